@@ -21,6 +21,46 @@ contract MutatingExtensionContract {
 // Version 3 of the backpack system. This tries to make the cost of trading not
 // depend on the number of attributes on an item.
 contract Backpack {
+  // --------------------------------------------------------------------------
+  // Part 0: Events
+  //
+  // Every change to items and the schema is logged, so that off chain
+  // services can mirror the backpacks by replaying the logs (see
+  // backpack_indexer.py) instead of calling into the contract per item.
+
+  // |packed| is the new item's packed word, laid out as described after
+  // ItemInstance. The item starts out under construction.
+  event ItemCreated(uint64 indexed item_id, address indexed owner,
+                    uint256 packed);
+  event ItemFinalized(uint64 indexed item_id);
+
+  // The item |old_id| was reopened for modification as |new_id|, and is
+  // under construction again.
+  event ItemReopened(uint64 indexed old_id, uint64 indexed new_id);
+
+  // The item |old_id| was given to |recipient| as |new_id|.
+  event ItemMoved(uint64 indexed old_id, uint64 indexed new_id,
+                  address indexed recipient);
+  event ItemDeleted(uint64 indexed item_id);
+
+  event IntAttributeSet(uint64 indexed item_id, uint32 indexed defindex,
+                        uint64 value);
+  event IntAttributeRemoved(uint64 indexed item_id, uint32 indexed defindex);
+
+  event AttributeSet(uint32 indexed defindex, bytes32 name, bytes32 value);
+  event AttributeModifiableSet(uint32 indexed defindex, bool modifiable);
+  event ItemSchemaSet(uint32 indexed defindex, uint8 min_level,
+                      uint8 max_level, address use_contract);
+  event SchemaIntAttributeSet(uint32 indexed item_defindex,
+                              uint32 indexed attribute_defindex,
+                              uint64 value);
+  event SchemaIntAttributeRemoved(uint32 indexed item_defindex,
+                                  uint32 indexed attribute_defindex);
+  event SchemaVersionSet(bytes32 version);
+
+  // The action |name| now runs |recipe|, or was removed if |recipe| is 0.
+  event ActionSet(bytes32 name, address recipe);
+
   // --------------------------------------------------------------------------
   // Part 1: Users and Permissions
   //
@@ -131,6 +171,30 @@ contract Backpack {
     return user_data[user].item_ids[i];
   }
 
+  // Returns up to |count| of |user|'s backpack slots starting at slot |start|,
+  // so a client can list a backpack a page at a time instead of with two calls
+  // per item. Each slot is packed into one word, from the low bits up: item id
+  // (64 bits), defindex (32), level (16), quality (16) and origin (16).
+  function GetBackpackPage(address user, uint32 start, uint32 count) constant
+      returns (uint256[] page) {
+    User u = user_data[user];
+    if (start >= u.backpack_length)
+      return;
+    if (count > u.backpack_length - start)
+      count = u.backpack_length - start;
+
+    page = new uint256[](count);
+    for (uint i = 0; i < count; ++i) {
+      uint64 item_id = u.item_ids[start + i];
+      uint256 packed = item_storage[all_items[item_id]].packed;
+      page[i] = uint256(item_id) |
+          uint256(DefindexOf(packed)) * 2**64 |
+          uint256(LevelOf(packed)) * 2**96 |
+          uint256(QualityOf(packed)) * 2**112 |
+          uint256(OriginOf(packed)) * 2**128;
+    }
+  }
+
   // --------------------------------------------------------------------------
   // Part 2: Attributes
   //
@@ -159,6 +223,7 @@ contract Backpack {
     if (all_attributes[defindex].defindex == 0)
       all_attributes[defindex].defindex = defindex;
     all_attributes[defindex].attribute_data[name] = value;
+    AttributeSet(defindex, name, value);
     return "OK";
   }
 
@@ -171,6 +236,31 @@ contract Backpack {
     if (all_attributes[defindex].defindex == 0)
       all_attributes[defindex].defindex = defindex;
     all_attributes[defindex].modifiable = modifiable;
+    AttributeModifiableSet(defindex, modifiable);
+    return "OK";
+  }
+
+  // Bulk version of SetAttribute: sets |name| to |values[i]| on attribute
+  // |defindexes[i]|. Nothing is set if any of the defindexes are invalid.
+  function SetAttributes(uint32[] defindexes, bytes32 name, bytes32[] values)
+      external returns (bytes32) {
+    if (!HasPermission(msg.sender, Permissions.ModifySchema))
+      return "Permission Denied";
+    if (defindexes.length != values.length)
+      return "Wrong number of arguments";
+    uint i;
+    for (i = 0; i < defindexes.length; ++i) {
+      if (defindexes[i] == 0)
+        return "Invalid Attribute";
+    }
+
+    for (i = 0; i < defindexes.length; ++i) {
+      AttributeDefinition a = all_attributes[defindexes[i]];
+      if (a.defindex == 0)
+        a.defindex = defindexes[i];
+      a.attribute_data[name] = values[i];
+      AttributeSet(defindexes[i], name, values[i]);
+    }
     return "OK";
   }
 
@@ -192,6 +282,16 @@ contract Backpack {
     bool modifiable;
   }
 
+  // The integer attributes of a SchemaItem or an ItemInstance. |values| keeps
+  // them enumerable, and |slot_for_defindex| finds one without a search.
+  struct IntegerAttributeSet {
+    IntegerAttribute[] values;
+
+    // Maps an attribute defindex to its index in |values| plus one, so that
+    // zero means the attribute isn't set.
+    mapping (uint32 => uint) slot_for_defindex;
+  }
+
   struct StringAttribute {
     // The attribute defindex;
     uint32 defindex;
@@ -211,7 +311,7 @@ contract Backpack {
     MutatingExtensionContract on_use_contract;
 
     // New values for this item.
-    IntegerAttribute[] int_attributes;
+    IntegerAttributeSet int_attributes;
     StringAttribute[] str_attributes;
   }
 
@@ -225,6 +325,26 @@ contract Backpack {
     schema.min_level = min_level;
     schema.max_level = max_level;
     schema.on_use_contract = MutatingExtensionContract(use_contract);
+    ItemSchemaSet(defindex, min_level, max_level, use_contract);
+    return "OK";
+  }
+
+  // Bulk version of SetItemSchema, for items which don't have a use contract.
+  function SetItemSchemas(uint32[] defindexes, uint8[] min_levels,
+                          uint8[] max_levels) external returns (bytes32) {
+    if (!HasPermission(msg.sender, Permissions.ModifySchema))
+      return "Permission Denied";
+    if (defindexes.length != min_levels.length ||
+        defindexes.length != max_levels.length)
+      return "Wrong number of arguments";
+
+    for (uint i = 0; i < defindexes.length; ++i) {
+      SchemaItem schema = item_schemas[defindexes[i]];
+      schema.min_level = min_levels[i];
+      schema.max_level = max_levels[i];
+      schema.on_use_contract = MutatingExtensionContract(0);
+      ItemSchemaSet(defindexes[i], min_levels[i], max_levels[i], 0);
+    }
     return "OK";
   }
 
@@ -244,9 +364,38 @@ contract Backpack {
 
     SchemaItem schema = item_schemas[item_defindex];
     SetIntAttributeImpl(schema.int_attributes, attribute_defindex, value);
+    SchemaIntAttributeSet(item_defindex, attribute_defindex, value);
     return "OK";
   }
 
+  function RemoveIntAttributeFromItemSchema(uint32 item_defindex,
+                                            uint32 attribute_defindex)
+      returns (bytes32) {
+    if (!HasPermission(msg.sender, Permissions.ModifySchema))
+      return "Permission Denied";
+
+    SchemaItem schema = item_schemas[item_defindex];
+    if (RemoveIntAttributeImpl(schema.int_attributes, attribute_defindex))
+      SchemaIntAttributeRemoved(item_defindex, attribute_defindex);
+    return "OK";
+  }
+
+  // The version of the schema which the item schemas and attributes on chain
+  // were last brought up to date with. The tools which upload the schema set
+  // this to the sha1 of the tf2_schema.json they uploaded.
+  function SetSchemaVersion(bytes32 version) returns (bytes32) {
+    if (!HasPermission(msg.sender, Permissions.ModifySchema))
+      return "Permission Denied";
+
+    schema_version = version;
+    SchemaVersionSet(version);
+    return "OK";
+  }
+
+  function GetSchemaVersion() constant returns (bytes32) {
+    return schema_version;
+  }
+
   // --------------------------------------------------------------------------
   // Part 3: Item Instances
   //
@@ -268,9 +417,10 @@ contract Backpack {
   // externally, which should be in the same numeric namespace as the rest of
   // Valve's item servers.
   struct ItemInstance {
-    // The current item id. This changes each time the item is modified or
-    // changes hands.
-    uint64 id;
+    // The item's small fields, packed into one word so that creating or
+    // reading an item touches one storage slot instead of one per field. The
+    // layout is described below.
+    uint256 packed;
 
     // This is the owner of this item.
     address owner;
@@ -279,33 +429,91 @@ contract Backpack {
     // be set by |owner|.
     address unlocked_for;
 
-    // The current state of this item. For items which are currently owned by
-    // someone, this is STATE_ITEM_EXISTS.
-    ItemState state;
+    // New values for this item.
+    IntegerAttributeSet int_attributes;
+    StringAttribute[] str_attributes;
+  }
 
-    // -- Why inline the next three uint16? To save space. All items have these
-    // three properties and the world works on unprincipled excpetions and
-    // hacks.
+  // The layout of ItemInstance.packed, from the low bits up:
+  //
+  //   id             64  The current item id. This changes each time the item
+  //                      is modified or changes hands.
+  //   original_id    64  The original id this item was created with.
+  //   defindex       32  The item type index.
+  //   level          16  An item's level. This is (usually) a pseudorandom
+  //                      number between 1-100 as defined by the item schema.
+  //                      However, in Mann vs Machine, the item level is set to
+  //                      a player's number of tours of duty, so it can be much
+  //                      larger, hence a 16 bit integer.
+  //   quality        16
+  //   origin         16
+  //   state           8  The current ItemState of this item. For items which
+  //                      are currently owned by someone, this is ITEM_EXISTS.
+  //   backpack_slot  32  Where this item's id is in its owner's item_ids, so
+  //                      it can be removed without searching the backpack.
+  //
+  // GetItemDataPacked() returns these words as is; item_layout.py decodes
+  // them.
+  uint256 constant kOriginalIdShift = 2**64;
+  uint256 constant kDefindexShift = 2**128;
+  uint256 constant kLevelShift = 2**160;
+  uint256 constant kQualityShift = 2**176;
+  uint256 constant kOriginShift = 2**192;
+  uint256 constant kStateShift = 2**208;
+  uint256 constant kBackpackSlotShift = 2**216;
 
-    // An item's level. This is (usually) a pseudorandom number between 1-100
-    // as defined by the item schema. However, in Mann vs Machine, the item
-    // level is set to a player's number of tours of duty, so it can be much
-    // larger, hence a 16 bit integer.
-    uint16 level;
-    uint16 quality;
-    uint16 origin;
+  function IdOf(uint256 packed) private constant returns (uint64) {
+    return uint64(packed);
+  }
 
-    // -- End unprincipled exceptions.
+  function OriginalIdOf(uint256 packed) private constant returns (uint64) {
+    return uint64(packed / kOriginalIdShift);
+  }
 
-    // The item type index.
-    uint32 defindex;
+  function DefindexOf(uint256 packed) private constant returns (uint32) {
+    return uint32(packed / kDefindexShift);
+  }
 
-    // The original id this item was created with.
-    uint64 original_id;
+  function LevelOf(uint256 packed) private constant returns (uint16) {
+    return uint16(packed / kLevelShift);
+  }
 
-    // New values for this item.
-    IntegerAttribute[] int_attributes;
-    StringAttribute[] str_attributes;
+  function QualityOf(uint256 packed) private constant returns (uint16) {
+    return uint16(packed / kQualityShift);
+  }
+
+  function OriginOf(uint256 packed) private constant returns (uint16) {
+    return uint16(packed / kOriginShift);
+  }
+
+  function StateOf(uint256 packed) private constant returns (ItemState) {
+    return ItemState(uint8(packed / kStateShift));
+  }
+
+  function BackpackSlotOf(uint256 packed) private constant returns (uint32) {
+    return uint32(packed / kBackpackSlotShift);
+  }
+
+  // Returns |packed| with the field at |shift|, which is |mask| wide, set to
+  // |value|.
+  function SetFieldImpl(uint256 packed, uint256 shift, uint256 mask,
+                        uint256 value) private constant returns (uint256) {
+    return (packed & ~(mask * shift)) | (value * shift);
+  }
+
+  function WithId(uint256 packed, uint64 id) private constant
+      returns (uint256) {
+    return SetFieldImpl(packed, 1, 0xFFFFFFFFFFFFFFFF, id);
+  }
+
+  function WithState(uint256 packed, ItemState state) private constant
+      returns (uint256) {
+    return SetFieldImpl(packed, kStateShift, 0xFF, uint256(state));
+  }
+
+  function WithBackpackSlot(uint256 packed, uint32 slot) private constant
+      returns (uint256) {
+    return SetFieldImpl(packed, kBackpackSlotShift, 0xFFFFFFFF, slot);
   }
 
   // Used to create new items. If the caller has permission to make new items,
@@ -364,6 +572,64 @@ contract Backpack {
                           msg.sender, level, original_id);
   }
 
+  // Bulk version of ImportItem, which also sets the int attributes on each
+  // item and finalizes it, so that a whole backpack can be imported in a
+  // handful of transactions instead of three per item.
+  //
+  // Each entry in |items| is a packed item. From the low bits up: 32 bits of
+  // defindex, 16 bits each of quality, origin and level, 64 bits of
+  // original_id, and 16 bits counting how many of the following entries in
+  // |attributes| belong to this item. Each entry in |attributes| packs a 32
+  // bit attribute defindex in the low bits with the 64 bit value above it.
+  //
+  // Item ids are handed out consecutively, so the ids of the new items are
+  // |first_id|, |first_id| + 2, etc. Returns 0 and creates nothing if any of
+  // the items are invalid.
+  //
+  // (Requires Permissions.GrantItems and Permissions.AddAttributesToItem.)
+  function ImportItems(uint256[] items, uint256[] attributes,
+                       address recipient) external
+      returns (uint64 first_id) {
+    if (!HasPermission(msg.sender, Permissions.GrantItems) ||
+        !HasPermission(msg.sender, Permissions.AddAttributesToItem))
+      return 0;
+
+    // Validate the whole batch up front so a bad entry can't leave half of
+    // the batch imported.
+    uint i;
+    uint attribute_count = 0;
+    for (i = 0; i < items.length; ++i) {
+      if (item_schemas[uint32(items[i])].min_level == 0)
+        return 0;
+      attribute_count += uint16(items[i] / 2**144);
+    }
+    if (attribute_count != attributes.length)
+      return 0;
+
+    uint a = 0;
+    for (i = 0; i < items.length; ++i) {
+      uint256 packed = items[i];
+      uint64 item_id = CreateItemImpl(uint32(packed),
+                                      uint16(packed / 2**32) /* quality */,
+                                      uint16(packed / 2**48) /* origin */,
+                                      recipient,
+                                      0 /* unlocked_for */,
+                                      uint16(packed / 2**64) /* level */,
+                                      uint64(packed / 2**80));
+      if (i == 0)
+        first_id = item_id;
+
+      ItemInstance item = item_storage[all_items[item_id]];
+      uint end = a + uint16(packed / 2**144);
+      for (; a < end; ++a) {
+        SetItemIntAttributeImpl(item, item_id, uint32(attributes[a]),
+                                uint64(attributes[a] / 2**32));
+      }
+      item.packed = WithState(item.packed, ItemState.ITEM_EXISTS);
+      ItemFinalized(item_id);
+    }
+  }
+
   // When |item_id| exists, and the item is unlocked for the caller, create a
   // new item number for this item, put it in the under construction state, and
   // return it. Otherwise returns 0.
@@ -378,24 +644,21 @@ contract Backpack {
       return 0;
 
     ItemInstance item = item_storage[internal_id];
-    if (item.state == ItemState.ITEM_EXISTS &&
+    uint256 packed = item.packed;
+    if (StateOf(packed) == ItemState.ITEM_EXISTS &&
         (item.owner == msg.sender || item.unlocked_for == msg.sender)) {
       EnsureLockedImpl(internal_id, item_id);
 
       delete all_items[item_id];
+      past_ids[item_id] = internal_id;
 
       uint64 new_item_id = GetNextItemID();
-      item.id = new_item_id;
-      item.state = ItemState.UNDER_CONSTRUCTION;
+      item.packed = WithState(WithId(packed, new_item_id),
+                              ItemState.UNDER_CONSTRUCTION);
       all_items[new_item_id] = internal_id;
 
-      User u = user_data[item.owner];
-      for (uint32 i = 0; i < u.backpack_length; ++i) {
-        if (u.item_ids[i] == item_id) {
-          u.item_ids[i] = new_item_id;
-          break;
-        }
-      }
+      user_data[item.owner].item_ids[BackpackSlotOf(packed)] = new_item_id;
+      ItemReopened(item_id, new_item_id);
 
       // Because we locked the item before, we now unlock the new item for the
       // sender.
@@ -422,33 +685,49 @@ contract Backpack {
       return 0;
 
     ItemInstance item = item_storage[internal_id];
-    if (item.state == ItemState.ITEM_EXISTS &&
+    if (StateOf(item.packed) == ItemState.ITEM_EXISTS &&
         (item.owner == msg.sender || item.unlocked_for == msg.sender)) {
-      EnsureLockedImpl(internal_id, item_id);
-
-      // Clean up references to the previous |item_id|.
-      RemoveItemIdFromBackpackImpl(item_id, item.owner);
-      delete all_items[item_id];
-
-      // Clean up modifiable attributes.
-      uint i = 0;
-      for (i = 0; i < item.int_attributes.length; ++i) {
-        IntegerAttribute attr = item.int_attributes[i];
-        if (attr.modifiable)
-          attr.value = 0;
-      }
-
-      uint64 new_item_id = GetNextItemID();
-      item.id = new_item_id;
-      item.owner = recipient;
-      all_items[new_item_id] = internal_id;
-      AddItemIdToBackpackImpl(new_item_id, recipient);
-      return new_item_id;
+      return MoveItemImpl(internal_id, item_id, recipient);
     }
 
     return 0;
   }
 
+  // Swaps |one_items|, owned by |user_one|, for |two_items|, owned by
+  // |user_two|, in one call. The whole exchange is validated before any item
+  // moves: every item must exist, belong to the right user and be givable by
+  // the caller, both users must accept items, and both backpacks must have
+  // room for what they receive. Returns "OK", or why nothing was moved.
+  //
+  // (May only be called by the items' owners or unlocked_for.)
+  function ExchangeItems(address user_one, uint64[] one_items,
+                         address user_two, uint64[] two_items)
+      returns (bytes32) {
+    if (user_one == user_two)
+      return "Invalid exchange";
+    if (!CanExchangeImpl(user_one, one_items) ||
+        !CanExchangeImpl(user_two, two_items))
+      return "Can't give item";
+    if (!AllowsItemsReceived(user_one) || !AllowsItemsReceived(user_two))
+      return "Items not accepted";
+    if (!HasRoomForImpl(user_one, one_items.length, two_items.length) ||
+        !HasRoomForImpl(user_two, two_items.length, one_items.length))
+      return "Backpack full";
+
+    // Every item leaves its owner's backpack before any arrives, so neither
+    // backpack ever holds more than its final size.
+    uint i;
+    for (i = 0; i < one_items.length; ++i)
+      RemoveItemIdFromBackpackImpl(all_items[one_items[i]], user_one);
+    for (i = 0; i < two_items.length; ++i)
+      RemoveItemIdFromBackpackImpl(all_items[two_items[i]], user_two);
+    for (i = 0; i < one_items.length; ++i)
+      HandOverItemImpl(all_items[one_items[i]], one_items[i], user_two);
+    for (i = 0; i < two_items.length; ++i)
+      HandOverItemImpl(all_items[two_items[i]], two_items[i], user_one);
+    return "OK";
+  }
+
   // Adds an integer attribute to an item in the under construction state.
   //
   // (Requires Permissions.AddAttributesToItem.)
@@ -460,10 +739,10 @@ contract Backpack {
       return;
 
     ItemInstance item = item_storage[internal_id];
-    if (item.state == ItemState.UNDER_CONSTRUCTION &&
+    if (StateOf(item.packed) == ItemState.UNDER_CONSTRUCTION &&
         HasPermission(msg.sender, Permissions.AddAttributesToItem) &&
         (item.owner == msg.sender || item.unlocked_for == msg.sender)) {
-      SetIntAttributeImpl(item.int_attributes, attribute_defindex, value);
+      SetItemIntAttributeImpl(item, item_id, attribute_defindex, value);
     }
   }
 
@@ -478,11 +757,11 @@ contract Backpack {
       return;
 
     ItemInstance item = item_storage[internal_id];
-    if (item.state == ItemState.UNDER_CONSTRUCTION &&
+    if (StateOf(item.packed) == ItemState.UNDER_CONSTRUCTION &&
         HasPermission(msg.sender, Permissions.AddAttributesToItem) &&
         (item.owner == msg.sender || item.unlocked_for == msg.sender)) {
       for (uint i = 0; i < keys.length; ++i) {
-        SetIntAttributeImpl(item.int_attributes, keys[i], values[i]);
+        SetItemIntAttributeImpl(item, item_id, keys[i], values[i]);
       }
     }
   }
@@ -493,7 +772,7 @@ contract Backpack {
       return;
 
     ItemInstance item = item_storage[internal_id];
-    if (item.state == ItemState.UNDER_CONSTRUCTION &&
+    if (StateOf(item.packed) == ItemState.UNDER_CONSTRUCTION &&
         HasPermission(msg.sender, Permissions.AddAttributesToItem) &&
         (item.owner == msg.sender || item.unlocked_for == msg.sender)) {
       // Verify that attribute_defindex is defined.
@@ -501,22 +780,8 @@ contract Backpack {
       if (a.defindex != attribute_defindex)
         return;
 
-      // Iterate through all the items and change the value if we already see a
-      // value for this defindex.
-      uint i = 0;
-      uint last = item.int_attributes.length - 1;
-      for (i = 0; i < item.int_attributes.length; ++i) {
-        IntegerAttribute attr = item.int_attributes[i];
-        if (attr.defindex == attribute_defindex) {
-          // If we are not the last item in the list, we copy the last item in
-          // the list to where we are so we don't have holes.
-          if (i != last)
-            attr = item.int_attributes[last];
-
-          item.int_attributes.length--;
-          return;
-        }
-      }
+      if (RemoveIntAttributeImpl(item.int_attributes, attribute_defindex))
+        IntAttributeRemoved(item_id, attribute_defindex);
     }
   }
 
@@ -528,10 +793,11 @@ contract Backpack {
       return;
 
     ItemInstance item = item_storage[internal_id];
-    if (item.state == ItemState.UNDER_CONSTRUCTION &&
+    if (StateOf(item.packed) == ItemState.UNDER_CONSTRUCTION &&
         (item.owner == msg.sender || item.unlocked_for == msg.sender)) {
       EnsureLockedImpl(internal_id, item_id);
-      item.state = ItemState.ITEM_EXISTS;
+      item.packed = WithState(item.packed, ItemState.ITEM_EXISTS);
+      ItemFinalized(item_id);
     }
   }
 
@@ -544,7 +810,8 @@ contract Backpack {
       return;
 
     ItemInstance item = item_storage[internal_id];
-    if (item.state == ItemState.ITEM_EXISTS && item.owner == msg.sender)
+    if (StateOf(item.packed) == ItemState.ITEM_EXISTS &&
+        item.owner == msg.sender)
       EnsureUnlockedImpl(internal_id, item_id, user);
   }
 
@@ -575,11 +842,12 @@ contract Backpack {
     if (item.owner == msg.sender || item.unlocked_for == msg.sender) {
       EnsureLockedImpl(internal_id, item_id);
 
-      RemoveItemIdFromBackpackImpl(item_id, item.owner);
+      RemoveItemIdFromBackpackImpl(internal_id, item.owner);
 
       // Delete the actual item.
       delete item_storage[internal_id];
       delete all_items[item_id];
+      ItemDeleted(item_id);
     }
   }
 
@@ -591,12 +859,70 @@ contract Backpack {
       return;
 
     ItemInstance item = item_storage[internal_id];
-    defindex = item.defindex;
+    uint256 packed = item.packed;
+    defindex = DefindexOf(packed);
     owner = item.owner;
-    level = item.level;
-    quality = item.quality;
-    origin = item.origin;
-    original_id = item.original_id;
+    level = LevelOf(packed);
+    quality = QualityOf(packed);
+    origin = OriginOf(packed);
+    original_id = OriginalIdOf(packed);
+  }
+
+  // Returns the current id of the item which once had the id |item_id| on
+  // chain, or 0 if there's no such item or it has since been deleted. Ids
+  // which are current resolve to themselves.
+  function ResolveItemId(uint64 item_id) constant returns (uint64) {
+    if (all_items[item_id] != 0)
+      return item_id;
+
+    uint256 internal_id = past_ids[item_id];
+    if (internal_id == 0)
+      return 0;
+    return IdOf(item_storage[internal_id].packed);
+  }
+
+  // Bulk version of ResolveItemId.
+  function ResolveItemIds(uint64[] item_ids) constant
+      returns (uint64[] current_ids) {
+    current_ids = new uint64[](item_ids.length);
+    for (uint i = 0; i < item_ids.length; ++i)
+      current_ids[i] = ResolveItemId(item_ids[i]);
+  }
+
+  // Returns the current id of the item most recently imported with the off
+  // chain |original_id|, or 0 if there's no such item or it has since been
+  // deleted. Off chain ids can equal chain ids, so they're looked up here
+  // rather than by ResolveItemId.
+  function ResolveOriginalId(uint64 original_id) constant returns (uint64) {
+    uint256 internal_id = imported_ids[original_id];
+    if (internal_id == 0)
+      return 0;
+    return IdOf(item_storage[internal_id].packed);
+  }
+
+  // Bulk version of ResolveOriginalId.
+  function ResolveOriginalIds(uint64[] original_ids) constant
+      returns (uint64[] current_ids) {
+    current_ids = new uint64[](original_ids.length);
+    for (uint i = 0; i < original_ids.length; ++i)
+      current_ids[i] = ResolveOriginalId(original_ids[i]);
+  }
+
+  // Bulk version of GetItemData. Returns the packed word of each item, laid
+  // out as described after ItemInstance, and its owner. Items which don't
+  // exist come back as zeros.
+  function GetItemDataPacked(uint64[] item_ids) constant
+      returns (uint256[] items, address[] owners) {
+    items = new uint256[](item_ids.length);
+    owners = new address[](item_ids.length);
+    for (uint i = 0; i < item_ids.length; ++i) {
+      uint256 internal_id = all_items[item_ids[i]];
+      if (internal_id != 0) {
+        ItemInstance item = item_storage[internal_id];
+        items[i] = item.packed;
+        owners[i] = item.owner;
+      }
+    }
   }
 
   function GetItemDefindex(uint64 item_id) constant returns (uint32) {
@@ -604,8 +930,7 @@ contract Backpack {
     if (internal_id == 0)
       return;
 
-    ItemInstance item = item_storage[internal_id];
-    return item.defindex;
+    return DefindexOf(item_storage[internal_id].packed);
   }
 
   function GetItemLength(uint64 item_id) constant returns (uint256 count) {
@@ -614,7 +939,7 @@ contract Backpack {
       return;
 
     ItemInstance item = item_storage[internal_id];
-    return item.int_attributes.length;
+    return item.int_attributes.values.length;
   }
 
   function GetItemOwner(uint64 item_id) constant returns (address owner) {
@@ -632,7 +957,7 @@ contract Backpack {
       return false;
 
     ItemInstance item = item_storage[internal_id];
-    return item.state == ItemState.ITEM_EXISTS &&
+    return StateOf(item.packed) == ItemState.ITEM_EXISTS &&
         (item.owner == msg.sender || item.unlocked_for == msg.sender);
   }
 
@@ -642,25 +967,17 @@ contract Backpack {
     if (internal_id == 0)
       return;
 
-    // Iterate through all the items and change the value if we already see a
-    // value for this defindex.
     ItemInstance item = item_storage[internal_id];
-    for (uint i = 0; i < item.int_attributes.length; ++i) {
-      IntegerAttribute attr = item.int_attributes[i];
-      if (attr.defindex == defindex) {
-        return attr.value;
-      }
-    }
+    uint slot = item.int_attributes.slot_for_defindex[defindex];
+    if (slot != 0)
+      return item.int_attributes.values[slot - 1].value;
 
     // The item might have an attribute as part of its schema, which we fall
     // back on when we don't have an explicit value set.
-    SchemaItem schema = item_schemas[item.defindex];
-    for (i = 0; i < schema.int_attributes.length; ++i) {
-      attr = schema.int_attributes[i];
-      if (attr.defindex == defindex) {
-        return attr.value;
-      }
-    }
+    SchemaItem schema = item_schemas[DefindexOf(item.packed)];
+    slot = schema.int_attributes.slot_for_defindex[defindex];
+    if (slot != 0)
+      return schema.int_attributes.values[slot - 1].value;
 
     return 0;
   }
@@ -686,6 +1003,7 @@ contract Backpack {
       return;
 
     actions[name] = recipe;
+    ActionSet(name, recipe);
   }
 
   function DoAction(bytes32 name, uint64[] item_ids)
@@ -714,21 +1032,21 @@ contract Backpack {
     if (internal_id == 0)
       return;
 
-    // Iterate through all the attributes on the item and add the amount if
-    // the referenced attribute exists and is modifiable.
+    // Add the amount if the referenced attribute exists on the item and is
+    // modifiable.
     ItemInstance item = item_storage[internal_id];
-    uint i = 0;
-    for (i = 0; i < item.int_attributes.length; ++i) {
-      IntegerAttribute attr = item.int_attributes[i];
-      if (attr.defindex == attribute_defindex &&
-          attr.modifiable) {
-        attr.value = attr.value + amount;
-        return;
-      }
+    uint slot = item.int_attributes.slot_for_defindex[attribute_defindex];
+    if (slot == 0) {
+      // AddToModifiable can only be used to modify existing attributes.
+      // Invalid input.
+      return;
     }
 
-    // AddToModifiable can only be used to modify existing attributes. Invalid
-    // input.
+    IntegerAttribute attr = item.int_attributes.values[slot - 1];
+    if (attr.modifiable) {
+      attr.value = attr.value + amount;
+      IntAttributeSet(item_id, attribute_defindex, attr.value);
+    }
   }
 
   // --------------------------------------------------------------------------
@@ -749,82 +1067,195 @@ contract Backpack {
     uint256 next_internal_id = item_storage.length;
     item_storage.length++;
     ItemInstance item =  item_storage[next_internal_id];
-    item.id = item_id;
     item.owner = recipient;
-    item.unlocked_for = unlocked_for;
-    item.state = ItemState.UNDER_CONSTRUCTION;
-    item.level = level;
-    item.quality = quality;
-    item.origin = origin;
-    item.defindex = defindex;
+    if (unlocked_for != 0)
+      item.unlocked_for = unlocked_for;
+    // Imported items keep their off chain id. Items made here have their own
+    // id as their original id, and already resolve by it.
     if (original_id == 0)
-      item.original_id = item_id;
+      original_id = item_id;
     else
-      item.original_id = original_id;
+      imported_ids[original_id] = next_internal_id;
 
-    all_items[item_id] = next_internal_id;
+    // Note that CreateNewItem always succeeds, up to the item limit. Claim
+    // the next backpack slot here so the packed word is written once.
+    User u = user_data[recipient];
+    uint32 slot = u.backpack_length;
+    u.item_ids[slot] = item_id;
+    u.backpack_length++;
 
-    // Note that CreateNewItem always succeeds, up to the item limit.
-    AddItemIdToBackpackImpl(item_id, recipient);
+    item.packed = uint256(item_id) |
+        uint256(original_id) * kOriginalIdShift |
+        uint256(defindex) * kDefindexShift |
+        uint256(level) * kLevelShift |
+        uint256(quality) * kQualityShift |
+        uint256(origin) * kOriginShift |
+        uint256(ItemState.UNDER_CONSTRUCTION) * kStateShift |
+        uint256(slot) * kBackpackSlotShift;
+
+    all_items[item_id] = next_internal_id;
+    ItemCreated(item_id, recipient, item.packed);
 
     // The item is left unfinalized and unlocked for the creator to possibly
     // add attributes and effects.
     return item_id;
   }
 
-  function SetIntAttributeImpl(IntegerAttribute[] storage int_attributes,
+  function SetIntAttributeImpl(IntegerAttributeSet storage int_attributes,
                                uint32 attribute_defindex,
-                               uint64 value) private {
+                               uint64 value) private returns (bool) {
     // Verify that attribute_defindex is defined.
     AttributeDefinition a = all_attributes[attribute_defindex];
     if (a.defindex != attribute_defindex)
-      return;
+      return false;
 
-    // Iterate through all the items and change the value if we already see a
-    // value for this defindex.
-    uint i = 0;
-    for (i = 0; i < int_attributes.length; ++i) {
-      IntegerAttribute attr = int_attributes[i];
-      if (attr.defindex == attribute_defindex) {
-        attr.value = value;
-        attr.modifiable = a.modifiable;
-        return;
-      }
+    uint slot = int_attributes.slot_for_defindex[attribute_defindex];
+    if (slot == 0) {
+      // We didn't find a preexisting attribute. Add one.
+      int_attributes.values.length++;
+      slot = int_attributes.values.length;
+      int_attributes.slot_for_defindex[attribute_defindex] = slot;
+      int_attributes.values[slot - 1].defindex = attribute_defindex;
     }
 
-    // We didn't find a preexisting attribute. Add one.
-    int_attributes.length++;
-    attr = int_attributes[int_attributes.length - 1];
-    attr.defindex = attribute_defindex;
+    IntegerAttribute attr = int_attributes.values[slot - 1];
     attr.value = value;
     attr.modifiable = a.modifiable;
+    return true;
   }
 
-  function AddItemIdToBackpackImpl(uint64 item_id, address recipient) private {
+  // SetIntAttributeImpl for the item |item_id|, logging the change.
+  function SetItemIntAttributeImpl(ItemInstance storage item, uint64 item_id,
+                                   uint32 attribute_defindex, uint64 value)
+      private {
+    if (SetIntAttributeImpl(item.int_attributes, attribute_defindex, value))
+      IntAttributeSet(item_id, attribute_defindex, value);
+  }
+
+  function RemoveIntAttributeImpl(IntegerAttributeSet storage int_attributes,
+                                  uint32 attribute_defindex) private
+      returns (bool) {
+    uint slot = int_attributes.slot_for_defindex[attribute_defindex];
+    if (slot == 0)
+      return false;
+
+    // If we are not the last item in the list, we copy the last item in the
+    // list to where we are so we don't have holes.
+    uint last = int_attributes.values.length;
+    if (slot != last) {
+      IntegerAttribute attr = int_attributes.values[slot - 1];
+      IntegerAttribute last_attr = int_attributes.values[last - 1];
+      attr.defindex = last_attr.defindex;
+      attr.value = last_attr.value;
+      attr.modifiable = last_attr.modifiable;
+      int_attributes.slot_for_defindex[attr.defindex] = slot;
+    }
+
+    delete int_attributes.slot_for_defindex[attribute_defindex];
+    int_attributes.values.length--;
+    return true;
+  }
+
+  // Moves the existing item |item_id| to |recipient|'s backpack, giving it a
+  // new id, which is returned. The caller has already checked that the move is
+  // allowed.
+  function MoveItemImpl(uint256 internal_id, uint64 item_id,
+                        address recipient) private returns (uint64) {
+    RemoveItemIdFromBackpackImpl(internal_id, item_storage[internal_id].owner);
+    return HandOverItemImpl(internal_id, item_id, recipient);
+  }
+
+  // The rest of MoveItemImpl, for an item already taken out of its owner's
+  // backpack.
+  function HandOverItemImpl(uint256 internal_id, uint64 item_id,
+                            address recipient) private returns (uint64) {
+    EnsureLockedImpl(internal_id, item_id);
+
+    // Clean up references to the previous |item_id|.
+    ItemInstance item = item_storage[internal_id];
+    delete all_items[item_id];
+    past_ids[item_id] = internal_id;
+
+    uint64 new_item_id = GetNextItemID();
+    item.packed = WithId(item.packed, new_item_id);
+    item.owner = recipient;
+    all_items[new_item_id] = internal_id;
+    AddItemIdToBackpackImpl(internal_id, recipient);
+    ItemMoved(item_id, new_item_id, recipient);
+
+    // Clean up modifiable attributes.
+    for (uint i = 0; i < item.int_attributes.values.length; ++i) {
+      IntegerAttribute attr = item.int_attributes.values[i];
+      if (attr.modifiable) {
+        attr.value = 0;
+        IntAttributeSet(new_item_id, attr.defindex, 0);
+      }
+    }
+    return new_item_id;
+  }
+
+  // Whether every item in |item_ids| exists, is owned by |owner|, may be
+  // given away by the caller, and appears only once.
+  function CanExchangeImpl(address owner, uint64[] item_ids) private
+      constant returns (bool) {
+    for (uint i = 0; i < item_ids.length; ++i) {
+      uint256 internal_id = all_items[item_ids[i]];
+      if (internal_id == 0)
+        return false;
+
+      ItemInstance item = item_storage[internal_id];
+      if (StateOf(item.packed) != ItemState.ITEM_EXISTS ||
+          item.owner != owner ||
+          (owner != msg.sender && item.unlocked_for != msg.sender))
+        return false;
+
+      for (uint j = 0; j < i; ++j) {
+        if (item_ids[j] == item_ids[i])
+          return false;
+      }
+    }
+    return true;
+  }
+
+  // Whether |user| has room to receive |received| items while giving away
+  // |given|. Users who end up with fewer items always have room.
+  function HasRoomForImpl(address user, uint given, uint received) private
+      constant returns (bool) {
+    if (received <= given)
+      return true;
+    User u = user_data[user];
+    return u.backpack_length + received - given <= u.backpack_capacity;
+  }
+
+  function AddItemIdToBackpackImpl(uint256 internal_id, address recipient)
+      private {
+    ItemInstance item = item_storage[internal_id];
     User u = user_data[recipient];
-    u.item_ids[u.backpack_length] = item_id;
+    uint256 packed = item.packed;
+    item.packed = WithBackpackSlot(packed, u.backpack_length);
+    u.item_ids[u.backpack_length] = IdOf(packed);
     u.backpack_length++;
   }
 
-  function RemoveItemIdFromBackpackImpl(uint64 item_id, address owner) private {
-    // Walk the owners backpack, looking for the reference to the item. When we
-    // find it, remove it.
+  function RemoveItemIdFromBackpackImpl(uint256 internal_id, address owner)
+      private {
+    uint256 packed = item_storage[internal_id].packed;
     User u = user_data[owner];
-    for (uint32 i = 0; i < u.backpack_length; ++i) {
-      if (u.item_ids[i] == item_id) {
-        if (i == u.backpack_length - 1) {
-          // We are the last item in the item list.
-          u.item_ids[i] = 0;
-        } else {
-          // We take the last item in the backpack list and move it here
-          u.item_ids[i] = u.item_ids[u.backpack_length - 1];
-          u.item_ids[u.backpack_length - 1] = 0;
-        }
-
-        u.backpack_length--;
-        break;
-      }
+    uint32 slot = BackpackSlotOf(packed);
+    if (slot >= u.backpack_length || u.item_ids[slot] != IdOf(packed))
+      return;
+
+    uint32 last = u.backpack_length - 1;
+    if (slot != last) {
+      // We take the last item in the backpack list and move it here
+      uint64 moved_id = u.item_ids[last];
+      u.item_ids[slot] = moved_id;
+      ItemInstance moved = item_storage[all_items[moved_id]];
+      moved.packed = WithBackpackSlot(moved.packed, slot);
     }
+
+    u.item_ids[last] = 0;
+    u.backpack_length--;
   }
 
   function DoActionImpl(address owner, uint64[] item_ids, address action)
@@ -901,12 +1332,25 @@ contract Backpack {
   // Maps item defindex to the schema definition.
   mapping (uint32 => SchemaItem) private item_schemas;
 
+  // The sha1 of the tf2_schema.json the schema was last uploaded from.
+  bytes32 private schema_version;
+
   // 0 indexed storage of items.
   ItemInstance[] private item_storage;
 
   // Maps item ids to internal storage ids.
   mapping (uint64 => uint256) private all_items;
 
+  // Maps the ids items no longer have to internal storage ids, so stale ids
+  // can be resolved to current ones without a search. Deleted items keep
+  // their entries; their storage is zeroed, so they resolve to 0.
+  mapping (uint64 => uint256) private past_ids;
+
+  // Maps the off chain original ids of imported items to internal storage
+  // ids, the same way. These are kept apart from |past_ids| because an off
+  // chain id can be any number, including one already used on chain.
+  mapping (uint64 => uint256) private imported_ids;
+
   // Extension contracts.
   mapping (bytes32 => address) private actions;
 }
@@ -1028,49 +1472,16 @@ contract TradeCoordinator {
   }
 
   function AcceptTrade(uint256 trade_id) {
-    Trade t = trades[trade_id];
-    if (msg.sender != t.user_two)
-      return;
-
-    // We need to recheck the validity of the trade before we accept it.
-    uint i;
-    for (i = 0; i < t.user_one_items.length; ++i) {
-      if (backpack.CanGiveItem(t.user_one_items[i]) != true) {
-        DeleteTradeImpl(trade_id);
-        return;
-      }
-    }
-    for (i = 0; i < t.user_two_items.length; ++i) {
-      if (backpack.CanGiveItem(t.user_two_items[i]) != true) {
-        DeleteTradeImpl(trade_id);
-        return;
-      }
-    }
-
-    if (!backpack.AllowsItemsReceived(t.user_one) ||
-        !backpack.AllowsItemsReceived(t.user_two)) {
-      DeleteTradeImpl(trade_id);
-      return;
-    }
+    AcceptTradeImpl(trade_id);
+  }
 
-    // There's a whole lot of validity checking stuff that needs to be done
-    //  here for a real implementation. (Like whether the items will fit in
-    //  each user's backpack.)  This loop swaps items back and forth. It is
-    //  still not the most optimized implementation and does not deal with the
-    //  case where both backpacks are full. However, it is good enough for
-    //  demonstration purposes.
-
-    uint length = t.user_one_items.length;
-    if (t.user_two_items.length > length)
-      length = t.user_two_items.length;
-    for (i = 0; i < length; ++i) {
-      if (i < t.user_one_items.length)
-        backpack.GiveItemTo(t.user_one_items[i], t.user_two);
-      if (i < t.user_two_items.length)
-        backpack.GiveItemTo(t.user_two_items[i], t.user_one);
+  // Settles each of |trade_ids| which was proposed to the sender, in one
+  // transaction. Returns how many trades went through.
+  function AcceptTrades(uint256[] trade_ids) returns (uint accepted) {
+    for (uint i = 0; i < trade_ids.length; ++i) {
+      if (AcceptTradeImpl(trade_ids[i]))
+        accepted++;
     }
-
-    DeleteTradeImpl(trade_id);
   }
 
   function RejectTrade(uint256 trade_id) {
@@ -1086,6 +1497,20 @@ contract TradeCoordinator {
     trades.length = 1;
   }
 
+  function AcceptTradeImpl(uint256 trade_id) private returns (bool) {
+    Trade t = trades[trade_id];
+    if (msg.sender != t.user_two)
+      return false;
+
+    // Backpack rechecks the whole trade, including whether the items will fit
+    // in each user's backpack, before it moves anything. Invalid trades are
+    // dropped.
+    bytes32 result = backpack.ExchangeItems(t.user_one, t.user_one_items,
+                                            t.user_two, t.user_two_items);
+    DeleteTradeImpl(trade_id);
+    return result == "OK";
+  }
+
   function DeleteTradeImpl(uint256 trade_id) private {
     Trade t = trades[trade_id];
     delete t.user_one_items;
@@ -1115,6 +1540,16 @@ contract Crate is MutatingExtensionContract {
     address user;
   }
 
+  // The rolls precommitted to one block.
+  struct BlockRolls {
+    // The roll ids which haven't been uncrated by PerformUncrates() yet.
+    uint[] roll_ids;
+
+    // How many rolls are still open. Single PerformUncrate() calls don't
+    // remove their id from |roll_ids|, so this can be less than its length.
+    uint open;
+  }
+
   // Calling the crating contract through the UseItem interface will destroy
   // the key and the crate, and put a precommitment to roll two blocks into the
   // future.
@@ -1131,17 +1566,18 @@ contract Crate is MutatingExtensionContract {
       return "Incorrect items passed";
 
     uint blockheight = block.number + 2;
-    uint[] precommitments = precommitments_per_block_number[blockheight];
+    BlockRolls precommitments = precommitments_per_block_number[blockheight];
 
     uint roll_id = open_rolls.length++;
     RollID r = open_rolls[roll_id];
-    r.offset = precommitments.length;
+    r.offset = precommitments.roll_ids.length;
     r.blockheight = blockheight;
     r.user = backpack.GetItemOwner(item_ids[0]);
 
     // Add to the list of precommitments.
-    uint i = precommitments.length++;
-    precommitments[i] = roll_id;
+    uint i = precommitments.roll_ids.length++;
+    precommitments.roll_ids[i] = roll_id;
+    precommitments.open++;
 
     backpack.DeleteItem(item_ids[0]);
     backpack.DeleteItem(item_ids[1]);
@@ -1151,22 +1587,79 @@ contract Crate is MutatingExtensionContract {
 
   function PerformUncrate(uint roll_id) external returns (bytes32 message) {
     RollID r = open_rolls[roll_id];
-    if ((r.blockheight == 0) ||
-        (block.number < r.blockheight + 1) ||
-        (block.number > r.blockheight + 255 - 2)) {
+    uint blockheight = r.blockheight;
+    if (blockheight == 0 || !IsReadyImpl(blockheight))
       return "Wrong block height";
+
+    GrantRollImpl(r.user, GetRandom(blockheight, r.offset));
+    delete open_rolls[roll_id];
+
+    // Free the block's list once nothing in it is left open.
+    BlockRolls rolls = precommitments_per_block_number[blockheight];
+    rolls.open--;
+    if (rolls.open == 0)
+      delete precommitments_per_block_number[blockheight];
+    return "OK";
+  }
+
+  // Uncrates up to |max_rolls| of the rolls precommitted to |blockheight| in
+  // one transaction, deleting each roll as it goes and the block's list once
+  // it is empty. Every roll for a block draws on the same two block hashes,
+  // so those are only looked up once. Returns how many rolls were uncrated.
+  function PerformUncrates(uint blockheight, uint max_rolls)
+      external returns (uint uncrated) {
+    if (!IsReadyImpl(blockheight))
+      return 0;
+
+    bytes32 previous_hash = block.blockhash(blockheight - 1);
+    bytes32 hash = block.blockhash(blockheight);
+
+    BlockRolls rolls = precommitments_per_block_number[blockheight];
+    while (rolls.roll_ids.length > 0 && uncrated < max_rolls) {
+      uint roll_id = rolls.roll_ids[rolls.roll_ids.length - 1];
+      rolls.roll_ids.length--;
+
+      // Skip rolls which were already uncrated with PerformUncrate().
+      RollID r = open_rolls[roll_id];
+      if (r.blockheight == 0)
+        continue;
+
+      GrantRollImpl(r.user, RandomFromHashes(previous_hash, hash, r.offset));
+      delete open_rolls[roll_id];
+      rolls.open--;
+      uncrated++;
     }
 
-    uint roll = GetRandom(r.blockheight, r.offset) % 9;
-    uint64 new_id = backpack.CreateNewItem(item_ids[roll], 6, 8, r.user);
+    if (rolls.roll_ids.length == 0)
+      delete precommitments_per_block_number[blockheight];
+  }
+
+  // Whether the rolls for |blockheight| can be uncrated in this block.
+  function IsReadyImpl(uint blockheight) internal returns (bool) {
+    return block.number >= blockheight + 1 &&
+        block.number <= blockheight + 255 - 2;
+  }
+
+  function GrantRollImpl(address user, uint random) internal {
+    uint roll = random % 9;
+    uint64 new_id = backpack.CreateNewItem(item_ids[roll], 6, 8, user);
     backpack.FinalizeItem(new_id);
-    // TODO(drblue): delete r and remove from prpecommitments per block number.
-    return "OK";
   }
 
   function GetRandom(uint blockheight, uint offset)
       internal returns (uint random) {
-    return uint(sha256(block.blockhash(blockheight - 1), block.blockhash(blockheight), offset));
+    return RandomFromHashes(block.blockhash(blockheight - 1),
+                            block.blockhash(blockheight), offset);
+  }
+
+  function RandomFromHashes(bytes32 previous_hash, bytes32 hash, uint offset)
+      internal returns (uint random) {
+    return uint(sha256(previous_hash, hash, offset));
+  }
+
+  // The number of rolls precommitted to |blockheight| which are still open.
+  function GetOpenRollCount(uint blockheight) constant returns (uint) {
+    return precommitments_per_block_number[blockheight].open;
   }
 
   function Crate(Backpack system) {
@@ -1186,5 +1679,5 @@ contract Crate is MutatingExtensionContract {
   Backpack backpack;
   uint32[9] item_ids;
   RollID[] open_rolls;
-  mapping (uint => uint[]) precommitments_per_block_number;
+  mapping (uint => BlockRolls) precommitments_per_block_number;
 }
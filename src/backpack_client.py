@@ -0,0 +1,60 @@
+# Copyright 2015 Dr. Blue.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##############################################################################
+#
+# Helpers for reading a user's backpack off a Backpack contract.
+#
+# Backpack.GetBackpackPage() returns many slots per call, so listing a full
+# backpack takes one call for its length plus one per page, instead of two
+# calls per item. Likewise GetItemDataPacked() reads many items at once.
+
+from item_layout import UnpackItem
+
+# How many slots to ask for per call.
+kPageSize = 100
+
+
+# Unpacks one slot returned by GetBackpackPage().
+def UnpackBackpackSlot(packed):
+  return {
+      'id': packed & 0xFFFFFFFFFFFFFFFF,
+      'defindex': packed >> 64 & 0xFFFFFFFF,
+      'level': packed >> 96 & 0xFFFF,
+      'quality': packed >> 112 & 0xFFFF,
+      'origin': packed >> 128 & 0xFFFF,
+  }
+
+
+# Yields a dict for each slot of |user|'s backpack, in backpack order.
+def IterBackpack(contract, user, page_size=kPageSize):
+  length = contract.GetNumberOfItemsOwnedFor(user)
+  for start in range(0, length, page_size):
+    for packed in contract.GetBackpackPage(user, start, page_size):
+      yield UnpackBackpackSlot(packed)
+
+
+def GetBackpack(contract, user, page_size=kPageSize):
+  return list(IterBackpack(contract, user, page_size))
+
+
+# Returns a record, as decoded by item_layout.UnpackItem(), for each id in
+# |item_ids|. Items which don't exist have an id of 0.
+def GetItems(contract, item_ids, page_size=kPageSize):
+  records = []
+  for start in range(0, len(item_ids), page_size):
+    packed, owners = contract.GetItemDataPacked(
+        item_ids[start:start + page_size])
+    records.extend(UnpackItem(p, o) for p, o in zip(packed, owners))
+  return records
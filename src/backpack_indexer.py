@@ -0,0 +1,384 @@
+#!/usr/bin/python
+#
+# Copyright 2015 Dr. Blue.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##############################################################################
+#
+# Mirrors the items and schema of a Backpack contract into SQLite by replaying
+# the events it logs.
+#
+# Each Update() picks up where the last one stopped, so the mirror can be kept
+# current by calling it after every few blocks. The position is stored in the
+# database along with the mirror, so a file backed mirror survives restarts.
+# Reads then never touch the EVM:
+#
+#   indexer = BackpackIndexer(s, contract.address, 'mirror.sqlite')
+#   indexer.Update()
+#   indexer.Backpack(tester.a1)
+#   indexer.ItemsOfDefindex(5022)
+#
+# The mirror assumes the chain only grows. Reverting the chain to an earlier
+# snapshot leaves it describing the abandoned blocks; start a new one.
+
+import argparse
+import json
+import os
+import sqlite3
+import chain_state
+from ethereum import abi
+from item_layout import UnpackItem
+
+kSchema = """
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    original_id INTEGER,
+    defindex INTEGER,
+    level INTEGER,
+    quality INTEGER,
+    origin INTEGER,
+    state INTEGER,
+    owner TEXT);
+CREATE INDEX IF NOT EXISTS items_by_owner ON items (owner);
+CREATE INDEX IF NOT EXISTS items_by_defindex ON items (defindex);
+
+CREATE TABLE IF NOT EXISTS int_attributes (
+    item_id INTEGER,
+    defindex INTEGER,
+    value INTEGER,
+    PRIMARY KEY (item_id, defindex));
+
+CREATE TABLE IF NOT EXISTS attributes (
+    defindex INTEGER,
+    name BLOB,
+    value BLOB,
+    PRIMARY KEY (defindex, name));
+
+CREATE TABLE IF NOT EXISTS modifiable_attributes (
+    defindex INTEGER PRIMARY KEY,
+    modifiable INTEGER);
+
+CREATE TABLE IF NOT EXISTS actions (
+    name BLOB PRIMARY KEY,
+    recipe TEXT);
+
+CREATE TABLE IF NOT EXISTS item_schemas (
+    defindex INTEGER PRIMARY KEY,
+    min_level INTEGER,
+    max_level INTEGER,
+    use_contract TEXT);
+
+CREATE TABLE IF NOT EXISTS schema_int_attributes (
+    item_defindex INTEGER,
+    attribute_defindex INTEGER,
+    value INTEGER,
+    PRIMARY KEY (item_defindex, attribute_defindex));
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value);
+"""
+
+# The columns of the items table, in order.
+kItemColumns = ['id', 'original_id', 'defindex', 'level', 'quality',
+                'origin', 'state', 'owner']
+
+# ItemState values, as in Backpack.sol.
+kItemExists = 1
+kUnderConstruction = 2
+
+# Int attribute values are uint64s, but SQLite integers are signed, so values
+# are stored less 2^63. That keeps them in the same order.
+kValueOffset = 2 ** 63
+
+
+def _StoreValue(value):
+  return value - kValueOffset
+
+
+def _LoadValue(value):
+  return value + kValueOffset
+
+
+# Returns |address| as lowercase hex without a 0x prefix. Accepts the 20 byte
+# binary addresses the tester uses as well as hex.
+def NormalizeAddress(address):
+  if isinstance(address, (int, long)):
+    return '%040x' % address
+  if len(address) == 20:
+    return address.encode('hex')
+  if address.startswith('0x'):
+    address = address[2:]
+  return address.lower()
+
+
+# Reads the logs of a contract off an ethereum.tester chain, block by block.
+class TesterLogSource(object):
+  def __init__(self, s, address):
+    self.s = s
+    self.address = NormalizeAddress(address)
+
+  # Returns the blocks from number |first| up to the head, oldest first.
+  def _BlocksSince(self, first):
+    blocks = []
+    block = self.s.block
+    while block.number >= first:
+      blocks.append(block)
+      if block.number == 0:
+        break
+      block = block.get_parent()
+    blocks.reverse()
+    return blocks
+
+  # Returns (block number, receipt count) of the head, which is where the
+  # next call to Logs() should start once it has read everything.
+  def Head(self):
+    return self.s.block.number, len(self.s.block.get_receipts())
+
+  # Yields the contract's logs after the first |receipts| receipts of block
+  # |block_number|, up to the head.
+  def Logs(self, block_number, receipts):
+    for block in self._BlocksSince(block_number):
+      skip = receipts if block.number == block_number else 0
+      for receipt in block.get_receipts()[skip:]:
+        for log in receipt.logs:
+          if NormalizeAddress(log.address) == self.address:
+            yield log
+
+
+class BackpackIndexer(object):
+  def __init__(self, s, address, db_path=':memory:', build_dir='build',
+               source=None):
+    with open(os.path.join(build_dir, 'Backpack.abi')) as f:
+      self.translator = abi.ContractTranslator(json.load(f))
+    self.source = source or TesterLogSource(s, address)
+
+    self.db = sqlite3.connect(db_path)
+    self.db.executescript(kSchema)
+
+    self.handlers = {
+        'ItemCreated': self._OnItemCreated,
+        'ItemFinalized': self._OnItemFinalized,
+        'ItemReopened': self._OnItemReopened,
+        'ItemMoved': self._OnItemMoved,
+        'ItemDeleted': self._OnItemDeleted,
+        'IntAttributeSet': self._OnIntAttributeSet,
+        'IntAttributeRemoved': self._OnIntAttributeRemoved,
+        'AttributeSet': self._OnAttributeSet,
+        'AttributeModifiableSet': self._OnAttributeModifiableSet,
+        'ItemSchemaSet': self._OnItemSchemaSet,
+        'SchemaIntAttributeSet': self._OnSchemaIntAttributeSet,
+        'SchemaIntAttributeRemoved': self._OnSchemaIntAttributeRemoved,
+        'SchemaVersionSet': self._OnSchemaVersionSet,
+        'ActionSet': self._OnActionSet,
+    }
+
+  def _GetMeta(self, key, default=None):
+    row = self.db.execute('SELECT value FROM meta WHERE key = ?',
+                          (key,)).fetchone()
+    return default if row is None else row[0]
+
+  def _SetMeta(self, key, value):
+    self.db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, value))
+
+  # Replays every log since the last Update(). Returns how many events were
+  # applied.
+  def Update(self):
+    block_number = self._GetMeta('block_number', 0)
+    receipts = self._GetMeta('receipts', 0)
+    head = self.source.Head()
+    applied = 0
+    with self.db:
+      for log in self.source.Logs(block_number, receipts):
+        event = self.translator.listen(log, noprint=True)
+        handler = event and self.handlers.get(event['_event_type'])
+        if handler:
+          handler(event)
+          applied += 1
+      self._SetMeta('block_number', head[0])
+      self._SetMeta('receipts', head[1])
+    return applied
+
+  # -- Event handlers. --
+
+  def _OnItemCreated(self, e):
+    record = UnpackItem(e['packed'], NormalizeAddress(e['owner']))
+    self.db.execute('INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?, ?, '
+                    '?, ?)', [record[c] for c in kItemColumns])
+
+  def _OnItemFinalized(self, e):
+    self.db.execute('UPDATE items SET state = ? WHERE id = ?',
+                    (kItemExists, e['item_id']))
+
+  def _RenumberItem(self, old_id, new_id):
+    self.db.execute('UPDATE items SET id = ? WHERE id = ?', (new_id, old_id))
+    self.db.execute('UPDATE int_attributes SET item_id = ? WHERE item_id = ?',
+                    (new_id, old_id))
+
+  def _OnItemReopened(self, e):
+    self._RenumberItem(e['old_id'], e['new_id'])
+    self.db.execute('UPDATE items SET state = ? WHERE id = ?',
+                    (kUnderConstruction, e['new_id']))
+
+  def _OnItemMoved(self, e):
+    self._RenumberItem(e['old_id'], e['new_id'])
+    self.db.execute('UPDATE items SET owner = ? WHERE id = ?',
+                    (NormalizeAddress(e['recipient']), e['new_id']))
+
+  def _OnItemDeleted(self, e):
+    self.db.execute('DELETE FROM items WHERE id = ?', (e['item_id'],))
+    self.db.execute('DELETE FROM int_attributes WHERE item_id = ?',
+                    (e['item_id'],))
+
+  def _OnIntAttributeSet(self, e):
+    self.db.execute('INSERT OR REPLACE INTO int_attributes VALUES (?, ?, ?)',
+                    (e['item_id'], e['defindex'], _StoreValue(e['value'])))
+
+  def _OnIntAttributeRemoved(self, e):
+    self.db.execute('DELETE FROM int_attributes WHERE item_id = ? AND '
+                    'defindex = ?', (e['item_id'], e['defindex']))
+
+  def _OnAttributeSet(self, e):
+    self.db.execute('INSERT OR REPLACE INTO attributes VALUES (?, ?, ?)',
+                    (e['defindex'], buffer(e['name']), buffer(e['value'])))
+
+  def _OnAttributeModifiableSet(self, e):
+    self.db.execute('INSERT OR REPLACE INTO modifiable_attributes VALUES '
+                    '(?, ?)', (e['defindex'], int(e['modifiable'])))
+
+  def _OnItemSchemaSet(self, e):
+    self.db.execute('INSERT OR REPLACE INTO item_schemas VALUES (?, ?, ?, ?)',
+                    (e['defindex'], e['min_level'], e['max_level'],
+                     NormalizeAddress(e['use_contract'])))
+
+  def _OnSchemaIntAttributeSet(self, e):
+    self.db.execute('INSERT OR REPLACE INTO schema_int_attributes VALUES '
+                    '(?, ?, ?)', (e['item_defindex'], e['attribute_defindex'],
+                                  _StoreValue(e['value'])))
+
+  def _OnSchemaIntAttributeRemoved(self, e):
+    self.db.execute('DELETE FROM schema_int_attributes WHERE item_defindex = '
+                    '? AND attribute_defindex = ?',
+                    (e['item_defindex'], e['attribute_defindex']))
+
+  def _OnSchemaVersionSet(self, e):
+    self._SetMeta('schema_version', buffer(e['version']))
+
+  def _OnActionSet(self, e):
+    recipe = NormalizeAddress(e['recipe'])
+    if int(recipe, 16):
+      self.db.execute('INSERT OR REPLACE INTO actions VALUES (?, ?)',
+                      (buffer(e['name']), recipe))
+    else:
+      self.db.execute('DELETE FROM actions WHERE name = ?',
+                      (buffer(e['name']),))
+
+  # -- Queries. --
+
+  def _Items(self, where, args):
+    rows = self.db.execute('SELECT %s FROM items WHERE %s ORDER BY id' % (
+        ', '.join(kItemColumns), where), args)
+    return [dict(zip(kItemColumns, row)) for row in rows]
+
+  # Returns the record of |item_id|, in the form item_layout.UnpackItem()
+  # returns, or None if it doesn't exist.
+  def Item(self, item_id):
+    items = self._Items('id = ?', (item_id,))
+    return items[0] if items else None
+
+  # Returns the records of the items |user| owns, ordered by id.
+  def Backpack(self, user):
+    return self._Items('owner = ?', (NormalizeAddress(user),))
+
+  def ItemsOfDefindex(self, defindex):
+    return self._Items('defindex = ?', (defindex,))
+
+  # Returns a dict of attribute defindex to value for the int attributes set
+  # on |item_id| itself, not counting the ones it inherits from its schema.
+  def IntAttributes(self, item_id):
+    return dict((defindex, _LoadValue(value)) for defindex, value in
+                self.db.execute('SELECT defindex, value FROM int_attributes '
+                                'WHERE item_id = ?', (item_id,)))
+
+  # Like Backpack.GetItemIntAttribute(), falls back on the item's schema.
+  def IntAttribute(self, item_id, defindex):
+    row = self.db.execute(
+        'SELECT value FROM int_attributes WHERE item_id = ? AND defindex = ?',
+        (item_id, defindex)).fetchone()
+    if row is None:
+      row = self.db.execute(
+          'SELECT s.value FROM items i JOIN schema_int_attributes s ON '
+          's.item_defindex = i.defindex WHERE i.id = ? AND '
+          's.attribute_defindex = ?', (item_id, defindex)).fetchone()
+    return _LoadValue(row[0]) if row else 0
+
+  def ItemSchema(self, defindex):
+    row = self.db.execute('SELECT min_level, max_level, use_contract FROM '
+                          'item_schemas WHERE defindex = ?',
+                          (defindex,)).fetchone()
+    if row is None:
+      return None
+    return {'min_level': row[0], 'max_level': row[1], 'use_contract': row[2]}
+
+  def AttributeModifiable(self, defindex):
+    row = self.db.execute('SELECT modifiable FROM modifiable_attributes '
+                          'WHERE defindex = ?', (defindex,)).fetchone()
+    return bool(row and row[0])
+
+  # Returns the address of the recipe the action |name| runs, or None.
+  def Action(self, name):
+    row = self.db.execute('SELECT recipe FROM actions WHERE name = ?',
+                          (buffer(name.ljust(32, '\0')),)).fetchone()
+    return row[0] if row else None
+
+  def SchemaVersion(self):
+    version = self._GetMeta('schema_version')
+    return None if version is None else str(version)
+
+  def Close(self):
+    self.db.close()
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description='Mirrors the Backpack contract in a load_backpack.py '
+      'checkpoint into SQLite, and answers queries from the mirror.')
+  parser.add_argument('checkpoint',
+                      help='A chain checkpoint, as written next to a '
+                      'load_backpack.py journal.')
+  parser.add_argument('--db', default='backpack_mirror.sqlite',
+                      help='The SQLite mirror to bring up to date.')
+  parser.add_argument('--build', default='build',
+                      help='The directory the contracts were compiled into.')
+  parser.add_argument('--owner', help='Print the backpack of this address.')
+  parser.add_argument('--defindex', type=int,
+                      help='Print every item of this defindex.')
+  args = parser.parse_args()
+
+  s, checkpoint = chain_state.LoadState(args.checkpoint)
+  indexer = BackpackIndexer(s, checkpoint['contract'], args.db, args.build)
+  print "Applied %d events." % indexer.Update()
+
+  items = []
+  if args.owner:
+    items = indexer.Backpack(args.owner)
+  elif args.defindex is not None:
+    items = indexer.ItemsOfDefindex(args.defindex)
+  for item in items:
+    print ' '.join('%s=%s' % (c, item[c]) for c in kItemColumns)
+  indexer.Close()
+
+
+if __name__ == '__main__':
+  main()
@@ -14,9 +14,38 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import BaseHTTPServer
+import SocketServer
+import StringIO
+import json
+import json_stream
+import os
+import rlp
+import shutil
+import sys
+import tempfile
+import threading
 import unittest
-from ethereum import tester
+from backpack_client import GetBackpack, GetItems
+from backpack_indexer import BackpackIndexer, NormalizeAddress
+from block_packer import BlockPacker
+from call_plan import LoadPlan, PlanTransport, WritePlan
+from chain_state import AttachContract, CheckpointWriter, LoadState
+from chain_transport import CallFailed, JsonRpcTransport, TesterTransport
+from contract_profiler import ContractProfiler, Profile, kMineName
+from generate_backpacks import BackpackGenerator, BackpackModel
+from ethereum import processblock, tester, transactions, utils
 from ethertdd import FileContractStore
+from lineage_resolver import LineageResolver
+from import_accounts import AccountsInDirectory, ImportAccounts, PrintSummary
+from import_journal import ImportJournal
+from import_plan import BuildPlan, kModifiableAttributes
+from import_telemetry import ImportTelemetry
+from load_backpack import BackpackLoader, OpenChain
+from schema_delta import ApplyDelta, DiffSchemas
+from schema_index import LoadSchemaIndex, SchemaIndex, WriteIndex
+from tf2_schema import IterBackpackItems, Schema
+from world_snapshot import LoadWorld, SaveWorld, StaleSnapshot
 
 # Up the gas limit because our contract is pretty huge.
 tester.gas_limit = 100000000;
@@ -26,32 +55,72 @@ kPermissionDenied = 'Permission Denied\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x
 kNullString = '\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
 kInvalidAttribute = 'Invalid Attribute\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
 
+# For setting up worlds, where there's no test to fail: raises unless a
+# contract call returned kOK.
+def CheckOK(result):
+    if result != kOK:
+        raise Exception("Expected OK, got %r" % result.rstrip('\x00'))
+
 fs = FileContractStore().build
 
+# Deploying the contracts is most of the cost of setting up a test, so every
+# test shares one chain. The bare Backpack is deployed on it once, each test
+# class builds its world on top of that once, and each test starts from a
+# snapshot of its class's world.
+#
+# Calls to the test contracts go through the same BlockPacker as the loader's,
+# which mines whenever the next call wouldn't fit in the current block. Tests
+# only mine by hand where they need a new block for its own sake.
+_base_world = None
+
+def BaseWorld():
+    global _base_world
+    if _base_world is None:
+        t = tester.state()
+        t.mine()
+        packer = BlockPacker(t)
+        contract = packer.Wrap(Profile(
+            t, fs.Backpack.create(sender=tester.k0, state=t), 'Backpack'))
+        t.mine()
+        _base_world = (t, packer, contract, t.snapshot())
+    return _base_world
+
 class BackpackTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.t, cls.packer, cls.contract, base = BaseWorld()
+        cls.t.revert(base)
+        cls.SetUpWorld()
+        # Commit the world so the snapshot covers all of it.
+        cls.t.mine()
+        cls.world = cls.t.snapshot()
+
+    # Subclasses deploy their extra contracts and set up what all of their
+    # tests share here. It runs once per class.
+    @classmethod
+    def SetUpWorld(cls):
+        pass
+
+    # Deploys the contract |name| for a class's world, with its calls packed
+    # and profiled like the Backpack's.
+    @classmethod
+    def Deploy(cls, name, *args):
+        contract = getattr(fs, name).create(*args, sender=tester.k0,
+                                            state=cls.t)
+        return cls.packer.Wrap(Profile(cls.t, contract, name))
+
     def setUp(self):
-        self.t = tester.state()
-        self.t.mine()
-        self.contract = fs.Backpack.create(sender=tester.k0,
-                                           state=self.t)
-        self.t.mine()
+        self.t.revert(self.world)
 
     def GetArrayOfDefindexOfBackpack(self, address):
-        count = self.contract.GetNumberOfItemsOwnedFor(address);
         defindixes = []
-        for i in range(count):
-            item_id = self.contract.GetItemIdFromBackpack(address, i);
-            self.assertNotEquals(item_id, 0);
-            item_data = self.contract.GetItemData(item_id);
-            defindixes.append(item_data[0]);
+        for slot in GetBackpack(self.contract, address):
+            self.assertNotEquals(slot['id'], 0);
+            defindixes.append(slot['defindex']);
         return defindixes
 
     def GetArrayOfItemIdsOfBackpack(self, address):
-        count = self.contract.GetNumberOfItemsOwnedFor(address);
-        item_ids = []
-        for i in range(count):
-            item_ids.append(self.contract.GetItemIdFromBackpack(address, i));
-        return item_ids
+        return [slot['id'] for slot in GetBackpack(self.contract, address)]
 
 
 class UsersAndPermissionsTest(BackpackTest):
@@ -73,14 +142,12 @@ class UsersAndPermissionsTest(BackpackTest):
         self.assertEquals(
             self.contract.SetPermission(tester.a1, 4, True, sender=tester.k1),
             kPermissionDenied)
-        self.t.mine()
         self.assertFalse(self.contract.HasPermission(tester.a1, 4))
 
         # Gets the permission from the contract creater.
         self.assertEquals(
             self.contract.SetPermission(tester.a1, 4, True, sender=tester.k0),
             kOK)
-        self.t.mine()
         self.assertTrue(self.contract.HasPermission(tester.a1, 4))
 
     def test_allow_items(self):
@@ -130,6 +197,24 @@ class AttributeTest(BackpackTest):
         self.assertEquals(self.contract.GetAttribute(1, "One"),
                           '1\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00');
 
+    def test_set_attributes(self):
+        self.assertEquals(self.contract.SetAttributes(
+            [142, 261], "name", ["set item tint RGB", "set item tint RGB 2"]),
+                          kOK);
+        self.assertEquals(self.contract.GetAttribute(142, "name"),
+                          "set item tint RGB".ljust(32, '\x00'));
+        self.assertEquals(self.contract.GetAttribute(261, "name"),
+                          "set item tint RGB 2".ljust(32, '\x00'));
+
+    def test_set_attributes_rejects_zero(self):
+        self.assertEquals(self.contract.SetAttributes(
+            [142, 0], "name", ["One", "Zero"]), kInvalidAttribute);
+        self.assertEquals(self.contract.GetAttribute(142, "name"), kNullString);
+
+    def test_set_attributes_permission(self):
+        self.assertEquals(self.contract.SetAttributes(
+            [142], "name", ["One"], sender=tester.k1), kPermissionDenied);
+
 class SchemaTest(BackpackTest):
     def test_schema_permission(self):
         self.assertEquals(self.contract.SetItemSchema(18, 5, 25, 0, sender=tester.k1),
@@ -139,6 +224,18 @@ class SchemaTest(BackpackTest):
         self.assertEquals(self.contract.SetItemSchema(18, 5, 25, 0), kOK);
         self.assertEquals(self.contract.GetItemLevelRange(18), [5, 25]);
 
+    def test_set_item_schemas(self):
+        self.assertEquals(self.contract.SetItemSchemas([18, 94], [5, 1],
+                                                       [25, 100]), kOK);
+        self.assertEquals(self.contract.GetItemLevelRange(18), [5, 25]);
+        self.assertEquals(self.contract.GetItemLevelRange(94), [1, 100]);
+
+    def test_set_item_schemas_permission(self):
+        self.assertEquals(self.contract.SetItemSchemas([18], [5], [25],
+                                                       sender=tester.k1),
+                          kPermissionDenied);
+        self.assertEquals(self.contract.GetItemLevelRange(18), [0, 0]);
+
     def test_cant_add_invalid_attribute(self):
         self.assertEquals(self.contract.SetItemSchema(18, 5, 25, 0), kOK);
         self.assertEquals(self.contract.AddIntAttributeToItemSchema(18, 6, 15),
@@ -153,6 +250,68 @@ class SchemaTest(BackpackTest):
         self.assertEquals(self.contract.SetItemSchema(30556, 1, 100, 0), kOK);
         self.assertEquals(self.contract.AddIntAttributeToItemSchema(30556, 388, 64), kOK);
 
+    def test_remove_attribute_from_item_schema(self):
+        self.assertEquals(self.contract.SetAttribute(388, "name", "kill eater kill type"), kOK);
+        self.assertEquals(self.contract.SetAttribute(214, "name", "kill eater"), kOK);
+        self.assertEquals(self.contract.SetItemSchema(30556, 1, 100, 0), kOK);
+        self.assertEquals(self.contract.AddIntAttributeToItemSchema(30556, 388, 64), kOK);
+        self.assertEquals(self.contract.AddIntAttributeToItemSchema(30556, 214, 10), kOK);
+        id = self.contract.CreateNewItem(30556, 0, 1, tester.a1);
+        self.contract.FinalizeItem(id);
+
+        self.assertEquals(self.contract.RemoveIntAttributeFromItemSchema(
+            30556, 388, sender=tester.k1), kPermissionDenied);
+        self.assertEquals(self.contract.GetItemIntAttribute(id, 388), 64);
+
+        self.assertEquals(self.contract.RemoveIntAttributeFromItemSchema(30556, 388), kOK);
+        self.assertEquals(self.contract.GetItemIntAttribute(id, 388), 0);
+        self.assertEquals(self.contract.GetItemIntAttribute(id, 214), 10);
+
+    def test_schema_version(self):
+        self.assertEquals(self.contract.GetSchemaVersion(), kNullString);
+        version = 'v' * 32
+        self.assertEquals(self.contract.SetSchemaVersion(version, sender=tester.k1),
+                          kPermissionDenied);
+        self.assertEquals(self.contract.SetSchemaVersion(version), kOK);
+        self.assertEquals(self.contract.GetSchemaVersion(), version);
+
+
+class SchemaDeltaTest(BackpackTest):
+    def MakeSchema(self, items, attributes):
+        return Schema(items, [{'defindex': d, 'name': n} for d, n in attributes])
+
+    def test_diff_and_apply(self):
+        old = self.MakeSchema(
+            [{'defindex': 20, 'name': 'a', 'min_ilevel': 1, 'max_ilevel': 5},
+             {'defindex': 21, 'name': 'b', 'min_ilevel': 1, 'max_ilevel': 1,
+              'attributes': [{'name': 'x', 'value': 7},
+                             {'name': 'y', 'value': 8}]}],
+            [(1, 'x'), (2, 'y')])
+        new = self.MakeSchema(
+            [{'defindex': 20, 'name': 'a', 'min_ilevel': 1, 'max_ilevel': 5},
+             {'defindex': 21, 'name': 'b', 'min_ilevel': 1, 'max_ilevel': 10,
+              'attributes': [{'name': 'x', 'value': 9}]},
+             {'defindex': 22, 'name': 'c', 'min_ilevel': 3, 'max_ilevel': 3}],
+            [(1, 'x'), (2, 'renamed y'), (3, 'z')])
+
+        delta = DiffSchemas(old, new)
+        self.assertEquals(delta.attributes, {2: 'renamed y', 3: 'z'})
+        self.assertEquals(delta.item_schemas, {21: (1, 10), 22: (3, 3)})
+        self.assertEquals(delta.added_int_attributes, [(21, 1, 9)])
+        self.assertEquals(delta.removed_int_attributes, [(21, 2)])
+
+        # Only what's live on chain is diffed when we know what that is.
+        live = DiffSchemas(old, new, set([20]), set([1]))
+        self.assertTrue(live.IsEmpty())
+
+        loader = BackpackLoader(TesterTransport(self.t, self.contract), new)
+        ApplyDelta(loader, delta, 'ab' * 20)
+        self.assertEquals(self.contract.GetAttribute(2, "name"),
+                          'renamed y'.ljust(32, '\x00'))
+        self.assertEquals(self.contract.GetItemLevelRange(22), [3, 3])
+        self.assertEquals(self.contract.GetSchemaVersion(),
+                          '\xab' * 20 + '\x00' * 12)
+
 
 class ItemsTests(BackpackTest):
     def test_dont_create_item_with_no_schema(self):
@@ -199,6 +358,48 @@ class ItemsTests(BackpackTest):
         # strangifiers / etc.
         self.assertEquals(item_data[5], item_id);
 
+    def test_backpack_pages(self):
+        self.assertEquals(self.contract.SetItemSchema(20, 50, 50, 0), kOK);
+        self.assertEquals(self.contract.SetItemSchema(21, 1, 100, 0), kOK);
+        expected = []
+        for i in range(5):
+            defindex = 20 + i % 2
+            id = self.contract.CreateNewItem(defindex, 6, 1, tester.a1);
+            self.contract.FinalizeItem(id);
+            expected.append((id, defindex));
+
+        slots = GetBackpack(self.contract, tester.a1, page_size=2)
+        self.assertEquals([(s['id'], s['defindex']) for s in slots], expected);
+        for slot in slots:
+            item_data = self.contract.GetItemData(slot['id']);
+            self.assertEquals(slot['level'], item_data[2]);
+            self.assertEquals(slot['quality'], 6);
+            self.assertEquals(slot['origin'], 1);
+
+        # Pages are clipped to the end of the backpack.
+        self.assertEquals(len(self.contract.GetBackpackPage(tester.a1, 4, 10)), 1);
+        self.assertEquals(self.contract.GetBackpackPage(tester.a1, 5, 10), []);
+
+    def test_get_item_data_packed(self):
+        self.assertEquals(self.contract.SetItemSchema(20, 50, 50, 0), kOK);
+        finalized = self.contract.CreateNewItem(20, 6, 1, tester.a1);
+        self.contract.FinalizeItem(finalized);
+        unfinalized = self.contract.CreateNewItem(20, 11, 8, tester.a1);
+
+        records = GetItems(self.contract, [finalized, 12345, unfinalized])
+        self.assertEquals(records[1]['id'], 0);
+
+        for record, state, slot in [(records[0], 1, 0), (records[2], 2, 1)]:
+            item_data = self.contract.GetItemData(record['id']);
+            self.assertEquals(record['defindex'], item_data[0]);
+            self.assertEquals(record['owner'], item_data[1]);
+            self.assertEquals(record['level'], item_data[2]);
+            self.assertEquals(record['quality'], item_data[3]);
+            self.assertEquals(record['origin'], item_data[4]);
+            self.assertEquals(record['original_id'], item_data[5]);
+            self.assertEquals(record['state'], state);
+            self.assertEquals(record['backpack_slot'], slot);
+
     def test_delete_last_item(self):
         for i in range(1, 4):
             self.assertEquals(self.contract.SetItemSchema(i, 50, 50, 0), kOK);
@@ -233,6 +434,31 @@ class ItemsTests(BackpackTest):
         indicies = self.GetArrayOfDefindexOfBackpack(tester.a1);
         self.assertEquals([3,2], indicies);
 
+    def test_delete_moved_items(self):
+        # Removing an item moves the last item into its slot; the moved item
+        # has to be found in its new slot afterwards.
+        for i in range(1, 5):
+            self.assertEquals(self.contract.SetItemSchema(i, 50, 50, 0), kOK);
+            id = self.contract.CreateNewItem(i, 0, 1, tester.a1);
+            self.contract.FinalizeItem(id);
+        item_ids = self.GetArrayOfItemIdsOfBackpack(tester.a1);
+
+        self.contract.DeleteItem(item_ids[0], sender=tester.k1);
+        self.assertEquals(self.GetArrayOfDefindexOfBackpack(tester.a1),
+                          [4,2,3]);
+        self.contract.DeleteItem(item_ids[3], sender=tester.k1);
+        self.assertEquals(self.GetArrayOfDefindexOfBackpack(tester.a1),
+                          [3,2]);
+
+        # Modifying an item keeps it in its slot.
+        self.contract.UnlockItemFor(item_ids[2], tester.a0, sender=tester.k1);
+        new_id = self.contract.OpenForModification(item_ids[2]);
+        self.assertEquals(self.GetArrayOfItemIdsOfBackpack(tester.a1),
+                          [new_id, item_ids[1]]);
+        self.contract.FinalizeItem(new_id);
+        self.contract.DeleteItem(new_id, sender=tester.k1);
+        self.assertEquals(self.GetArrayOfDefindexOfBackpack(tester.a1), [2]);
+
     def test_cant_delete_others_items(self):
         self.assertEquals(self.contract.SetItemSchema(5, 50, 50, 0), kOK);
         id = self.contract.CreateNewItem(5, 0, 1, tester.a1);
@@ -316,6 +542,47 @@ class ItemsTests(BackpackTest):
         self.assertEquals(self.contract.GetItemLength(id), 1);
         self.assertEquals(self.contract.GetItemIntAttribute(id, 142), 8);
 
+    def test_remove_int_attribute(self):
+        self.assertEquals(self.contract.CreateUser(tester.a1), kOK);
+        for defindex in [142, 261, 1004]:
+            self.assertEquals(self.contract.SetAttribute(defindex, "name",
+                                                         "paint"), kOK);
+
+        self.assertEquals(self.contract.SetItemSchema(5, 50, 50, 0), kOK);
+        id = self.contract.CreateNewItem(5, 0, 1, tester.a1);
+        self.contract.SetIntAttributes(id, [142, 261, 1004], [8, 9, 10]);
+
+        # Removing the first attribute moves the last one into its place.
+        self.contract.RemoveIntAttribute(id, 142);
+        self.contract.FinalizeItem(id);
+
+        self.assertEquals(self.contract.GetItemLength(id), 2);
+        self.assertEquals(self.contract.GetItemIntAttribute(id, 142), 0);
+        self.assertEquals(self.contract.GetItemIntAttribute(id, 261), 9);
+        self.assertEquals(self.contract.GetItemIntAttribute(id, 1004), 10);
+
+    def test_remove_moved_int_attribute(self):
+        self.assertEquals(self.contract.CreateUser(tester.a1), kOK);
+        for defindex in [142, 261, 1004]:
+            self.assertEquals(self.contract.SetAttribute(defindex, "name",
+                                                         "paint"), kOK);
+
+        self.assertEquals(self.contract.SetItemSchema(5, 50, 50, 0), kOK);
+        id = self.contract.CreateNewItem(5, 0, 1, tester.a1);
+        self.contract.SetIntAttributes(id, [142, 261, 1004], [8, 9, 10]);
+
+        # 1004 moves into 142's slot, and has to be found there.
+        self.contract.RemoveIntAttribute(id, 142);
+        self.contract.RemoveIntAttribute(id, 1004);
+        self.contract.SetIntAttribute(id, 142, 11);
+        self.contract.SetIntAttribute(id, 261, 12);
+        self.contract.FinalizeItem(id);
+
+        self.assertEquals(self.contract.GetItemLength(id), 2);
+        self.assertEquals(self.contract.GetItemIntAttribute(id, 142), 11);
+        self.assertEquals(self.contract.GetItemIntAttribute(id, 261), 12);
+        self.assertEquals(self.contract.GetItemIntAttribute(id, 1004), 0);
+
     # This is broken and I don't understand why this is broken.
     def test_open_for_modification(self):
         self.assertEquals(self.contract.CreateUser(tester.a1), kOK);
@@ -343,6 +610,1123 @@ class ItemsTests(BackpackTest):
         self.assertEquals(self.contract.GetItemLength(new_id), 1);
         self.assertEquals(self.contract.GetItemIntAttribute(new_id, 142), 8);
 
+    def test_resolve_item_ids(self):
+        self.assertEquals(self.contract.CreateUser(tester.a1), kOK);
+        self.assertEquals(self.contract.CreateUser(tester.a2), kOK);
+        self.assertEquals(self.contract.SetItemSchema(5, 50, 50, 0), kOK);
+
+        # An imported item resolves from its off chain id.
+        imported = self.contract.ImportItems([5 | 50 << 64 | 1234 << 80], [],
+                                             tester.a1);
+        self.assertEquals(self.contract.ResolveOriginalId(1234), imported);
+        self.assertEquals(self.contract.ResolveItemId(1234), 0);
+
+        first = self.contract.CreateNewItem(5, 0, 1, tester.a1);
+        self.contract.FinalizeItem(first);
+        second = self.contract.GiveItemTo(first, tester.a2, sender=tester.k1);
+        self.contract.UnlockItemFor(second, tester.a0, sender=tester.k2);
+        third = self.contract.OpenForModification(second);
+        self.contract.FinalizeItem(third);
+
+        # Every id the item has had leads to where it is now.
+        self.assertEquals(self.contract.ResolveItemIds([first, second, third,
+                                                        77]),
+                          [third, third, third, 0]);
+        self.assertEquals(self.contract.ResolveOriginalIds([1234, 77]),
+                          [imported, 0]);
+
+        # Until it's deleted.
+        self.contract.DeleteItem(third, sender=tester.k2);
+        self.assertEquals(self.contract.ResolveItemId(first), 0);
+
+    def test_original_ids_dont_collide_with_chain_ids(self):
+        self.assertEquals(self.contract.CreateUser(tester.a1), kOK);
+        self.assertEquals(self.contract.CreateUser(tester.a2), kOK);
+        self.assertEquals(self.contract.SetItemSchema(5, 50, 50, 0), kOK);
+        live = self.contract.CreateNewItem(5, 0, 1, tester.a1);
+        self.contract.FinalizeItem(live);
+        moved = self.contract.CreateNewItem(5, 0, 1, tester.a1);
+        self.contract.FinalizeItem(moved);
+        given = self.contract.GiveItemTo(moved, tester.a2, sender=tester.k1);
+
+        # Import items whose off chain ids are the ids of a live item and of
+        # an item which has since moved.
+        first = self.contract.ImportItems([5 | 50 << 64 | live << 80,
+                                           5 | 50 << 64 | moved << 80], [],
+                                          tester.a1);
+        self.assertEquals(self.contract.ResolveItemIds([live, moved]),
+                          [live, given]);
+        self.assertEquals(self.contract.ResolveOriginalIds([live, moved]),
+                          [first, first + 2]);
+
+        # Importing an off chain id again points it at the new item, and
+        # leaves the chain ids alone.
+        again = self.contract.ImportItems([5 | 50 << 64 | moved << 80], [],
+                                          tester.a1);
+        self.assertEquals(self.contract.ResolveOriginalId(moved), again);
+        self.assertEquals(self.contract.ResolveItemId(moved), given);
+
+        resolver = LineageResolver(self.contract)
+        self.assertEquals(resolver.ResolveOne(live), live);
+        self.assertEquals(resolver.ResolveOriginalOne(live), first);
+        self.assertEquals(resolver.calls, 2);
+
+    def test_lineage_resolver(self):
+        self.assertEquals(self.contract.CreateUser(tester.a1), kOK);
+        self.assertEquals(self.contract.CreateUser(tester.a2), kOK);
+        self.assertEquals(self.contract.SetItemSchema(5, 50, 50, 0), kOK);
+        ids = []
+        for i in range(3):
+            id = self.contract.CreateNewItem(5, 0, 1, tester.a1);
+            self.contract.FinalizeItem(id);
+            ids.append(id)
+        new_id = self.contract.GiveItemTo(ids[0], tester.a2, sender=tester.k1);
+
+        resolver = LineageResolver(self.contract, cache_size=2, page_size=2)
+        self.assertEquals(resolver.Resolve(ids),
+                          {ids[0]: new_id, ids[1]: ids[1], ids[2]: ids[2]});
+        self.assertEquals(resolver.calls, 2);
+
+        # ids[0] was the least recently used, so it fell out of the cache.
+        self.assertEquals(resolver.ResolveOne(ids[2]), ids[2]);
+        self.assertEquals(resolver.calls, 2);
+        self.assertEquals(resolver.ResolveOne(ids[0]), new_id);
+        self.assertEquals(resolver.calls, 3);
+
+        # Cached answers go stale until they're refreshed.
+        newer_id = self.contract.GiveItemTo(new_id, tester.a1,
+                                            sender=tester.k2);
+        self.assertEquals(resolver.ResolveOne(ids[0]), new_id);
+        self.assertEquals(resolver.ResolveOne(ids[0], refresh=True), newer_id);
+
+class ImportItemsTest(BackpackTest):
+    def PackItem(self, defindex, quality, origin, level, original_id,
+                 attribute_count):
+        return (defindex | quality << 32 | origin << 48 | level << 64 |
+                original_id << 80 | attribute_count << 144)
+
+    def PackAttribute(self, defindex, value):
+        return defindex | value << 32
+
+    def test_import_items(self):
+        self.assertEquals(self.contract.SetAttribute(142, "name",
+                                                     "set item tint RGB"),
+                          kOK);
+        self.assertEquals(self.contract.SetItemSchema(94, 1, 100, 0), kOK);
+        self.assertEquals(self.contract.SetItemSchema(442, 30, 30, 0), kOK);
+
+        first_id = self.contract.ImportItems(
+            [self.PackItem(94, 6, 0, 12, 1234, 1),
+             self.PackItem(442, 6, 0, 30, 5678, 0)],
+            [self.PackAttribute(142, 8)],
+            tester.a1);
+        self.assertNotEquals(first_id, 0);
+
+        self.assertEquals(self.GetArrayOfItemIdsOfBackpack(tester.a1),
+                          [first_id, first_id + 2]);
+        self.assertEquals(self.contract.GetItemData(first_id)[2], 12);
+        self.assertEquals(self.contract.GetItemData(first_id)[5], 1234);
+        self.assertEquals(self.contract.GetItemData(first_id + 2)[5], 5678);
+        self.assertEquals(self.contract.GetItemIntAttribute(first_id, 142), 8);
+        self.assertEquals(self.contract.GetItemLength(first_id + 2), 0);
+
+        # The items come out finalized.
+        self.assertTrue(self.contract.CanGiveItem(first_id, sender=tester.k1));
+
+    def test_import_items_rejects_undefined_item(self):
+        self.assertEquals(self.contract.SetItemSchema(94, 1, 100, 0), kOK);
+
+        first_id = self.contract.ImportItems(
+            [self.PackItem(94, 6, 0, 12, 1234, 0),
+             self.PackItem(20, 6, 0, 12, 5678, 0)],
+            [], tester.a1);
+        self.assertEquals(first_id, 0);
+        self.assertEquals(self.contract.GetNumberOfItemsOwnedFor(tester.a1), 0);
+
+    def test_import_items_permission(self):
+        self.assertEquals(self.contract.SetItemSchema(94, 1, 100, 0), kOK);
+        self.assertEquals(self.contract.ImportItems(
+            [self.PackItem(94, 6, 0, 12, 1234, 0)], [], tester.a1,
+            sender=tester.k1), 0);
+        self.assertEquals(self.contract.GetNumberOfItemsOwnedFor(tester.a1), 0);
+
+
+class CallPlanTest(BackpackTest):
+    def MakeSchema(self):
+        attributes = [{'defindex': 1, 'name': 'x'},
+                      {'defindex': 2, 'name': 'y' * 40}]
+        attributes += [{'defindex': d, 'name': 'kills %d' % d}
+                       for d in kModifiableAttributes]
+        return Schema(
+            [{'defindex': 20, 'name': 'a', 'min_ilevel': 1, 'max_ilevel': 5,
+              'attributes': [{'name': 'x', 'value': 7}]}],
+            attributes)
+
+    def MakeItems(self, count):
+        return [{'id': 100 + i, 'original_id': 50 + i, 'defindex': 20,
+                 'level': 3, 'quality': 6, 'origin': 0,
+                 'attributes': [{'defindex': 1, 'value': 7},
+                                {'defindex': 2, 'value': i},
+                                {'defindex': 2, 'value': 'not an int'}]}
+                for i in range(count)]
+
+    def test_batches_fit_gas_limit(self):
+        # Each item needs 195000 gas, so only two fit under 90% of 500000.
+        planner = PlanTransport(500000)
+        BackpackLoader(planner, self.MakeSchema(),
+                       recipient=tester.a1.encode('hex')).ImportItems(
+                           self.MakeItems(5));
+        imports = [e for e in planner.entries
+                   if e['function'] == 'ImportItems']
+        self.assertEquals([len(e['records']) for e in imports], [2, 2, 1]);
+        for entry in planner.entries:
+            self.assertTrue(entry['gas'] <= 500000);
+
+    def test_plan_then_execute(self):
+        schema = self.MakeSchema()
+        items = self.MakeItems(5)
+
+        planner = PlanTransport()
+        BackpackLoader(planner, schema,
+                       recipient=tester.a1.encode('hex')).ImportItems(items);
+        self.assertEquals([e['function'] for e in planner.entries],
+                          ['SetAttributeModifiable'] * 6 +
+                          ['SetAttributes', 'SetItemSchemas',
+                           'AddIntAttributeToItemSchema', 'ImportItems']);
+        self.assertEquals(planner.blocks_used, 1);
+
+        # Inherited and non int attributes are left off, and names are cut
+        # down to a bytes32.
+        records = planner.entries[-1]['records']
+        self.assertEquals(records[1][0:2], [101, 51]);
+        self.assertEquals(records[1][2]['attributes'], [[2, 1]]);
+        self.assertTrue('y' * 32 in planner.entries[6]['args'][2]);
+
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            WritePlan(path, planner, None)
+            plan = LoadPlan(path)
+        finally:
+            os.remove(path)
+
+        loader = BackpackLoader(TesterTransport(self.t, self.contract),
+                                schema)
+        loader.ExecutePlan(plan['calls']);
+        self.assertEquals(loader.items_imported, 5);
+        self.assertEquals(self.contract.GetNumberOfItemsOwnedFor(tester.a1), 5);
+        self.assertEquals(self.contract.GetAttribute(2, "name"), 'y' * 32);
+        # Items get the attributes their schema gives them.
+        item_id = self.contract.GetItemIdFromBackpack(tester.a1, 0)
+        self.assertEquals(self.contract.GetItemIntAttribute(item_id, 1), 7);
+
+
+class SyncTest(BackpackTest):
+    def MakeItem(self, i, origin=0, value=None):
+        return {'id': 100 + i, 'original_id': 50 + i, 'defindex': 20,
+                'level': 3, 'quality': 6, 'origin': origin,
+                'attributes': [{'defindex': 1,
+                                'value': i if value is None else value}]}
+
+    def test_sync_counts_each_kind_of_change(self):
+        schema = Schema(
+            [{'defindex': 20, 'name': 'a', 'min_ilevel': 1, 'max_ilevel': 5}],
+            [{'defindex': 1, 'name': 'x'}] +
+            [{'defindex': d, 'name': 'kills %d' % d}
+             for d in kModifiableAttributes])
+        directory = tempfile.mkdtemp()
+        try:
+            journal = ImportJournal(os.path.join(directory, 'journal'))
+            journal.Open()
+            loader = BackpackLoader(
+                TesterTransport(self.t, self.contract), schema,
+                journal=journal,
+                checkpoint_path=os.path.join(directory, 'checkpoint'))
+            loader.ImportItems([self.MakeItem(i) for i in range(4)]);
+
+            # Item 0 is the same, item 1 has a new attribute value, item 2
+            # has a new origin, item 3 is gone and item 4 is new.
+            counts = loader.Sync([self.MakeItem(0),
+                                  self.MakeItem(1, value=9),
+                                  self.MakeItem(2, origin=1),
+                                  self.MakeItem(4)]);
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertEquals(counts, {'new': 1, 'changed': 1, 'modified': 1,
+                                   'removed': 1});
+        self.assertEquals(sorted(journal.items), [100, 101, 102, 104]);
+        self.assertEquals(journal.items[100]['origin'], 0);
+        self.assertEquals(
+            self.contract.GetItemData(journal.items[102]['new_id'])[4], 1);
+        self.assertEquals(self.contract.GetItemIntAttribute(
+            journal.items[101]['new_id'], 1), 9);
+        self.assertEquals(self.contract.GetNumberOfItemsOwnedFor(tester.a1),
+                          4);
+
+
+class _ThreadedHTTPServer(SocketServer.ThreadingMixIn,
+                          BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+# Raised to have the stand-in node hang up without answering.
+class _HangUp(Exception):
+    pass
+
+
+# A stand-in Ethereum node for JsonRpcTransport: a JSON-RPC server in front of
+# an ethereum.tester chain. Like a real node, it holds transactions back until
+# the ones before them from the same sender arrive, and mines a new block
+# when the next transaction won't fit. |reject| and |drop| pick transactions
+# for the node to refuse, or to take and then hang up on without answering.
+# Refusals wait for |hold| to be set.
+class StandInNode(object):
+    def __init__(self):
+        self.s = tester.state()
+        self.lock = threading.Lock()
+        self.known = set()
+        # Maps (sender, nonce) to a transaction waiting on the ones before it.
+        self.queued = {}
+        self.receipts = {}
+        self.reject = lambda tx: False
+        self.drop = lambda tx: False
+        self.hold = threading.Event()
+        self.hold.set()
+
+        node = self
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                payload = json.loads(
+                    self.rfile.read(int(self.headers['Content-Length'])))
+                responses = []
+                for request in (payload if isinstance(payload, list)
+                                else [payload]):
+                    response = {'jsonrpc': '2.0', 'id': request['id']}
+                    try:
+                        response['result'] = node.Handle(request['method'],
+                                                          request['params'])
+                    except _HangUp:
+                        self.close_connection = 1
+                        return
+                    except Exception as e:
+                        response['error'] = {'code': -32000,
+                                             'message': str(e)}
+                    responses.append(response)
+                body = json.dumps(responses if isinstance(payload, list)
+                                  else responses[0])
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _ThreadedHTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_address[1]
+
+    def Close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def Nonce(self, address):
+        with self.lock:
+            return self.s.block.get_nonce(address)
+
+    def _Apply(self, tx):
+        block = self.s.block
+        if block.gas_used + tx.startgas > block.gas_limit:
+            self.s.mine()
+            block = self.s.block
+        success, _ = processblock.apply_transaction(block, tx)
+        receipts = block.get_receipts()
+        gas = receipts[-1].gas_used
+        if len(receipts) > 1:
+            gas -= receipts[-2].gas_used
+        receipt = {
+            'blockNumber': '0x%x' % block.number,
+            'gasUsed': '0x%x' % gas,
+            'status': '0x1' if success else '0x0',
+            'logs': [{'address': '0x' + NormalizeAddress(log.address),
+                      'topics': ['0x%064x' % t for t in log.topics],
+                      'data': '0x' + log.data.encode('hex')}
+                     for log in receipts[-1].logs],
+        }
+        if not tx.to:
+            # Some nodes checksum addresses with upper case.
+            receipt['contractAddress'] = '0x' + utils.mk_contract_address(
+                tx.sender, tx.nonce).encode('hex').upper()
+        self.receipts['0x' + tx.hash.encode('hex')] = receipt
+
+    def _SendRawTransaction(self, raw):
+        tx = rlp.decode(raw[2:].decode('hex'), transactions.Transaction)
+        if self.reject(tx):
+            self.hold.wait()
+            raise Exception("transaction rejected")
+        tx_hash = '0x' + tx.hash.encode('hex')
+        with self.lock:
+            if tx_hash in self.known:
+                raise Exception("already known")
+            if tx.nonce < self.s.block.get_nonce(tx.sender):
+                raise Exception("nonce too low")
+            self.known.add(tx_hash)
+            self.queued[(tx.sender, tx.nonce)] = tx
+            while True:
+                next_tx = self.queued.pop(
+                    (tx.sender, self.s.block.get_nonce(tx.sender)), None)
+                if next_tx is None:
+                    break
+                self._Apply(next_tx)
+        if self.drop(tx):
+            raise _HangUp()
+        return tx_hash
+
+    def _Call(self, call):
+        with self.lock:
+            snapshot = self.s.snapshot()
+            try:
+                output = self.s.send(tester.k9, call['to'][2:].decode('hex'),
+                                     0, call['data'][2:].decode('hex'))
+            finally:
+                self.s.revert(snapshot)
+        return '0x' + output.encode('hex')
+
+    def Handle(self, method, params):
+        if method == 'eth_sendRawTransaction':
+            return self._SendRawTransaction(params[0])
+        if method == 'eth_call':
+            return self._Call(params[0])
+        with self.lock:
+            if method == 'eth_getBlockByNumber':
+                return {'gasLimit': '0x%x' % self.s.block.gas_limit}
+            if method == 'eth_getTransactionCount':
+                return '0x%x' % self.s.block.get_nonce(
+                    params[0][2:].decode('hex'))
+            if method == 'eth_getTransactionReceipt':
+                return self.receipts.get(params[0])
+            if method == 'eth_getTransactionByHash':
+                return {'hash': params[0]} if params[0] in self.known else None
+        raise Exception("unknown method %s" % method)
+
+
+class JsonRpcTransportTest(unittest.TestCase):
+    kCallGas = 1000000
+
+    def setUp(self):
+        self.node = StandInNode()
+
+    def tearDown(self):
+        self.node.Close()
+
+    # Returns a transport talking to a new Backpack on the node, with an item
+    # schema and tester.a1 set up.
+    def Connect(self):
+        with open(os.path.join('build', 'Backpack.abi')) as f:
+            transport = JsonRpcTransport(self.node.url, json.load(f),
+                                         poll_interval=0.01)
+        with open(os.path.join('build', 'Backpack.bin')) as f:
+            transport.Deploy(f.read().strip().decode('hex'))
+        transport.Call('SetItemSchema', (94, 1, 100, 0),
+                       estimate=self.kCallGas)
+        transport.Call('CreateUser', (tester.a1,), estimate=self.kCallGas)
+        transport.Wait()
+        return transport
+
+    def CreateItem(self, transport):
+        return transport.Call('CreateNewItem', (94, 6, 0, tester.a1),
+                              estimate=self.kCallGas)
+
+    def test_pipelined_calls_resolve_from_events(self):
+        transport = self.Connect()
+        self.assertEquals(transport.address,
+                          utils.mk_contract_address(tester.a0, 0).encode('hex'));
+        calls = [self.CreateItem(transport) for i in range(5)]
+        transport.Wait()
+
+        item_ids = [c.Result() for c in calls]
+        self.assertEquals(len(set(item_ids)), 5);
+        self.assertFalse(0 in item_ids);
+        self.assertEquals(
+            transport.Constant('GetNumberOfItemsOwnedFor', tester.a1), 5);
+        # The deployment, the schema, the user and the five items.
+        self.assertEquals(transport.calls, 8);
+        self.assertTrue(transport.total_gas > 0);
+
+    def test_rejected_send_does_not_hold_up_later_calls(self):
+        transport = self.Connect()
+        nonce = self.node.Nonce(tester.a0)
+        self.node.hold.clear()
+        # Only the call is refused, not the transfer filling in its nonce.
+        self.node.reject = lambda tx: tx.nonce == nonce + 1 and tx.data
+        calls = [self.CreateItem(transport) for i in range(3)]
+        self.node.hold.set()
+
+        # The call after the refused one is mined without waiting out its
+        # deadline, since the refused nonce gets used up.
+        self.assertRaises(CallFailed, calls[1].Result);
+        self.assertNotEquals(calls[0].Result(), 0);
+        self.assertNotEquals(calls[2].Result(), 0);
+        transport.Wait()
+        self.assertEquals(
+            transport.Constant('GetNumberOfItemsOwnedFor', tester.a1), 2);
+
+    def test_send_whose_connection_drops_is_not_sent_twice(self):
+        transport = self.Connect()
+        nonce = self.node.Nonce(tester.a0)
+        self.node.drop = lambda tx: tx.nonce == nonce
+        self.assertNotEquals(self.CreateItem(transport).Result(), 0);
+        transport.Wait()
+        self.assertEquals(
+            transport.Constant('GetNumberOfItemsOwnedFor', tester.a1), 1);
+
+
+class JsonStreamTest(unittest.TestCase):
+    def test_values_split_at_every_read_boundary(self):
+        doc = ('{"skip": [1.25, -3e-2, {"s": "a\\"b"}, 7.5E+3], "f": 0.5, '
+               '"items": [1.5, 2e3, {"a": 1.25, "b": [true, null]}, -12, 0, '
+               '"x", 3.0e-1]}')
+        expected = json.loads(doc)['items']
+        read_size = json_stream.kReadSize
+        try:
+            for size in range(1, len(doc) + 1):
+                json_stream.kReadSize = size
+                self.assertEquals(
+                    list(json_stream.IterArray(StringIO.StringIO(doc),
+                                               ('items',))),
+                    expected);
+        finally:
+            json_stream.kReadSize = read_size
+
+
+class ImportJournalTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def Record(self, journal, source_id):
+        journal.RecordItem(source_id, source_id, source_id * 2,
+                           {'defindex': 5})
+
+    def test_entries_past_the_checkpoint_are_dropped(self):
+        journal = ImportJournal(self.path)
+        journal.Open()
+        journal.RecordAttribute(142)
+        self.Record(journal, 1)
+        self.assertEquals(journal.Sync(), 1);
+        journal.NextGeneration()
+        self.Record(journal, 2)
+        journal.RecordDeletedItem(1)
+        journal.Close()
+
+        # The chain was only checkpointed at generation 1.
+        journal = ImportJournal(self.path)
+        journal.Open(1)
+        self.assertEquals(journal.attributes, set([142]));
+        self.assertEquals(sorted(journal.items), [1]);
+        self.assertEquals(journal.items[1]['new_id'], 2);
+        self.assertEquals(journal.generation, 2);
+        journal.Close()
+
+    def test_resume_after_resume(self):
+        journal = ImportJournal(self.path)
+        journal.Open()
+        self.Record(journal, 1)
+        journal.Sync()
+        journal.NextGeneration()
+        self.Record(journal, 2)
+        journal.Close()
+
+        # Resuming from generation 1 throws away item 2; the retry records
+        # item 3 as generation 2 instead.
+        journal = ImportJournal(self.path)
+        journal.Open(1)
+        self.Record(journal, 3)
+        journal.Sync()
+        journal.Close()
+
+        journal = ImportJournal(self.path)
+        journal.Open(2)
+        self.assertEquals(sorted(journal.items), [1, 3]);
+        journal.Close()
+
+    def test_torn_last_line(self):
+        journal = ImportJournal(self.path)
+        journal.Open()
+        self.Record(journal, 1)
+        journal.Sync()
+        journal.Close()
+        with open(self.path, 'a') as f:
+            f.write('{"gen": 2, "id": 2, "ki')
+
+        journal = ImportJournal(self.path)
+        journal.Open(1)
+        self.assertEquals(sorted(journal.items), [1]);
+        self.Record(journal, 3)
+        journal.Sync()
+        journal.Close()
+
+        # What came after the torn line isn't lost with it.
+        journal = ImportJournal(self.path)
+        journal.Open(2)
+        self.assertEquals(sorted(journal.items), [1, 3]);
+        journal.Close()
+        with open(self.path) as f:
+            for line in f:
+                json.loads(line)
+
+
+class SchemaIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def Index(self, schema):
+        path = os.path.join(self.directory, 'schema.idx')
+        WriteIndex(schema, path)
+        return SchemaIndex(path)
+
+    def WriteSchemaFile(self, items, attributes):
+        path = os.path.join(self.directory, 'tf2_schema.json')
+        with open(path, 'w') as f:
+            json.dump({'result': {'items': items, 'attributes': attributes}},
+                      f)
+        return path
+
+    def test_round_trip(self):
+        schema = Schema(
+            [{'defindex': 20, 'name': u'caf\xe9', 'min_ilevel': 1,
+              'max_ilevel': 100,
+              'attributes': [{'name': 'x', 'value': 7},
+                             {'name': 'y', 'value': -3},
+                             {'name': 'x', 'value': 1.5},
+                             {'name': 'y', 'value': 'text'},
+                             {'name': 'x', 'value': True},
+                             {'name': 'y', 'value': 2**64},
+                             {'name': 'x', 'value': None}]},
+             {'defindex': 21, 'name': 'x', 'min_ilevel': 5,
+              'max_ilevel': 5}],
+            [{'defindex': 1, 'name': 'x'}, {'defindex': 2, 'name': 'y'}])
+        index = self.Index(schema)
+
+        item = index.items_by_defindex[20]
+        self.assertEquals(item['name'], u'caf\xe9');
+        self.assertEquals((item['min_ilevel'], item['max_ilevel']),
+                          (1, 100));
+        # Only numbers keep their value.
+        self.assertEquals([a['value'] for a in item['attributes']],
+                          [7, -3, 1.5, None, None, None, None]);
+        self.assertEquals([a['name'] for a in item['attributes']],
+                          ['x', 'y'] * 3 + ['x']);
+        self.assertEquals(index.items_by_defindex[21].get('attributes', []),
+                          []);
+        self.assertEquals(index.attributes_by_name['y'],
+                          {'defindex': 2, 'name': 'y'});
+        self.assertEquals(index.attributes_by_defindex[1],
+                          {'defindex': 1, 'name': 'x'});
+        self.assertEquals(sorted(index.items_by_defindex), [20, 21]);
+        self.assertEquals(sorted(index.attributes_by_name), ['x', 'y']);
+
+        # Each name is pooled once, and the multibyte one is measured in
+        # bytes.
+        first = index._ItemRecord(0)
+        second = index._ItemRecord(1)
+        self.assertEquals(first[2], 5);
+        self.assertEquals(second[1:3], index._AttributeRecord(0)[1:]);
+        index.Close()
+
+    def test_colliding_keys(self):
+        # With three items the table has eight slots, and defindexes eight
+        # apart all hash to the same one.
+        schema = Schema(
+            [{'defindex': d, 'name': 'item %d' % d, 'min_ilevel': d % 100,
+              'max_ilevel': 100} for d in (3, 11, 19)],
+            [{'defindex': d, 'name': 'attribute %d' % d}
+             for d in range(1, 100)])
+        index = self.Index(schema)
+
+        for d in (3, 11, 19):
+            self.assertEquals(index.items_by_defindex[d]['name'],
+                              'item %d' % d);
+        self.assertFalse(27 in index.items_by_defindex);
+        for d in range(1, 100):
+            self.assertEquals(
+                index.attributes_by_name['attribute %d' % d]['defindex'], d);
+            self.assertEquals(index.attributes_by_defindex[d]['name'],
+                              'attribute %d' % d);
+        index.Close()
+
+    def test_missing_keys(self):
+        index = self.Index(Schema([], [{'defindex': 1, 'name': 'x'}]))
+        self.assertRaises(KeyError, lambda: index.items_by_defindex[20])
+        self.assertEquals(index.items_by_defindex.get(20, 'none'), 'none');
+        self.assertFalse('z' in index.attributes_by_name);
+        self.assertEquals(index.attributes_by_defindex.get(2), None);
+        self.assertEquals(len(index.items_by_defindex), 0);
+        index.Close()
+
+    def test_stale_index_is_rebuilt(self):
+        cache = os.path.join(self.directory, 'cache')
+        item = {'defindex': 20, 'name': 'a', 'min_ilevel': 1, 'max_ilevel': 5}
+        path = self.WriteSchemaFile([item], [])
+        index = LoadSchemaIndex(path, cache)
+        self.assertEquals(index.items_by_defindex[20]['max_ilevel'], 5);
+        index.Close()
+
+        # A new version of the schema gets its own index.
+        item['max_ilevel'] = 10
+        path = self.WriteSchemaFile([item], [])
+        index = LoadSchemaIndex(path, cache)
+        self.assertEquals(index.items_by_defindex[20]['max_ilevel'], 10);
+        index.Close()
+        self.assertEquals(len(os.listdir(cache)), 2);
+
+        # As does one whose index was written in an older format.
+        index_path = os.path.join(cache, 'schema-%s.idx' % index.sha1)
+        with open(index_path, 'r+b') as f:
+            f.write('TF2SIDX0')
+        index = LoadSchemaIndex(path, cache)
+        self.assertEquals(index.items_by_defindex[20]['max_ilevel'], 10);
+        index.Close()
+
+
+class _FakeTransport(object):
+    total_gas = 3000
+    blocks_used = 2
+
+
+class ImportTelemetryTest(unittest.TestCase):
+    def setUp(self):
+        self.out = StringIO.StringIO()
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def Lines(self):
+        with open(self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_levels(self):
+        for level, expected in [('debug', 'item\nstep 2\n'),
+                                ('info', 'step 2\n'), ('quiet', '')]:
+            out = StringIO.StringIO()
+            telemetry = ImportTelemetry(level, out=out)
+            telemetry.Debug("item")
+            telemetry.Info("step %d", 2)
+            self.assertEquals(out.getvalue(), expected);
+
+    def test_progress_reports(self):
+        telemetry = ImportTelemetry('info', self.path, interval=10,
+                                    out=self.out)
+        telemetry.SetTransport(_FakeTransport())
+        telemetry.Expect(10)
+        telemetry.Phase('import')
+        start = telemetry.start = telemetry._last_report = float(
+            int(telemetry.start))
+
+        telemetry.AddItems(4)
+        telemetry.Tick(start + 9)
+        self.assertEquals(self.Lines(), []);
+        telemetry.Tick(start + 10)
+        [report] = self.Lines()
+        self.assertEquals(report['event'], 'progress');
+        self.assertEquals(report['phase'], 'import');
+        self.assertEquals(report['items_per_second'], 0.4);
+        self.assertEquals(report['gas_per_second'], 300.0);
+        self.assertEquals(report['blocks'], 2);
+        # Six items to go at 0.4 items/s.
+        self.assertEquals(report['eta_seconds'], 15.0);
+        self.assertEquals(self.out.getvalue(),
+                          "import: 4 items, 0.4 items/s, 300 gas/s, 2 blocks, "
+                          "ETA 15s\n");
+
+        # How much of the input was read beats how many items were expected.
+        telemetry.Progress(0.8)
+        telemetry.Report(start + 10)
+        self.assertEquals(self.Lines()[-1]['eta_seconds'], 2.5);
+
+    def test_summary_breaks_down_phases(self):
+        telemetry = ImportTelemetry('info', self.path, out=self.out)
+        telemetry.Phase('parse')
+        telemetry._phase_start -= 2
+        telemetry.Phase('import')
+        telemetry._phase_start -= 3
+        telemetry.AddItems(5)
+        telemetry.Finish()
+
+        summary = self.Lines()[-1]
+        self.assertEquals(summary['event'], 'summary');
+        self.assertEquals(summary['items'], 5);
+        self.assertEquals(sorted(summary['phase_seconds']),
+                          ['import', 'parse']);
+        self.assertTrue(summary['phase_seconds']['import'] >= 3);
+        self.assertTrue(2 <= summary['phase_seconds']['parse'] < 3);
+        # The longest phase comes first.
+        lines = self.out.getvalue().splitlines()
+        self.assertTrue(lines[-2].strip().startswith('import'));
+        self.assertTrue(lines[-1].strip().startswith('parse'));
+
+    def test_open_chain_reports_through_telemetry(self):
+        OpenChain(None, ImportTelemetry('info', out=self.out))
+        self.assertEquals(self.out.getvalue(),
+                          "Creating ethereum context...\n");
+        OpenChain(None, ImportTelemetry('quiet', out=self.out))
+        self.assertEquals(self.out.getvalue(),
+                          "Creating ethereum context...\n");
+
+
+class ImportAccountsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def WriteJson(self, name, value):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            json.dump(value, f)
+        return path
+
+    def test_one_account_fails_alone(self):
+        schema_path = self.WriteJson('tf2_schema.json', {'result': {
+            'items': [{'defindex': 20, 'name': 'a', 'min_ilevel': 1,
+                       'max_ilevel': 5}],
+            'attributes': [{'defindex': d, 'name': 'kills %d' % d}
+                           for d in kModifiableAttributes]}})
+        os.mkdir(os.path.join(self.directory, 'backpacks'))
+        self.WriteJson(os.path.join('backpacks', 'good.json'), {'result': {
+            'items': [{'id': 100 + i, 'original_id': 50 + i, 'defindex': 20,
+                       'level': 3, 'quality': 6, 'origin': 0}
+                      for i in range(2)]}})
+        with open(os.path.join(self.directory, 'backpacks', 'bad.json'),
+                  'w') as f:
+            f.write('{"result": {"items": [{"id": ')
+
+        out = StringIO.StringIO()
+        stdout, sys.stdout = sys.stdout, out
+        try:
+            results, seconds = ImportAccounts(
+                AccountsInDirectory(os.path.join(self.directory, 'backpacks')),
+                1, schema_path, os.path.join(self.directory, 'cache'))
+            PrintSummary(results, seconds)
+        finally:
+            sys.stdout = stdout
+
+        by_account = dict((r['account'], r) for r in results)
+        self.assertEquals(sorted(by_account), ['bad', 'good']);
+        self.assertEquals(by_account['good']['error'], None);
+        self.assertEquals(by_account['good']['items'], 2);
+        self.assertTrue(by_account['good']['gas'] > 0);
+        self.assertTrue(by_account['bad']['error']);
+        self.assertEquals(by_account['bad']['items'], 0);
+
+        lines = out.getvalue().splitlines()
+        self.assertTrue(any(l.startswith('bad') and 'FAILED' in l
+                            for l in lines));
+        self.assertTrue(lines[-1].startswith(
+            "2 accounts (1 failed), 2 items in "));
+
+
+class ImportPlanTest(unittest.TestCase):
+    def test_inherited_attributes_are_shared_between_plans(self):
+        schema = Schema([{'defindex': 94, 'attributes': [{'name': 'paint'}]}],
+                        [{'defindex': 142, 'name': 'paint'},
+                         {'defindex': 214, 'name': 'kills'}])
+        item = {'defindex': 94, 'attributes': [
+            {'defindex': 142, 'value': 1}, {'defindex': 214, 'value': 3}]}
+        inherited = {}
+        plan = BuildPlan(schema, [item], inherited)
+        self.assertEquals(plan.items, [(item, [214], [3])]);
+        self.assertEquals(inherited, {94: set([142])});
+
+        # Later plans use what the first one worked out, without looking at
+        # the schema again.
+        del schema.items_by_defindex[94]
+        plan = BuildPlan(schema, [item], inherited)
+        self.assertEquals(plan.items, [(item, [214], [3])]);
+
+
+class GenerateBackpacksTest(unittest.TestCase):
+    def test_generated_backpacks_are_reproducible(self):
+        model = BackpackModel()
+        model.Learn(IterBackpackItems('raw_tf2_bp.json'))
+
+        first = BackpackGenerator(model, seed=7).Backpack(500, 300)
+        second = BackpackGenerator(model, seed=7).Backpack(500, 300)
+        self.assertEquals(first, second);
+        self.assertNotEquals(
+            first, BackpackGenerator(model, seed=8).Backpack(500, 300));
+
+        items = first['result']['items']
+        self.assertEquals(first['result']['num_backpack_slots'], 500);
+        self.assertEquals(len(set(i['id'] for i in items)), 500);
+        self.assertEquals(items[499]['inventory'] & 0xffff, 500);
+        for item in items:
+            self.assertTrue(item['level'] in model.levels[item['defindex']]);
+            self.assertTrue(
+                item['quality'] in model.qualities[item['defindex']]);
+
+
+class ChainStateTest(BackpackTest):
+    def test_checkpoints_only_append_what_is_new(self):
+        self.assertEquals(self.contract.SetItemSchema(94, 1, 100, 0), kOK);
+        self.assertEquals(self.contract.CreateUser(tester.a1), kOK);
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            writer = CheckpointWriter(path)
+            writer.Save(self.t, {'generation': 1});
+            full = os.path.getsize(path)
+            id = self.contract.CreateNewItem(94, 6, 0, tester.a1);
+            writer.Save(self.t, {'generation': 2});
+            added = os.path.getsize(path) - full
+
+            t, extra = LoadState(path);
+        finally:
+            os.remove(path)
+
+        # The second checkpoint only wrote what the new item added.
+        self.assertTrue(0 < added < full);
+        self.assertEquals(extra, {'generation': 2});
+        contract = AttachContract(t, 'Backpack', self.contract.address)
+        self.assertEquals(contract.GetItemData(id),
+                          self.contract.GetItemData(id));
+
+
+class WorldSnapshotTest(BackpackTest):
+    def test_save_and_load(self):
+        self.assertEquals(self.contract.SetItemSchema(94, 1, 100, 0), kOK);
+        self.assertEquals(self.contract.CreateUser(tester.a1), kOK);
+        id = self.contract.CreateNewItem(94, 6, 0, tester.a1);
+        self.contract.FinalizeItem(id);
+
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            SaveWorld(self.t, path, self.contract.address, {1234: id});
+            t, contract, item_ids = LoadWorld(path);
+
+            # A world saved with another build of the contract isn't loaded.
+            SaveWorld(self.t, path, self.contract.address, {},
+                      code_hash='0' * 40);
+            self.assertRaises(StaleSnapshot, LoadWorld, path);
+        finally:
+            os.remove(path)
+
+        self.assertEquals(item_ids, {1234: id});
+        self.assertEquals(contract.address, self.contract.address);
+        self.assertEquals(contract.GetItemData(id),
+                          self.contract.GetItemData(id));
+        self.assertEquals(contract.GetNumberOfItemsOwnedFor(tester.a1), 1);
+
+        # The loaded world carries on where the saved one left off.
+        self.assertNotEquals(contract.CreateNewItem(94, 6, 0, tester.a1), 0);
+        self.assertEquals(contract.GetNumberOfItemsOwnedFor(tester.a1), 2);
+        self.assertNotEquals(
+            fs.Backpack.create(sender=tester.k0, state=t).address,
+            contract.address);
+
+
+class IndexerTest(BackpackTest):
+    def test_mirror_follows_items(self):
+        indexer = BackpackIndexer(self.t, self.contract.address)
+        self.assertEquals(self.contract.SetAttribute(142, "name",
+                                                     "set item tint RGB"),
+                          kOK);
+        self.assertEquals(self.contract.SetItemSchema(94, 1, 100, 0), kOK);
+        self.assertEquals(self.contract.CreateUser(tester.a1), kOK);
+        self.assertEquals(self.contract.CreateUser(tester.a2), kOK);
+
+        kept = self.contract.CreateNewItem(94, 6, 0, tester.a1);
+        self.contract.SetIntAttribute(kept, 142, 8);
+        self.contract.FinalizeItem(kept);
+        deleted = self.contract.CreateNewItem(94, 6, 0, tester.a1);
+        self.contract.FinalizeItem(deleted);
+        self.assertEquals(indexer.Update(), 7);
+
+        self.assertEquals([i['id'] for i in indexer.Backpack(tester.a1)],
+                          [kept, deleted]);
+        self.assertEquals(indexer.Item(kept)['state'], 1);
+        self.assertEquals(indexer.IntAttribute(kept, 142), 8);
+
+        # Only what happened since the last update is replayed. Logs are read
+        # out of the pending block as well as mined ones, and mining the
+        # pending block doesn't replay what was already read from it.
+        given = self.contract.GiveItemTo(kept, tester.a2, sender=tester.k1);
+        self.contract.DeleteItem(deleted, sender=tester.k1);
+        self.assertEquals(indexer.Update(), 2);
+        self.t.mine()
+        self.assertEquals(indexer.Update(), 0);
+
+        self.assertEquals(indexer.Backpack(tester.a1), []);
+        self.assertEquals(indexer.Item(kept), None);
+        self.assertEquals(indexer.Item(given)['owner'],
+                          tester.a2.encode('hex'));
+        self.assertEquals(indexer.IntAttribute(given, 142), 8);
+        self.assertEquals([i['id'] for i in indexer.ItemsOfDefindex(94)],
+                          [given]);
+        self.assertEquals(indexer.ItemSchema(94)['max_level'], 100);
+        self.assertEquals(indexer.Update(), 0);
+
+    def test_mirror_keeps_uint64_values(self):
+        indexer = BackpackIndexer(self.t, self.contract.address)
+        self.assertEquals(self.contract.SetAttribute(142, "name",
+                                                     "set item tint RGB"),
+                          kOK);
+        self.assertEquals(self.contract.SetItemSchema(94, 1, 100, 0), kOK);
+        self.assertEquals(self.contract.AddIntAttributeToItemSchema(
+            94, 142, 2**63), kOK);
+        self.assertEquals(self.contract.CreateUser(tester.a1), kOK);
+        painted = self.contract.CreateNewItem(94, 6, 0, tester.a1);
+        self.contract.SetIntAttribute(painted, 142, 2**64 - 1);
+        self.contract.FinalizeItem(painted);
+        plain = self.contract.CreateNewItem(94, 6, 0, tester.a1);
+        self.contract.FinalizeItem(plain);
+        indexer.Update()
+
+        self.assertEquals(indexer.IntAttribute(painted, 142), 2**64 - 1);
+        self.assertEquals(indexer.IntAttributes(painted), {142: 2**64 - 1});
+        self.assertEquals(indexer.IntAttribute(plain, 142), 2**63);
+        self.assertEquals(indexer.IntAttribute(plain, 143), 0);
+
+    def test_mirror_follows_modifiable_attributes_and_actions(self):
+        indexer = BackpackIndexer(self.t, self.contract.address)
+        self.assertEquals(self.contract.SetAttributeModifiable(214, True), kOK);
+        self.assertEquals(self.contract.SetAttributeModifiable(215, True), kOK);
+        self.contract.SetAction("Paint", tester.a2);
+        self.contract.SetAction("Restore", tester.a3);
+        self.t.mine()
+        self.assertEquals(indexer.Update(), 4);
+        self.assertTrue(indexer.AttributeModifiable(214));
+        self.assertTrue(indexer.AttributeModifiable(215));
+        self.assertFalse(indexer.AttributeModifiable(142));
+        self.assertEquals(indexer.Action("Paint"), tester.a2.encode('hex'));
+        self.assertEquals(indexer.Action("Restore"), tester.a3.encode('hex'));
+
+        self.assertEquals(self.contract.SetAttributeModifiable(215, False),
+                          kOK);
+        self.contract.SetAction("Restore", 0);
+        self.t.mine()
+        self.assertEquals(indexer.Update(), 2);
+        self.assertFalse(indexer.AttributeModifiable(215));
+        self.assertEquals(indexer.Action("Restore"), None);
+        self.assertEquals(indexer.Action("Paint"), tester.a2.encode('hex'));
+
+        # Without ModifySchema nothing is set, and nothing is logged.
+        self.contract.SetAction("Paint", tester.a3, sender=tester.k1);
+        self.t.mine()
+        self.assertEquals(indexer.Update(), 0);
+
+
+class ContractProfilerTest(BackpackTest):
+    def test_records_gas_and_calls_per_function(self):
+        profiler = ContractProfiler()
+        contract = profiler.Wrap(self.t, self.contract, 'Backpack')
+        self.t.mine()
+        before = self.t.block.gas_used
+        self.assertEquals(contract.SetItemSchema(94, 1, 100, 0), kOK);
+        self.assertEquals(contract.SetItemSchema(95, 1, 100, 0), kOK);
+        self.assertEquals(contract.CreateUser(tester.a1), kOK);
+        self.assertEquals(contract.GetBackpackCapacityFor(tester.a1), 300);
+
+        stats = profiler.stats
+        self.assertEquals(stats['Backpack.SetItemSchema']['calls'], 2);
+        self.assertEquals(stats['Backpack.CreateUser']['calls'], 1);
+        self.assertTrue(stats['Backpack.CreateUser']['gas'] > 0);
+        # Nothing mined in between, so the calls account for all of the
+        # block's gas.
+        self.assertEquals(sum(s['gas'] for s in stats.itervalues()),
+                          self.t.block.gas_used - before);
+        # Attributes which aren't functions aren't wrapped.
+        self.assertEquals(contract.address, self.contract.address);
+
+    def test_records_time_spent_mining(self):
+        profiler = ContractProfiler()
+        s = tester.state()
+        profiler.WrapState(s)
+        profiler.WrapState(s)
+        s.mine()
+        s.mine()
+        self.assertEquals(profiler.stats[kMineName]['calls'], 2);
+        self.assertEquals(profiler.stats[kMineName]['gas'], 0);
+
+    def test_merge_worker_stats(self):
+        profiler = ContractProfiler()
+        profiler.Record('Backpack.CreateUser', 100, 0.5)
+        worker = ContractProfiler()
+        worker.Record('Backpack.CreateUser', 150, 0.25)
+        worker.Record('Backpack.CreateNewItem', 300, 1.0)
+        worker.Record('Backpack.CreateNewItem', 200, 1.0)
+
+        profiler.Merge(worker.stats)
+        self.assertEquals(profiler.stats, {
+            'Backpack.CreateUser': {'calls': 2, 'gas': 250, 'seconds': 0.75},
+            'Backpack.CreateNewItem': {'calls': 2, 'gas': 500,
+                                       'seconds': 2.0},
+        });
+
+        fd, path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            profiler.Write(path)
+            with open(path) as f:
+                rows = json.load(f)
+        finally:
+            os.remove(path)
+        # Slowest first.
+        self.assertEquals([r['function'] for r in rows],
+                          ['Backpack.CreateNewItem', 'Backpack.CreateUser']);
+
+
+class BlockPackerTest(BackpackTest):
+    def test_harness_calls_are_packed(self):
+        calls = self.packer.calls
+        self.assertEquals(self.contract.SetItemSchema(94, 1, 100, 0), kOK);
+        self.assertEquals(self.packer.calls, calls + 1);
+        self.assertTrue(self.packer.estimates['SetItemSchema'] > 0);
+
+    def test_packs_calls_into_blocks(self):
+        self.assertEquals(self.contract.SetItemSchema(94, 1, 100, 0), kOK);
+        self.t.mine()
+
+        packer = BlockPacker(self.t)
+        packed = packer.Wrap(self.contract)
+        packed.CreateNewItem(94, 0, 1, tester.a1);
+        per_call = packer.estimates['CreateNewItem']
+        self.assertTrue(per_call > 0)
+
+        # Leave room for three calls in each block.
+        packer.gas_limit = per_call * 3 + per_call / 2
+        for i in range(5):
+            packed.CreateNewItem(94, 0, 1, tester.a1);
+
+        self.assertEquals(packer.calls, 6)
+        self.assertEquals(packer.blocks_used, 2)
+        self.assertTrue(0 < packer.FillRatio() <= 1)
+        self.assertEquals(self.contract.GetNumberOfItemsOwnedFor(tester.a1), 6)
+
+    def test_passes_through_attributes(self):
+        packer = BlockPacker(self.t)
+        packed = packer.Wrap(self.contract)
+        self.assertEquals(packed.address, self.contract.address)
+        self.assertEquals(packed.CreateUser(tester.a1), kOK);
+        self.assertEquals(packer.calls, 1)
+
+
 class ModifiableAttributeTest(BackpackTest):
     def test_can_add_to_modifiable_attribute(self):
         self.assertEquals(self.contract.SetAttributeModifiable(214, True), kOK);
@@ -406,11 +1790,11 @@ class ModifiableAttributeTest(BackpackTest):
 
 
 class PaintCanTest(BackpackTest):
-    def setUp(self):
-        BackpackTest.setUp(self);
-        self.paint_can = fs.PaintCan.create(sender=tester.k0, state=self.t)
-        self.contract.SetPermission(self.paint_can.address, 4, True);
-        self.assertEquals(self.contract.CreateUser(tester.a1), kOK);
+    @classmethod
+    def SetUpWorld(cls):
+        cls.paint_can = cls.Deploy('PaintCan')
+        cls.contract.SetPermission(cls.paint_can.address, 4, True);
+        CheckOK(cls.contract.CreateUser(tester.a1))
 
 
     def test_paint_can(self):
@@ -465,13 +1849,12 @@ class PaintCanTest(BackpackTest):
 
 
 class RestorePaintJobTest(BackpackTest):
-    def setUp(self):
-        BackpackTest.setUp(self);
-        self.restore = fs.RestorePaintJob.create(sender=tester.k0,
-                                                 state=self.t)
-        self.contract.SetPermission(self.restore.address, 4, True);
-        self.contract.SetAction("RestorePaintJob", self.restore.address);
-        self.assertEquals(self.contract.CreateUser(tester.a1), kOK);
+    @classmethod
+    def SetUpWorld(cls):
+        cls.restore = cls.Deploy('RestorePaintJob')
+        cls.contract.SetPermission(cls.restore.address, 4, True);
+        cls.contract.SetAction("RestorePaintJob", cls.restore.address);
+        CheckOK(cls.contract.CreateUser(tester.a1))
 
     def test_can_restore_paint_job(self):
         self.assertEquals(self.contract.SetAttribute(142, "name",
@@ -496,12 +1879,11 @@ class RestorePaintJobTest(BackpackTest):
 
 
 class TradeCoordinatorTest(BackpackTest):
-    def setUp(self):
-        BackpackTest.setUp(self);
-        self.trade = fs.TradeCoordinator.create(self.contract.address,
-                                                sender=tester.k0, state=self.t)
-        self.assertEquals(self.contract.CreateUser(tester.a1), kOK);
-        self.assertEquals(self.contract.CreateUser(tester.a2), kOK);
+    @classmethod
+    def SetUpWorld(cls):
+        cls.trade = cls.Deploy('TradeCoordinator', cls.contract.address)
+        CheckOK(cls.contract.CreateUser(tester.a1))
+        CheckOK(cls.contract.CreateUser(tester.a2))
 
     def test_can_trade(self):
         # a1 has a Texas Ten Gallon hat.
@@ -534,28 +1916,116 @@ class TradeCoordinatorTest(BackpackTest):
         self.assertEquals(self.GetArrayOfDefindexOfBackpack(tester.a2), [94]);
 
 
+    def MakeItems(self, defindex, user, count):
+        self.assertEquals(self.contract.SetItemSchema(defindex, 1, 100, 0), kOK);
+        first_id = self.contract.ImportItems([defindex] * count, [], user);
+        return [first_id + 2 * i for i in range(count)]
+
+    # Lets tester.a0 exchange |item_ids| on their owner's behalf.
+    def UnlockAll(self, item_ids, owner_key):
+        for item_id in item_ids:
+            self.contract.UnlockItemFor(item_id, tester.a0, sender=owner_key);
+
+    def test_accept_trades(self):
+        hats = self.MakeItems(94, tester.a1, 3)
+        guns = self.MakeItems(442, tester.a2, 3)
+        for gun in guns:
+            self.contract.UnlockItemFor(gun, self.trade.address,
+                                        sender=tester.k2);
+        for hat in hats:
+            self.contract.UnlockItemFor(hat, self.trade.address,
+                                        sender=tester.k1);
+
+        first = self.trade.ProposeTrade(guns[:2], tester.a1, hats[:1],
+                                        sender=tester.k2);
+        second = self.trade.ProposeTrade(guns[2:], tester.a1, hats[1:],
+                                         sender=tester.k2);
+        self.assertEquals(self.trade.AcceptTrades([first, second],
+                                                  sender=tester.k1), 2);
+
+        self.assertEquals(sorted(self.GetArrayOfDefindexOfBackpack(tester.a1)),
+                          [442, 442, 442]);
+        self.assertEquals(sorted(self.GetArrayOfDefindexOfBackpack(tester.a2)),
+                          [94, 94, 94]);
+
+    def test_exchange_validates_everything_first(self):
+        hats = self.MakeItems(94, tester.a1, 2)
+        guns = self.MakeItems(442, tester.a2, 2)
+        self.UnlockAll(hats, tester.k1)
+        self.UnlockAll(guns, tester.k2)
+
+        # The same item twice.
+        self.assertEquals(self.contract.ExchangeItems(
+            tester.a1, [hats[0], hats[0]], tester.a2, guns),
+                          'Can\'t give item'.ljust(32, '\x00'));
+        # An item that isn't a2's.
+        self.assertEquals(self.contract.ExchangeItems(
+            tester.a1, hats[:1], tester.a2, [guns[0], hats[1]]),
+                          'Can\'t give item'.ljust(32, '\x00'));
+        self.assertEquals(self.GetArrayOfItemIdsOfBackpack(tester.a1), hats);
+        self.assertEquals(self.GetArrayOfItemIdsOfBackpack(tester.a2), guns);
+
+    def test_exchange_checks_capacity(self):
+        # a2's backpack is full, so it can take one item for one, but not two.
+        hats = self.MakeItems(94, tester.a1, 2)
+        guns = self.MakeItems(442, tester.a2, 300)
+        self.UnlockAll(hats, tester.k1)
+        self.UnlockAll(guns[:1], tester.k2)
+        self.assertEquals(self.contract.ExchangeItems(
+            tester.a1, hats, tester.a2, guns[:1]),
+                          'Backpack full'.ljust(32, '\x00'));
+        self.assertEquals(self.GetArrayOfItemIdsOfBackpack(tester.a1), hats);
+
+        self.assertEquals(self.contract.ExchangeItems(
+            tester.a1, hats[:1], tester.a2, guns[:1]), kOK);
+        self.assertEquals(sorted(self.GetArrayOfDefindexOfBackpack(tester.a1)),
+                          [94, 442]);
+        self.assertEquals(self.contract.GetNumberOfItemsOwnedFor(tester.a2),
+                          300);
+
+
+    def test_exchange_keeps_backpack_slots(self):
+        # a1 gives two hats from the middle of its backpack for three guns.
+        hats = self.MakeItems(94, tester.a1, 4)
+        guns = self.MakeItems(442, tester.a2, 3)
+        self.UnlockAll(hats[1:3], tester.k1)
+        self.UnlockAll(guns, tester.k2)
+        self.assertEquals(self.contract.ExchangeItems(
+            tester.a1, hats[1:3], tester.a2, guns), kOK);
+        self.assertEquals(self.contract.GetNumberOfItemsOwnedFor(tester.a1),
+                          5);
+        self.assertEquals(sorted(self.GetArrayOfDefindexOfBackpack(tester.a2)),
+                          [94, 94]);
+
+        # Every item is where its slot says, so each can be given away.
+        for item_id in self.GetArrayOfItemIdsOfBackpack(tester.a1):
+            self.assertNotEquals(self.contract.GiveItemTo(
+                item_id, tester.a2, sender=tester.k1), 0);
+        self.assertEquals(self.GetArrayOfItemIdsOfBackpack(tester.a1), []);
+        self.assertEquals(self.contract.GetNumberOfItemsOwnedFor(tester.a2),
+                          7);
+
+
 class CrateTest(BackpackTest):
-    def setUp(self):
-        BackpackTest.setUp(self);
-        self.crate = fs.Crate.create(self.contract.address,
-                                     sender=tester.k0, state=self.t)
-        self.contract.SetPermission(self.crate.address, 3, True);
-        self.contract.SetPermission(self.crate.address, 4, True);
-        self.assertEquals(self.contract.CreateUser(tester.a1), kOK);
+    @classmethod
+    def SetUpWorld(cls):
+        cls.crate = cls.Deploy('Crate', cls.contract.address)
+        cls.contract.SetPermission(cls.crate.address, 3, True);
+        cls.contract.SetPermission(cls.crate.address, 4, True);
+        CheckOK(cls.contract.CreateUser(tester.a1))
 
         for defindex in [175, 142, 128, 130, 247, 248, 5020, 5039, 5040]:
-            self.assertEquals(self.contract.SetItemSchema(defindex, 1, 1, 0), kOK);
+            CheckOK(cls.contract.SetItemSchema(defindex, 1, 1, 0))
 
         # Crate
-        self.assertEquals(self.contract.SetItemSchema(5022, 10, 10,
-                                                      self.crate.address), kOK);
-        self.crate_id = self.contract.CreateNewItem(5022, 0, 1, tester.a1);
-        self.contract.FinalizeItem(self.crate_id);
+        CheckOK(cls.contract.SetItemSchema(5022, 10, 10, cls.crate.address))
+        cls.crate_id = cls.contract.CreateNewItem(5022, 0, 1, tester.a1);
+        cls.contract.FinalizeItem(cls.crate_id);
 
         # Key
-        self.assertEquals(self.contract.SetItemSchema(5021, 5, 5, 0), kOK);
-        self.key_id = self.contract.CreateNewItem(5021, 0, 1, tester.a1);
-        self.contract.FinalizeItem(self.key_id);
+        CheckOK(cls.contract.SetItemSchema(5021, 5, 5, 0))
+        cls.key_id = cls.contract.CreateNewItem(5021, 0, 1, tester.a1);
+        cls.contract.FinalizeItem(cls.key_id);
 
 
     def testCrateWorking(self):
@@ -578,6 +2048,41 @@ class CrateTest(BackpackTest):
         self.assertEquals(self.crate.PerformUncrate(0), kOK);
         self.assertEquals(self.contract.GetNumberOfItemsOwnedFor(tester.a1), 1);
 
+        # The roll is used up.
+        self.assertEquals(self.crate.PerformUncrate(0), 'Wrong block height\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00');
+        self.assertEquals(self.contract.GetNumberOfItemsOwnedFor(tester.a1), 1);
+
+    def testBatchUncrate(self):
+        # Open three crates in the same block; the first one uncrates on its
+        # own and the batch picks up the rest.
+        crates = [(self.crate_id, self.key_id)]
+        for i in range(2):
+            crate_id = self.contract.CreateNewItem(5022, 0, 1, tester.a1);
+            self.contract.FinalizeItem(crate_id);
+            key_id = self.contract.CreateNewItem(5021, 0, 1, tester.a1);
+            self.contract.FinalizeItem(key_id);
+            crates.append((crate_id, key_id))
+        blockheight = self.t.block.number + 2
+        for crate_id, key_id in crates:
+            self.assertEquals(self.contract.UseItem([crate_id, key_id],
+                                                    sender=tester.k1), kOK)
+        self.assertEquals(self.crate.GetOpenRollCount(blockheight), 3);
+
+        self.assertEquals(self.crate.PerformUncrates(blockheight, 10), 0);
+        self.t.mine()
+        self.t.mine()
+        self.t.mine()
+
+        self.assertEquals(self.crate.PerformUncrate(0), kOK);
+        self.assertEquals(self.crate.GetOpenRollCount(blockheight), 2);
+        self.assertEquals(self.crate.PerformUncrates(blockheight, 1), 1);
+        self.assertEquals(self.crate.PerformUncrates(blockheight, 10), 1);
+        self.assertEquals(self.crate.GetOpenRollCount(blockheight), 0);
+        self.assertEquals(self.contract.GetNumberOfItemsOwnedFor(tester.a1), 3);
+
+        # Nothing is left to uncrate.
+        self.assertEquals(self.crate.PerformUncrates(blockheight, 10), 0);
+
     def testCrateNotEnoughBlocks(self):
         # Precommit to receiving an item.
         self.assertEquals(self.contract.UseItem(
@@ -0,0 +1,100 @@
+# Copyright 2015 Dr. Blue.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##############################################################################
+#
+# Decides when to mine while sending a stream of calls to a tester.state().
+#
+# Instead of mining after a fixed number of calls, the packer measures how
+# much gas each call actually used and only mines when the next call isn't
+# expected to fit in the current block. The estimate for a call is the most
+# gas any earlier call to the same function used, unless the caller knows
+# better and passes one in.
+
+from ethereum import tester
+
+# What we assume a call costs before we've seen that function run.
+kDefaultCallGas = 200000
+
+
+class BlockPacker(object):
+  def __init__(self, s, gas_limit=None):
+    self.s = s
+    self.gas_limit = gas_limit or tester.gas_limit
+
+    # Maps function name to the most gas a call to it has used.
+    self.estimates = {}
+
+    self.calls = 0
+    self.total_gas = 0
+    self.blocks_used = 0
+    self._last_block = None
+
+  # Makes sure there's room for |gas| in the current block, mining if there
+  # isn't.
+  def Reserve(self, gas):
+    used = self.s.block.gas_used
+    if used > 0 and used + gas > self.gas_limit:
+      self.s.mine()
+
+  # Calls fn(*args, **kwargs), which is the contract function |name|.
+  def Call(self, name, fn, args=(), kwargs=None, estimate=None):
+    if estimate is None:
+      estimate = self.estimates.get(name, kDefaultCallGas)
+    self.Reserve(estimate)
+
+    block = self.s.block
+    before = block.gas_used
+    result = fn(*args, **(kwargs or {}))
+    # Calls can mine themselves (for example, while checkpointing), in which
+    # case we can't tell what this one used.
+    if self.s.block is block:
+      used = block.gas_used - before
+      self.estimates[name] = max(used, self.estimates.get(name, 0))
+      self.total_gas += used
+      if block is not self._last_block:
+        self.blocks_used += 1
+        self._last_block = block
+    self.calls += 1
+    return result
+
+  # Returns a proxy for |contract| which sends every function call through
+  # Call().
+  def Wrap(self, contract):
+    return _PackedContract(self, contract)
+
+  # The fraction of the gas in the blocks we used which went to our calls.
+  def FillRatio(self):
+    if not self.blocks_used:
+      return 0.0
+    return float(self.total_gas) / (self.blocks_used * self.gas_limit)
+
+  def Report(self):
+    return "%d calls used %d gas in %d blocks (%.1f%% full)." % (
+        self.calls, self.total_gas, self.blocks_used, self.FillRatio() * 100)
+
+
+class _PackedContract(object):
+  def __init__(self, packer, contract):
+    self._packer = packer
+    self._contract = contract
+
+  def __getattr__(self, name):
+    attr = getattr(self._contract, name)
+    if not callable(attr):
+      return attr
+
+    def PackedCall(*args, **kwargs):
+      return self._packer.Call(name, attr, args, kwargs)
+    return PackedCall
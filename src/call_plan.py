@@ -0,0 +1,121 @@
+# Copyright 2015 Dr. Blue.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##############################################################################
+#
+# Works out every call an import will make without touching a chain.
+#
+# PlanTransport stands in for a real transport under BackpackLoader, so a plan
+# goes through exactly the same filtering, schema uploads and batching as an
+# import. Instead of sending each call it records it with its gas estimate,
+# and packs the estimates into blocks the way BlockPacker would. Calls are
+# never carried out, so nothing is journaled while planning.
+#
+# Plans are written as json. `load_backpack.py --from-plan FILE` sends a
+# plan's calls in order, skipping any whose work the journal already has.
+
+import json
+from block_packer import kDefaultCallGas
+from chain_transport import PendingCall
+from ethereum import tester
+
+# Bumped whenever the plan format changes.
+kPlanVersion = 1
+
+
+class PlanTransport(object):
+  def __init__(self, gas_limit=None):
+    self.gas_limit = gas_limit or tester.gas_limit
+    self.address = None
+    self.sender = tester.a0
+
+    # A dict for each call, in the order they'd be sent.
+    self.entries = []
+
+    self.total_gas = 0
+    self.blocks_used = 0
+    self._block_gas = 0
+
+  # Records a call to the contract function |name|. The call never happens,
+  # so it resolves to None without running its callbacks.
+  def Call(self, name, args=(), sender=None, estimate=None, records=None):
+    if sender:
+      raise Exception("Can't plan %s from another sender" % name)
+    if estimate is None:
+      estimate = kDefaultCallGas
+
+    # Start a new block when this call isn't expected to fit in the current
+    # one.
+    if not self.blocks_used or (
+        self._block_gas and self._block_gas + estimate > self.gas_limit):
+      self.blocks_used += 1
+      self._block_gas = 0
+    self._block_gas += estimate
+    self.total_gas += estimate
+
+    entry = {'function': name, 'args': list(args), 'gas': estimate,
+             'block': self.blocks_used - 1}
+    if records is not None:
+      entry['records'] = records
+    self.entries.append(entry)
+
+    pending = PendingCall(name)
+    pending._Resolve(None)
+    return pending
+
+  def Wait(self):
+    pass
+
+  @property
+  def calls(self):
+    return len(self.entries)
+
+  def Report(self):
+    return "%d calls need about %d gas in %d blocks." % (
+        self.calls, self.total_gas, self.blocks_used)
+
+
+# Writes the calls planned by |transport| to |path|, for a schema with the hex
+# |sha1|.
+def WritePlan(path, transport, sha1):
+  plan = {
+      'version': kPlanVersion,
+      'schema_sha1': sha1,
+      'gas_limit': transport.gas_limit,
+      'total_gas': transport.total_gas,
+      'blocks': transport.blocks_used,
+      'calls': transport.entries,
+  }
+  with open(path, 'w') as f:
+    json.dump(plan, f)
+
+
+# json hands back unicode, which the abi encoder doesn't take for bytes32s.
+def _Strings(value):
+  if isinstance(value, unicode):
+    return value.encode('utf-8')
+  if isinstance(value, list):
+    return [_Strings(v) for v in value]
+  if isinstance(value, dict):
+    return dict((_Strings(k), _Strings(v)) for k, v in value.iteritems())
+  return value
+
+
+def LoadPlan(path):
+  with open(path) as f:
+    plan = _Strings(json.load(f))
+  if plan['version'] != kPlanVersion:
+    raise Exception("'%s' is a version %d plan; expected version %d" % (
+        path, plan['version'], kPlanVersion))
+  return plan
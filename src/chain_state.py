@@ -0,0 +1,121 @@
+# Copyright 2015 Dr. Blue.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##############################################################################
+#
+# Saves an ethereum.tester chain to disk and loads it back.
+#
+# The tester keeps every trie node of every block in an in memory key/value
+# store, so the whole chain is that store plus the rlp of the head block. We
+# pickle both. Loading builds a fresh tester.state(), pours the store back in
+# and reverts to the saved head.
+#
+# The store only grows as a chain is built, so re-pickling all of it at every
+# checkpoint of a long import costs more each time. A CheckpointWriter writes
+# the whole store once and afterwards appends only the entries added since
+# its last save, along with the new head. A file is a sequence of those
+# pickled records; loading applies them in order.
+
+import cPickle as pickle
+import json
+import os
+import weakref
+from ethereum import tester
+
+# Maps each chain saved by SaveState() to its CheckpointWriters, by path.
+_writers = weakref.WeakKeyDictionary()
+
+
+def _WriteRecord(f, db, s, extra):
+  pickle.dump({'db': db, 'head': s.snapshot(), 'extra': extra}, f,
+              pickle.HIGHEST_PROTOCOL)
+  f.flush()
+  os.fsync(f.fileno())
+
+
+# Writes the chain in |s| to |path|. |extra| is any picklable metadata the
+# caller wants to keep alongside the chain. The first save of |s| to |path|
+# replaces the file atomically, so a crash while saving leaves the previous
+# file intact; later ones only append what's new.
+def SaveState(s, path, extra=None):
+  writers = _writers.setdefault(s, {})
+  if not path in writers:
+    writers[path] = CheckpointWriter(path)
+  writers[path].Save(s, extra)
+
+
+# Saves the same chain to |path| again and again, each time writing only what
+# changed since the last save.
+class CheckpointWriter(object):
+  def __init__(self, path):
+    self.path = path
+    # The store as of the last save. Values are never copied, so this costs
+    # a dict of references.
+    self._saved = None
+
+  def Save(self, s, extra=None):
+    # Commit the pending block so the head's state root covers everything.
+    s.mine()
+    db = s.db.db
+
+    if self._saved is None:
+      # The first save replaces the file atomically.
+      tmp_path = self.path + '.tmp'
+      with open(tmp_path, 'wb') as f:
+        _WriteRecord(f, db, s, extra)
+      os.rename(tmp_path, self.path)
+      self._saved = dict(db)
+      return
+
+    # Later saves append a record. If a crash tears it, LoadState() stops at
+    # the record before, which is the previous checkpoint.
+    saved = self._saved
+    added = dict((k, v) for k, v in db.iteritems() if saved.get(k) is not v)
+    with open(self.path, 'ab') as f:
+      _WriteRecord(f, added, s, extra)
+    saved.update(added)
+
+
+# Returns (state, extra) for a chain written by SaveState() or a
+# CheckpointWriter.
+def LoadState(path):
+  s = tester.state()
+  data = None
+  with open(path, 'rb') as f:
+    while True:
+      try:
+        record = pickle.load(f)
+      except EOFError:
+        break
+      except Exception:
+        # A record torn by a crash while appending.
+        if data is None:
+          raise
+        break
+      s.db.db.update(record['db'])
+      data = record
+  if data is None:
+    raise Exception("'%s' has no checkpoint in it" % path)
+
+  s.revert(data['head'])
+  return s, data['extra']
+
+
+# Returns a proxy for the already deployed contract |name| at |address|. This
+# is the equivalent of FileContractStore's create(), for contracts which live
+# in a chain we loaded from disk.
+def AttachContract(s, name, address, build_dir='build'):
+  with open(os.path.join(build_dir, name + '.abi')) as f:
+    abi = json.load(f)
+  return tester.ABIContract(s, abi, address)
@@ -0,0 +1,496 @@
+# Copyright 2015 Dr. Blue.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##############################################################################
+#
+# How the loader talks to a Backpack contract.
+#
+# A transport sends calls to the contract and hands back a PendingCall for
+# each, which resolves to the call's return value. TesterTransport runs each
+# call in process on an ethereum.tester chain, so its calls have resolved by
+# the time Call() returns. JsonRpcTransport signs transactions locally and
+# sends them to a node over a pool of HTTP connections, keeping many in flight
+# at once and collecting their receipts in the background.
+#
+# A transaction's return value never makes it into its receipt, so over
+# JSON-RPC the results of the functions in kResultEvents are read back out of
+# the events they log. Other calls resolve to None.
+#
+# Callbacks added to a PendingCall always run on the thread which made the
+# call, from inside Call() or Wait(), so they can safely touch the journal.
+#
+# Call() also takes the |records| the journal will keep for the call once it
+# succeeds. Only call_plan.PlanTransport, which writes them into the plan,
+# looks at them.
+
+import Queue
+import httplib
+import json
+import os
+import socket
+import threading
+import time
+import urlparse
+from multiprocessing.pool import ThreadPool
+import chain_state
+import rlp
+from block_packer import BlockPacker, kDefaultCallGas
+from ethereum import abi, tester, transactions, utils
+
+# Maps a function to (event, field): the function's result is that field of
+# the first such event the call logs, or 0 if it logs none.
+kResultEvents = {
+    'CreateNewItem': ('ItemCreated', 'item_id'),
+    'ImportItem': ('ItemCreated', 'item_id'),
+    'ImportItems': ('ItemCreated', 'item_id'),
+    'OpenForModification': ('ItemReopened', 'new_id'),
+    'GiveItemTo': ('ItemMoved', 'new_id'),
+}
+
+# The gas of a plain transfer, which is all filling a nonce takes.
+kTransferGas = 21000
+
+
+class CallFailed(Exception):
+  pass
+
+
+class PendingCall(object):
+  def __init__(self, name):
+    self.name = name
+    self.tx_hash = None
+    self.startgas = None
+    self.deadline = None
+    self._done = threading.Event()
+    self._result = None
+    self._error = None
+    self._callbacks = []
+    self._callbacks_run = False
+    # Whether the caller has seen the error, so Wait() needn't raise it.
+    self._reported = False
+
+  def Done(self):
+    return self._done.is_set()
+
+  # Blocks until the call is done and returns its result, raising CallFailed
+  # if it failed.
+  def Result(self):
+    self._done.wait()
+    if self._error:
+      self._reported = True
+      raise CallFailed("%s failed: %s" % (self.name, self._error))
+    return self._result
+
+  # Runs fn(result) once the call succeeds.
+  def AddCallback(self, fn):
+    if self._callbacks_run:
+      if not self._error:
+        fn(self._result)
+    else:
+      self._callbacks.append(fn)
+
+  def _Resolve(self, result):
+    self._result = result
+    self._done.set()
+
+  def _Fail(self, error):
+    self._error = error
+    self._done.set()
+
+  # Runs the callbacks of a finished call, or raises its error if nobody has
+  # seen it yet.
+  def _Finish(self):
+    self._callbacks_run = True
+    callbacks, self._callbacks = self._callbacks, []
+    if self._error:
+      if not self._reported:
+        self.Result()
+      return
+    for fn in callbacks:
+      fn(self._result)
+
+
+class TesterTransport(object):
+  def __init__(self, s, contract):
+    self.s = s
+    self.contract = contract
+    self.address = contract.address
+    self.packer = BlockPacker(s)
+    self.gas_limit = self.packer.gas_limit
+    # Calls without a sender come from the tester's default account.
+    self.sender = tester.a0
+
+  # Calls the contract function |name| with |args| from |sender|'s key. The
+  # BlockPacker mines around the call, expecting it to take |estimate| gas.
+  def Call(self, name, args=(), sender=None, estimate=None, records=None):
+    kwargs = {'sender': sender} if sender else {}
+    pending = PendingCall(name)
+    pending._Resolve(self.packer.Call(name, getattr(self.contract, name),
+                                      args, kwargs, estimate=estimate))
+    pending._Finish()
+    return pending
+
+  # Returns the result of the constant function |name|.
+  def Constant(self, name, *args):
+    return getattr(self.contract, name)(*args)
+
+  # Calls have all finished by the time Call() returns.
+  def Wait(self):
+    pass
+
+  def SaveCheckpoint(self, path, extra):
+    chain_state.SaveState(self.s, path, extra)
+
+  @property
+  def calls(self):
+    return self.packer.calls
+
+  @property
+  def total_gas(self):
+    return self.packer.total_gas
+
+  @property
+  def blocks_used(self):
+    return self.packer.blocks_used
+
+  def Report(self):
+    return self.packer.Report()
+
+
+# A fixed set of keep-alive HTTP connections to one JSON-RPC endpoint, shared
+# between threads.
+class _ConnectionPool(object):
+  def __init__(self, url, size, timeout=30):
+    parsed = urlparse.urlparse(url)
+    self.host = parsed.hostname
+    self.port = parsed.port or 80
+    self.path = parsed.path or '/'
+    self.timeout = timeout
+    self.connections = Queue.Queue()
+    for _ in range(size):
+      self.connections.put(None)
+    self.next_id = 0
+    self.lock = threading.Lock()
+
+  def _Post(self, connection, body):
+    connection.request('POST', self.path, body,
+                       {'Content-Type': 'application/json'})
+    return json.loads(connection.getresponse().read())
+
+  # Posts |payload| and returns the decoded response. Unless |retry| is
+  # false, a request which fails on a pooled connection is sent again on a new
+  # one. That's only safe when sending it twice does no harm, since the node
+  # may have seen the first attempt.
+  def Post(self, payload, retry=True):
+    body = json.dumps(payload)
+    connection = self.connections.get()
+    try:
+      if connection is not None:
+        try:
+          return self._Post(connection, body)
+        except (httplib.HTTPException, socket.error):
+          # The node may have closed an idle connection; retry on a new one.
+          connection.close()
+          connection = None
+          if not retry:
+            raise
+      connection = httplib.HTTPConnection(self.host, self.port,
+                                          timeout=self.timeout)
+      try:
+        return self._Post(connection, body)
+      except:
+        connection.close()
+        connection = None
+        raise
+    finally:
+      self.connections.put(connection)
+
+  def _Request(self, method, params):
+    with self.lock:
+      self.next_id += 1
+      return {'jsonrpc': '2.0', 'id': self.next_id, 'method': method,
+              'params': params}
+
+  # Calls |method| with |params|. Takes retry=False, as Post() does.
+  def Rpc(self, method, *params, **kwargs):
+    response = self.Post(self._Request(method, list(params)),
+                         kwargs.get('retry', True))
+    if response.get('error'):
+      raise CallFailed("%s: %s" % (method, response['error']))
+    return response['result']
+
+  # Sends a list of (method, params) in one request. Returns their results in
+  # order, with None for any which failed.
+  def RpcBatch(self, requests):
+    if not requests:
+      return []
+    payload = [self._Request(method, list(params))
+               for method, params in requests]
+    by_id = dict((r['id'], r) for r in self.Post(payload))
+    return [by_id.get(p['id'], {}).get('result') for p in payload]
+
+
+def _Hex(value):
+  return '0x' + value.encode('hex')
+
+
+# A log from a JSON-RPC receipt, shaped like the pyethereum logs which
+# ContractTranslator.listen() decodes.
+class _RpcLog(object):
+  def __init__(self, log):
+    self.address = log['address'][2:].lower()
+    self.topics = [int(t, 16) for t in log['topics']]
+    self.data = log['data'][2:].decode('hex')
+
+
+class JsonRpcTransport(object):
+  def __init__(self, url, contract_abi, address=None, default_key=tester.k0,
+               connections=4, max_in_flight=64, gas_price=1,
+               gas_limit=None, poll_interval=0.2, receipt_timeout=600):
+    self.translator = abi.ContractTranslator(contract_abi)
+    self.address = address
+    self.default_key = default_key
+    self.sender = utils.privtoaddr(default_key)
+    self.gas_price = gas_price
+    self.poll_interval = poll_interval
+    self.receipt_timeout = receipt_timeout
+
+    self.pool = _ConnectionPool(url, connections)
+    # No transaction may ask for more gas than a block holds, which on a real
+    # node is far below the tester's limit.
+    self.gas_limit = gas_limit or int(
+        self.pool.Rpc('eth_getBlockByNumber', 'latest', False)['gasLimit'], 16)
+    self.senders = ThreadPool(connections)
+    self.slots = threading.Semaphore(max_in_flight)
+
+    # Maps a sender's address to the nonce its next transaction gets.
+    self.nonces = {}
+    self.nonce_lock = threading.Lock()
+
+    self.lock = threading.Lock()
+    # Maps the hash of each transaction waiting for a receipt to its call.
+    self.in_flight = {}
+    # Calls which were sent but haven't finished yet.
+    self.outstanding = 0
+    # Finished calls whose callbacks haven't run yet.
+    self.finished = Queue.Queue()
+
+    self.calls = 0
+    self.total_gas = 0
+    self.blocks = set()
+
+    collector = threading.Thread(target=self._CollectReceipts)
+    collector.daemon = True
+    collector.start()
+
+  @property
+  def blocks_used(self):
+    return len(self.blocks)
+
+  def _NextNonce(self, address):
+    with self.nonce_lock:
+      if not address in self.nonces:
+        self.nonces[address] = int(
+            self.pool.Rpc('eth_getTransactionCount', _Hex(address),
+                          'pending'), 16)
+      nonce = self.nonces[address]
+      self.nonces[address] += 1
+      return nonce
+
+  # Signs and queues a transaction to |to| with |data|.
+  def _Transact(self, pending, to, data, sender, startgas):
+    self._RunCallbacks()
+    key = sender or self.default_key
+    pending.sender = utils.privtoaddr(key)
+    pending.nonce = self._NextNonce(pending.sender)
+    tx = transactions.Transaction(pending.nonce, self.gas_price, startgas, to,
+                                  0, data)
+    tx.sign(key)
+    pending.startgas = startgas
+
+    self.slots.acquire()
+    with self.lock:
+      self.outstanding += 1
+    self.senders.apply_async(self._Send,
+                             (pending, rlp.encode(tx), _Hex(tx.hash), key))
+    return pending
+
+  # Sends the signed transaction |raw|, whose hash is |tx_hash|. A send which
+  # loses its connection may still have reached the node, and sending it
+  # again would then fail as already known, so the node is asked whether it
+  # has the transaction before it's sent again.
+  def _Send(self, pending, raw, tx_hash, key):
+    try:
+      try:
+        self.pool.Rpc('eth_sendRawTransaction', _Hex(raw), retry=False)
+      except (httplib.HTTPException, socket.error):
+        if not self.pool.Rpc('eth_getTransactionByHash', tx_hash):
+          self.pool.Rpc('eth_sendRawTransaction', _Hex(raw), retry=False)
+      pending.tx_hash = tx_hash
+      pending.deadline = time.time() + self.receipt_timeout
+      with self.lock:
+        self.in_flight[pending.tx_hash] = pending
+    except Exception as e:
+      pending._Fail(str(e))
+      self._Finished(pending)
+      self._FillNonce(key, pending.nonce)
+
+  # Called when the transaction with |nonce| from |key| never reached the
+  # node. None of the sender's later transactions can be mined until that
+  # nonce is used, so it's used up by an empty transfer to the sender. If
+  # even that can't be sent, the sender's calls waiting behind the gap are
+  # failed now instead of at their deadline, and its nonce is read from the
+  # node again.
+  def _FillNonce(self, key, nonce):
+    address = utils.privtoaddr(key)
+    tx = transactions.Transaction(nonce, self.gas_price, kTransferGas,
+                                  address, 0, '')
+    tx.sign(key)
+    try:
+      self.pool.Rpc('eth_sendRawTransaction', _Hex(rlp.encode(tx)),
+                    retry=False)
+      return
+    except Exception:
+      pass
+
+    with self.nonce_lock:
+      self.nonces.pop(address, None)
+    with self.lock:
+      stuck = [(tx_hash, pending)
+               for tx_hash, pending in self.in_flight.iteritems()
+               if pending.sender == address and pending.nonce > nonce]
+      for tx_hash, _ in stuck:
+        del self.in_flight[tx_hash]
+    for _, pending in stuck:
+      pending._Fail("nonce %d of %s was never sent" % (
+          nonce, address.encode('hex')))
+      self._Finished(pending)
+
+  def _Finished(self, pending):
+    self.finished.put(pending)
+    with self.lock:
+      self.outstanding -= 1
+    self.slots.release()
+
+  def _CollectReceipts(self):
+    while True:
+      time.sleep(self.poll_interval)
+      with self.lock:
+        waiting = self.in_flight.items()
+      if not waiting:
+        continue
+      try:
+        receipts = self.pool.RpcBatch(
+            [('eth_getTransactionReceipt', [tx_hash])
+             for tx_hash, _ in waiting])
+      except Exception:
+        # The node is busy or restarting; try again next time around.
+        continue
+      now = time.time()
+      for (tx_hash, pending), receipt in zip(waiting, receipts):
+        if receipt is None and now < pending.deadline:
+          continue
+        with self.lock:
+          del self.in_flight[tx_hash]
+        if receipt is None:
+          pending._Fail("no receipt for %s" % tx_hash)
+        else:
+          self._Complete(pending, receipt)
+        self._Finished(pending)
+
+  def _Complete(self, pending, receipt):
+    gas = int(receipt['gasUsed'], 16)
+    self.calls += 1
+    self.total_gas += gas
+    self.blocks.add(receipt['blockNumber'])
+    # Nodes from before receipts had a status flag only tell us a call threw
+    # by it using all of its gas.
+    if receipt.get('status') == '0x0' or gas >= pending.startgas:
+      pending._Fail("transaction %s failed" % pending.tx_hash)
+      return
+    if pending.name == '(create)':
+      pending._Resolve(receipt['contractAddress'][2:].lower())
+      return
+
+    result = None
+    if pending.name in kResultEvents:
+      event_type, field = kResultEvents[pending.name]
+      result = 0
+      for log in receipt['logs']:
+        if log['address'][2:].lower() != self.address:
+          continue
+        event = self.translator.listen(_RpcLog(log), noprint=True)
+        if event and event['_event_type'] == event_type:
+          result = event[field]
+          break
+    pending._Resolve(result)
+
+  # Runs the callbacks of every call which has finished.
+  def _RunCallbacks(self):
+    while True:
+      try:
+        pending = self.finished.get_nowait()
+      except Queue.Empty:
+        return
+      pending._Finish()
+
+  # Sends a transaction calling the contract function |name| with |args|,
+  # from |sender|'s key, with |estimate| gas.
+  def Call(self, name, args=(), sender=None, estimate=None, records=None):
+    startgas = min(estimate or kDefaultCallGas, self.gas_limit)
+    data = self.translator.encode(name, list(args))
+    return self._Transact(PendingCall(name), self.address.decode('hex'),
+                          data, sender, startgas)
+
+  # Returns the result of the constant function |name|, as of the pending
+  # block.
+  def Constant(self, name, *args):
+    data = self.translator.encode(name, list(args))
+    result = self.pool.Rpc('eth_call', {'to': '0x' + self.address,
+                                        'data': _Hex(data)}, 'pending')
+    outputs = self.translator.decode(name, result[2:].decode('hex'))
+    return outputs[0] if len(outputs) == 1 else outputs
+
+  # Deploys the contract from its compiled |code| and talks to it from then
+  # on.
+  def Deploy(self, code, sender=None):
+    pending = self._Transact(PendingCall('(create)'), '', code, sender,
+                             self.gas_limit)
+    self.address = pending.Result()
+    self._RunCallbacks()
+    return self.address
+
+  # Blocks until every call has finished and run its callbacks. Raises
+  # CallFailed for any failure the caller hasn't already seen.
+  def Wait(self):
+    while True:
+      with self.lock:
+        idle = self.outstanding == 0
+      if idle and self.finished.empty():
+        return
+      try:
+        self.finished.get(timeout=self.poll_interval)._Finish()
+      except Queue.Empty:
+        pass
+
+  # The node keeps the chain, so a checkpoint only needs |extra|.
+  def SaveCheckpoint(self, path, extra):
+    self.Wait()
+    with open(path + '.tmp', 'w') as f:
+      json.dump(extra, f)
+    os.rename(path + '.tmp', path)
+
+  def Report(self):
+    return "%d calls used %d gas in %d blocks." % (
+        self.calls, self.total_gas, self.blocks_used)
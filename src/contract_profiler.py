@@ -0,0 +1,174 @@
+# Copyright 2015 Dr. Blue.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##############################################################################
+#
+# Records the gas, wall time and number of calls per contract function, and
+# the time spent mining, so it's obvious where a run's time goes.
+#
+# Profiling is off unless the BACKPACK_PROFILE environment variable names a
+# file to write the results to, as csv or, if the name ends in .json, json:
+#
+#   BACKPACK_PROFILE=profile.csv ./load_backpack.py
+#   BACKPACK_PROFILE=profile.json ./backpack_tests.py
+#
+# The results are written, and a summary sorted by time printed, when the
+# process exits. Code which creates contracts passes them through Profile(),
+# which returns them untouched when profiling is off.
+
+import atexit
+import csv
+import json
+import os
+import time
+
+kProfileEnvironmentVariable = 'BACKPACK_PROFILE'
+
+# The name time spent in state.mine() is recorded under.
+kMineName = '(mine)'
+
+kColumns = ['function', 'calls', 'gas', 'seconds']
+
+
+class ContractProfiler(object):
+  def __init__(self):
+    # Maps a function name to {'calls', 'gas', 'seconds'}.
+    self.stats = {}
+
+  def Record(self, name, gas, seconds):
+    stats = self.stats.setdefault(name, {'calls': 0, 'gas': 0,
+                                         'seconds': 0.0})
+    stats['calls'] += 1
+    stats['gas'] += gas
+    stats['seconds'] += seconds
+
+  # Adds the stats of another profiler, as returned by its |stats|.
+  def Merge(self, stats):
+    for name, other in stats.iteritems():
+      mine = self.stats.setdefault(name, {'calls': 0, 'gas': 0,
+                                          'seconds': 0.0})
+      for key in mine:
+        mine[key] += other[key]
+
+  # Calls fn(*args, **kwargs), which is the function |name| of a contract on
+  # the chain |s|, recording its gas and time.
+  def Call(self, s, name, fn, args=(), kwargs=None):
+    block = s.block
+    before = block.gas_used
+    start = time.time()
+    result = fn(*args, **(kwargs or {}))
+    seconds = time.time() - start
+    # As in BlockPacker, we can't tell the gas of a call which mined.
+    gas = block.gas_used - before if s.block is block else 0
+    self.Record(name, gas, seconds)
+    return result
+
+  # Returns a proxy for |contract| which records every function call. The
+  # functions are recorded as "<contract_name>.<function>".
+  def Wrap(self, s, contract, contract_name):
+    return _ProfiledContract(self, s, contract, contract_name)
+
+  # Records the time spent in |s|.mine().
+  def WrapState(self, s):
+    if getattr(s, '_profiled', False):
+      return
+    mine = s.mine
+
+    def ProfiledMine(*args, **kwargs):
+      start = time.time()
+      try:
+        return mine(*args, **kwargs)
+      finally:
+        self.Record(kMineName, 0, time.time() - start)
+    s.mine = ProfiledMine
+    s._profiled = True
+
+  def _Rows(self):
+    rows = []
+    for name, stats in self.stats.iteritems():
+      rows.append(dict(stats, function=name))
+    rows.sort(key=lambda r: -r['seconds'])
+    return rows
+
+  # Writes the stats to |path|, as json if it ends in .json and otherwise as
+  # csv.
+  def Write(self, path):
+    rows = self._Rows()
+    with open(path, 'wb') as f:
+      if path.endswith('.json'):
+        json.dump(rows, f, indent=2)
+      else:
+        writer = csv.DictWriter(f, kColumns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+  def Summary(self):
+    lines = ["%-40s %8s %12s %10s %9s %9s" % (
+        'function', 'calls', 'gas', 'gas/call', 'seconds', 'ms/call')]
+    for r in self._Rows():
+      lines.append("%-40s %8d %12d %10d %9.2f %9.2f" % (
+          r['function'], r['calls'], r['gas'], r['gas'] / r['calls'],
+          r['seconds'], r['seconds'] * 1000 / r['calls']))
+    return '\n'.join(lines)
+
+
+class _ProfiledContract(object):
+  def __init__(self, profiler, s, contract, contract_name):
+    self._profiler = profiler
+    self._s = s
+    self._contract = contract
+    self._contract_name = contract_name
+
+  def __getattr__(self, name):
+    attr = getattr(self._contract, name)
+    if not callable(attr):
+      return attr
+
+    full_name = '%s.%s' % (self._contract_name, name)
+    def ProfiledCall(*args, **kwargs):
+      return self._profiler.Call(self._s, full_name, attr, args, kwargs)
+    return ProfiledCall
+
+
+# The process wide profiler, when profiling is on.
+_profiler = None
+
+
+def _WriteAtExit(path):
+  if not _profiler.stats:
+    return
+  _profiler.Write(path)
+  print _profiler.Summary()
+  print "Wrote profile to '%s'." % path
+
+
+# Returns the process wide profiler, or None when profiling is off.
+def GetProfiler():
+  global _profiler
+  path = os.environ.get(kProfileEnvironmentVariable)
+  if _profiler is None and path:
+    _profiler = ContractProfiler()
+    atexit.register(_WriteAtExit, path)
+  return _profiler
+
+
+# Returns |contract|, which is named |contract_name| and lives on the chain
+# |s|, wrapped so its calls are profiled when profiling is on. Also starts
+# timing |s|.mine().
+def Profile(s, contract, contract_name):
+  profiler = GetProfiler()
+  if profiler is None:
+    return contract
+  profiler.WrapState(s)
+  return profiler.Wrap(s, contract, contract_name)
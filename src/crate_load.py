@@ -0,0 +1,214 @@
+#!/usr/bin/python
+#
+# Copyright 2015 Dr. Blue.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##############################################################################
+#
+# Opens a lot of crates on a test chain and reports how fast they uncrate and
+# how much storage the Crate contract is left holding.
+#
+# Every block, each user is granted some crates and keys and opens them, which
+# precommits a roll two blocks ahead. Once a block's rolls are ready they're
+# uncrated, either one PerformUncrate() per roll or with PerformUncrates() per
+# block height, depending on --mode.
+
+import argparse
+import time
+from ethereum import tester
+from gas_benchmarks import DeployBackpack, DeployContract
+from load_backpack import PackItem
+
+# Up the gas limit because our contract is pretty huge.
+tester.gas_limit = 100000000;
+
+kCrateDefindex = 5022
+kKeyDefindex = 5021
+
+# What Crate can roll.
+kPrizeDefindexes = [175, 142, 128, 130, 247, 248, 5020, 5039, 5040]
+
+kOK = 'OK' + '\x00' * 30
+
+
+# Returns the number of storage slots in use by the contract at |address|.
+def StorageSlots(s, address):
+  return len(s.block.account_to_dict(address)['storage'])
+
+
+class CrateLoad(object):
+  def __init__(self, build_dir, users, mode, max_rolls):
+    self.users = users
+    self.mode = mode
+    self.max_rolls = max_rolls
+
+    self.s = tester.state()
+    self.s.mine()
+    self.c = DeployBackpack(self.s, build_dir)
+    self.crate = DeployContract(self.s, build_dir, 'Crate', ['address'],
+                                [self.c.address])
+    self.c.SetPermission(self.crate.address, 3, True)
+    self.c.SetPermission(self.crate.address, 4, True)
+    for defindex in kPrizeDefindexes:
+      self.c.SetItemSchema(defindex, 1, 1, 0)
+    self.c.SetItemSchema(kCrateDefindex, 10, 10, self.crate.address)
+    self.c.SetItemSchema(kKeyDefindex, 5, 5, 0)
+    for user, _ in users:
+      self.c.CreateUser(user)
+    self.s.mine()
+
+    # Maps block height to the ids of the rolls precommitted to it.
+    self.pending = {}
+    self.next_roll_id = 0
+
+    self.opened = 0
+    self.uncrated = 0
+    self.open_gas = 0
+    self.uncrate_gas = 0
+    self.open_seconds = 0.0
+    self.uncrate_seconds = 0.0
+    self.peak_slots = 0
+
+  # Runs |fn| and returns (result, gas used).
+  def _Measure(self, fn, *args, **kwargs):
+    before = self.s.block.gas_used
+    result = fn(*args, **kwargs)
+    return result, self.s.block.gas_used - before
+
+  # Gives |count| crates and keys to each user, and has them open all of them
+  # in the current block.
+  def OpenCrates(self, count):
+    crate = PackItem({'defindex': kCrateDefindex, 'quality': 0, 'origin': 1,
+                      'level': 10, 'original_id': 0}, 0)
+    key = PackItem({'defindex': kKeyDefindex, 'quality': 0, 'origin': 1,
+                    'level': 5, 'original_id': 0}, 0)
+    blockheight = self.s.block.number + 2
+    rolls = self.pending.setdefault(blockheight, [])
+
+    start = time.time()
+    for user, key_id in self.users:
+      # Prizes pile up, so make room for them along with the new items.
+      needed = self.c.GetNumberOfItemsOwnedFor(user) + 2 * count
+      while self.c.GetBackpackCapacityFor(user) < needed:
+        self.c.AddBackpackCapacityFor(user)
+      first_id = self.c.ImportItems([crate, key] * count, [], user)
+      for i in range(count):
+        crate_id = first_id + 4 * i
+        result, gas = self._Measure(self.c.UseItem, [crate_id, crate_id + 2],
+                                    sender=key_id)
+        assert result == kOK, result
+        self.open_gas += gas
+        rolls.append(self.next_roll_id)
+        self.next_roll_id += 1
+        self.opened += 1
+    self.open_seconds += time.time() - start
+
+  # Uncrates every roll whose block is ready. With |everything|, first mines
+  # until all pending rolls are.
+  def UncrateReady(self, everything=False):
+    if everything and self.pending:
+      while self.s.block.number < max(self.pending) + 1:
+        self.s.mine()
+
+    start = time.time()
+    for blockheight in sorted(self.pending):
+      if self.s.block.number < blockheight + 1:
+        break
+      rolls = self.pending.pop(blockheight)
+      if self.mode == 'single':
+        for roll_id in rolls:
+          result, gas = self._Measure(self.crate.PerformUncrate, roll_id)
+          assert result == kOK, result
+          self.uncrate_gas += gas
+          self.uncrated += 1
+      else:
+        left = len(rolls)
+        while left:
+          count, gas = self._Measure(self.crate.PerformUncrates, blockheight,
+                                     self.max_rolls)
+          assert count > 0
+          self.uncrate_gas += gas
+          self.uncrated += count
+          left -= count
+    self.uncrate_seconds += time.time() - start
+
+  def Run(self, crates, per_block):
+    # Each round opens |per_block| crates per user.
+    rounds = (crates + per_block * len(self.users) - 1) / (
+        per_block * len(self.users))
+    self.slots_before = StorageSlots(self.s, self.crate.address)
+    for i in range(rounds):
+      self.OpenCrates(per_block)
+      self.UncrateReady()
+      self.peak_slots = max(self.peak_slots,
+                            StorageSlots(self.s, self.crate.address))
+      self.s.mine()
+      print "[%d/%d] %d opened, %d uncrated, %d slots" % (
+          i + 1, rounds, self.opened, self.uncrated, self.peak_slots)
+    self.UncrateReady(everything=True)
+    self.s.mine()
+    self.slots_after = StorageSlots(self.s, self.crate.address)
+
+  def Report(self):
+    def Rate(count, seconds):
+      return count / seconds if seconds else 0.0
+    def PerItem(gas, count):
+      return gas / count if count else 0
+
+    return '\n'.join([
+        "Mode: %s" % self.mode,
+        "Opened %d crates in %.1fs: %.1f/s, %d gas each." % (
+            self.opened, self.open_seconds,
+            Rate(self.opened, self.open_seconds),
+            PerItem(self.open_gas, self.opened)),
+        "Uncrated %d rolls in %.1fs: %.1f/s, %d gas each." % (
+            self.uncrated, self.uncrate_seconds,
+            Rate(self.uncrated, self.uncrate_seconds),
+            PerItem(self.uncrate_gas, self.uncrated)),
+        "Crate storage: %d slots before, %d at peak, %d after." % (
+            self.slots_before, self.peak_slots, self.slots_after),
+    ])
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description='Opens crates on a local test chain and measures uncrating '
+      'throughput and storage growth.')
+  parser.add_argument('--build', default='build',
+                      help='The directory the contracts were compiled into.')
+  parser.add_argument('--crates', type=int, default=2000,
+                      help='How many crates to open in total.')
+  parser.add_argument('--users', type=int, default=len(tester.accounts) - 1,
+                      help='How many users open crates.')
+  parser.add_argument('--per-block', type=int, default=20,
+                      help='How many crates each user opens per block.')
+  parser.add_argument('--mode', choices=['single', 'batch'], default='batch',
+                      help='Uncrate with PerformUncrate() per roll, or '
+                      'PerformUncrates() per block.')
+  parser.add_argument('--max-rolls', type=int, default=100,
+                      help='The most rolls to pass to one PerformUncrates().')
+  args = parser.parse_args()
+
+  # tester.a0 owns the contracts, so leave it out.
+  users = zip(tester.accounts, tester.keys)[1:args.users + 1]
+  if not users:
+    parser.error("Need at least one user.")
+
+  load = CrateLoad(args.build, users, args.mode, args.max_rolls)
+  load.Run(args.crates, args.per_block)
+  print load.Report()
+
+
+if __name__ == '__main__':
+  main()
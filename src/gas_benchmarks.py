@@ -0,0 +1,306 @@
+#!/usr/bin/python
+#
+# Copyright 2015 Dr. Blue.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##############################################################################
+#
+# Measures the gas used by Backpack operations as backpacks and items grow.
+#
+# To compare against an older version of the contract, build the old source
+# into another directory and point --build at it. Backpack.sol is the only
+# source, so it can be taken straight out of the revision to compare against:
+#
+#   git show <rev>:src/Backpack.sol > /tmp/Backpack-before.sol
+#   solc --bin --abi /tmp/Backpack-before.sol --optimize -o build-before
+#   make all_contracts
+#   ./gas_benchmarks.py --build build-before
+#   ./gas_benchmarks.py
+#
+# (Or check the revision out beside this one with `git worktree add
+# /tmp/before <rev>` and build /tmp/before/src/Backpack.sol.) Benchmarks of
+# functions the old contract doesn't have are skipped.
+
+import argparse
+import os
+import chain_state
+from ethereum import abi, tester
+from load_backpack import PackItem
+from world_snapshot import LoadWorld, SaveWorld, StaleSnapshot
+
+# Up the gas limit because our contract is pretty huge.
+tester.gas_limit = 100000000;
+
+# The backpack sizes to measure removal at.
+kBackpackSizes = [10, 300, 3000]
+
+# The attribute counts to measure attribute reads and writes at.
+kAttributeCounts = [1, 10, 50]
+
+# The batch sizes to measure item imports and reads at.
+kItemCounts = [1, 50, 200]
+
+# The number of items each side of a trade gives at.
+kTradeSizes = [1, 5, 20]
+
+# Items are created this many at a time through ImportItems.
+kFillBatchSize = 500
+
+kDefindex = 20
+
+
+# Deploys the contract |name| compiled into |build_dir|, passing the
+# constructor |args| of the solidity types |arg_types|.
+def DeployContract(s, build_dir, name, arg_types=(), args=()):
+  with open(os.path.join(build_dir, name + '.bin')) as f:
+    code = f.read().strip().decode('hex')
+  if args:
+    code += abi.encode_abi(list(arg_types), list(args))
+  address = s.evm(code, sender=tester.k0)
+  s.mine()
+  return chain_state.AttachContract(s, name, address, build_dir)
+
+
+def DeployBackpack(s, build_dir):
+  return DeployContract(s, build_dir, 'Backpack')
+
+
+# Returns (gas, result) for calling |fn| in a block of its own.
+def MeasureGas(s, fn, *args, **kwargs):
+  s.mine()
+  before = s.block.gas_used
+  result = fn(*args, **kwargs)
+  return s.block.gas_used - before, result
+
+
+# Returns a new chain with a Backpack in which tester.a1 owns |size| items.
+# Filling a big backpack takes a while, so the world is saved in |build_dir|
+# and loaded from there until the contract is rebuilt.
+def FilledBackpack(build_dir, size):
+  path = os.path.join(build_dir, 'filled-%d.world' % size)
+  if os.path.exists(path):
+    try:
+      s, c, _ = LoadWorld(path, build_dir)
+      return s, c
+    except StaleSnapshot:
+      pass
+
+  s = tester.state()
+  s.mine()
+  c = DeployBackpack(s, build_dir)
+  c.SetItemSchema(kDefindex, 1, 100, 0)
+  c.CreateUser(tester.a1)
+  c.CreateUser(tester.a2)
+  while c.GetBackpackCapacityFor(tester.a1) < size:
+    c.AddBackpackCapacityFor(tester.a1)
+
+  for start in range(0, size, kFillBatchSize):
+    count = min(kFillBatchSize, size - start)
+    item = {'defindex': kDefindex, 'quality': 6, 'origin': 0, 'level': 1,
+            'original_id': 0}
+    s.mine()
+    c.ImportItems([PackItem(item, 0)] * count, [], tester.a1)
+  s.mine()
+  SaveWorld(s, path, c.address, {}, build_dir)
+  return s, c
+
+
+# Gas for removing the item in the last slot of a full backpack, which is the
+# worst case when removal has to search for the item.
+def BenchRemoval(build_dir, size):
+  s, c = FilledBackpack(build_dir, size)
+  results = []
+
+  last = c.GetItemIdFromBackpack(tester.a1, size - 1)
+  gas, _ = MeasureGas(s, c.DeleteItem, last, sender=tester.k1)
+  results.append(('DeleteItem', gas))
+
+  last = c.GetItemIdFromBackpack(tester.a1, size - 2)
+  gas, new_id = MeasureGas(s, c.GiveItemTo, last, tester.a2,
+                           sender=tester.k1)
+  assert new_id != 0
+  results.append(('GiveItemTo', gas))
+  return results
+
+
+# Gas for reading and writing the last attribute on an item with |count|
+# attributes, and for reading an attribute which only its schema sets, which
+# means looking through the item's attributes first.
+def BenchAttributes(build_dir, count):
+  s = tester.state()
+  s.mine()
+  c = DeployBackpack(s, build_dir)
+  defindexes = range(1, count + 2)
+  c.SetAttributes(defindexes, "name", ['attribute'] * len(defindexes))
+  c.SetItemSchema(kDefindex, 1, 100, 0)
+  schema_attribute = defindexes.pop()
+  c.AddIntAttributeToItemSchema(kDefindex, schema_attribute, 1)
+  item_id = c.CreateNewItem(kDefindex, 6, 0, tester.a1)
+  s.mine()
+  c.SetIntAttributes(item_id, defindexes, [5] * count)
+
+  results = []
+  gas, _ = MeasureGas(s, c.SetIntAttribute, item_id, defindexes[-1], 6)
+  results.append(('SetIntAttribute', gas))
+  c.FinalizeItem(item_id)
+  gas, value = MeasureGas(s, c.GetItemIntAttribute, item_id, defindexes[-1])
+  assert value == 6
+  results.append(('GetItemIntAttribute', gas))
+  gas, value = MeasureGas(s, c.GetItemIntAttribute, item_id,
+                          schema_attribute)
+  assert value == 1
+  results.append(('GetItemIntAttribute(schema)', gas))
+
+  c.UnlockItemFor(item_id, tester.a0, sender=tester.k1)
+  item_id = c.OpenForModification(item_id)
+  gas, _ = MeasureGas(s, c.RemoveIntAttribute, item_id, defindexes[-1])
+  results.append(('RemoveIntAttribute', gas))
+  return results
+
+
+# Gas per item for importing |count| items in one ImportItems call, and for
+# reading them back with GetItemData and, where the contract has it,
+# GetItemDataPacked.
+def BenchItems(build_dir, count):
+  s = tester.state()
+  s.mine()
+  c = DeployBackpack(s, build_dir)
+  c.SetItemSchema(kDefindex, 1, 100, 0)
+  c.CreateUser(tester.a1)
+  while c.GetBackpackCapacityFor(tester.a1) < count:
+    c.AddBackpackCapacityFor(tester.a1)
+
+  item = {'defindex': kDefindex, 'quality': 6, 'origin': 0, 'level': 1,
+          'original_id': 0}
+  gas, first_id = MeasureGas(s, c.ImportItems, [PackItem(item, 0)] * count,
+                             [], tester.a1)
+  results = [('ImportItems/item', gas / count)]
+  item_ids = [first_id + 2 * i for i in range(count)]
+
+  s.mine()
+  before = s.block.gas_used
+  for item_id in item_ids:
+    c.GetItemData(item_id)
+  results.append(('GetItemData/item', (s.block.gas_used - before) / count))
+
+  if hasattr(c, 'GetItemDataPacked'):
+    gas, _ = MeasureGas(s, c.GetItemDataPacked, item_ids)
+    results.append(('GetItemDataPacked/item', gas / count))
+  return results
+
+
+# Imports |count| items for each of tester.a1 and tester.a2 and unlocks them
+# for |unlock_for|. Returns the two lists of item ids.
+def TradeItems(s, c, count, unlock_for):
+  item = {'defindex': kDefindex, 'quality': 6, 'origin': 0, 'level': 1,
+          'original_id': 0}
+  sides = []
+  for user, key in [(tester.a1, tester.k1), (tester.a2, tester.k2)]:
+    s.mine()
+    first_id = c.ImportItems([PackItem(item, 0)] * count, [], user)
+    item_ids = [first_id + 2 * i for i in range(count)]
+    for item_id in item_ids:
+      if unlock_for != user:
+        c.UnlockItemFor(item_id, unlock_for, sender=key)
+    sides.append(item_ids)
+  return sides
+
+
+# Gas for a |count| for |count| item trade: accepted through the
+# TradeCoordinator, and, where the contract has it, made with one direct
+# ExchangeItems call. Also the gas for settling |count| one for one trades,
+# accepted one at a time and, where the coordinator has it, all at once with
+# AcceptTrades.
+def BenchTrade(build_dir, count):
+  s = tester.state()
+  s.mine()
+  c = DeployBackpack(s, build_dir)
+  trade = DeployContract(s, build_dir, 'TradeCoordinator', ['address'],
+                         [c.address])
+  c.SetItemSchema(kDefindex, 1, 100, 0)
+  c.CreateUser(tester.a1)
+  c.CreateUser(tester.a2)
+  results = []
+
+  mine, theirs = TradeItems(s, c, count, trade.address)
+  s.mine()
+  trade_id = trade.ProposeTrade(theirs, tester.a1, mine, sender=tester.k2)
+  gas, _ = MeasureGas(s, trade.AcceptTrade, trade_id, sender=tester.k1)
+  # The traded items were given new ids.
+  assert c.GetItemDefindex(mine[0]) == 0
+  results.append(('AcceptTrade', gas))
+
+  if hasattr(c, 'ExchangeItems'):
+    mine, theirs = TradeItems(s, c, count, tester.a1)
+    gas, result = MeasureGas(s, c.ExchangeItems, tester.a1, mine, tester.a2,
+                             theirs, sender=tester.k1)
+    assert result.rstrip('\0') == 'OK'
+    results.append(('ExchangeItems', gas))
+
+  # Each of |count| trades swaps one item for one item.
+  def ProposeTrades():
+    mine, theirs = TradeItems(s, c, count, trade.address)
+    s.mine()
+    return [trade.ProposeTrade([theirs[i]], tester.a1, [mine[i]],
+                               sender=tester.k2) for i in range(count)]
+
+  trade_ids = ProposeTrades()
+  s.mine()
+  before = s.block.gas_used
+  for trade_id in trade_ids:
+    trade.AcceptTrade(trade_id, sender=tester.k1)
+  results.append(('AcceptTrade x size', s.block.gas_used - before))
+
+  if hasattr(trade, 'AcceptTrades'):
+    trade_ids = ProposeTrades()
+    gas, accepted = MeasureGas(s, trade.AcceptTrades, trade_ids,
+                               sender=tester.k1)
+    assert accepted == count
+    results.append(('AcceptTrades', gas))
+  return results
+
+
+# (name, function, sizes) for each benchmark. The function is given the build
+# directory and one size, and returns a list of (operation, gas).
+kBenchmarks = [
+    ('removal', BenchRemoval, kBackpackSizes),
+    ('attributes', BenchAttributes, kAttributeCounts),
+    ('items', BenchItems, kItemCounts),
+    ('trades', BenchTrade, kTradeSizes),
+]
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description='Measures the gas used by Backpack operations.')
+  parser.add_argument('--build', default='build',
+                      help='The directory the contracts were compiled into.')
+  parser.add_argument('--only', action='append',
+                      choices=[b[0] for b in kBenchmarks],
+                      help='Only run these benchmarks.')
+  parser.add_argument('--sizes', type=int, nargs='+',
+                      help='Measure at these sizes instead of the defaults.')
+  args = parser.parse_args()
+
+  print "%-12s %-28s %8s %10s" % ('benchmark', 'operation', 'size', 'gas')
+  for name, bench, sizes in kBenchmarks:
+    if args.only and not name in args.only:
+      continue
+    for size in args.sizes or sizes:
+      for operation, gas in bench(args.build, size):
+        print "%-12s %-28s %8d %10d" % (name, operation, size, gas)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,204 @@
+#!/usr/bin/python
+#
+# Copyright 2015 Dr. Blue.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##############################################################################
+#
+# Writes synthetic backpacks for scale and stress testing.
+#
+# raw_tf2_bp.json is one real backpack of a few hundred items, which is far
+# from a full 3000 slot backpack or thousands of accounts. BackpackModel
+# learns from real backpacks how often each defindex turns up, the qualities
+# and levels each defindex comes in, which attributes its items carry, and
+# the values each attribute takes. BackpackGenerator draws new items from
+# that and writes as many backpacks, of as many items, as a run needs, in the
+# same Steam API format. The output directory can be handed straight to
+# import_accounts.py --backpacks, or any one file to load_backpack.py.
+#
+# Everything is drawn from one random.Random seeded by --seed, so the same
+# arguments always write the same backpacks.
+
+import argparse
+import collections
+import json
+import os
+import random
+from tf2_schema import IterBackpackItems
+
+# Accounts are named by steamid64, counting up from the first one.
+kFirstAccount = 76561197960265728
+
+# Generated item ids start well above any real one.
+kFirstItemId = 10000000000
+
+# The high bit of an item's inventory field says it has a place in the
+# backpack; the low 16 bits are that place, counting from 1.
+kInventoryPlaced = 0x80000000
+
+# The fields of a generated item which are drawn from the model. Everything
+# else is copied from the real item it's based on.
+kDrawnFields = ('id', 'original_id', 'inventory', 'level', 'quality',
+                'attributes')
+
+
+class BackpackModel(object):
+  def __init__(self):
+    # Every real item seen. Basing each generated item on one of these,
+    # picked uniformly, reproduces how often each defindex turns up and
+    # which attributes go with it.
+    self.templates = []
+
+    # Maps a defindex to the quality and level of each of its items.
+    self.qualities = collections.defaultdict(list)
+    self.levels = collections.defaultdict(list)
+
+    # Maps an attribute defindex to every int valued attribute seen with it.
+    self.attribute_values = collections.defaultdict(list)
+
+    # How many items had been modified, and so had a new id.
+    self.modified = 0
+
+  def Learn(self, items):
+    for item in items:
+      self.templates.append(item)
+      self.qualities[item['defindex']].append(item['quality'])
+      self.levels[item['defindex']].append(item['level'])
+      for a in item.get('attributes', []):
+        if type(a['value']) is int:
+          self.attribute_values[a['defindex']].append(a)
+      if item['original_id'] != item['id']:
+        self.modified += 1
+
+  def ModifiedFraction(self):
+    return float(self.modified) / len(self.templates)
+
+
+class BackpackGenerator(object):
+  # |extra_attributes| more int attributes are added to each item, to make
+  # attribute heavy backpacks.
+  def __init__(self, model, seed=0, first_id=kFirstItemId,
+               extra_attributes=0):
+    self.model = model
+    self.random = random.Random(seed)
+    self.next_id = first_id
+    self.extra_attributes = extra_attributes
+    self._attribute_defindexes = sorted(model.attribute_values)
+
+  def _NextId(self):
+    self.next_id += 1
+    return self.next_id - 1
+
+  # Returns a new item in backpack position |slot|.
+  def Item(self, slot):
+    r = self.random
+    template = r.choice(self.model.templates)
+    defindex = template['defindex']
+    item = dict((k, v) for k, v in template.iteritems()
+                if not k in kDrawnFields)
+
+    # A modified item's original_id is an older id than its own.
+    item['original_id'] = self._NextId()
+    if r.random() < self.model.ModifiedFraction():
+      item['id'] = self._NextId()
+    else:
+      item['id'] = item['original_id']
+    item['inventory'] = kInventoryPlaced | (slot + 1)
+    item['quality'] = r.choice(self.model.qualities[defindex])
+    item['level'] = r.choice(self.model.levels[defindex])
+
+    # Keep the template's attributes, but draw new values for the int ones.
+    # The others (custom names and the like) are copied as is.
+    attributes = []
+    for a in template.get('attributes', []):
+      if type(a['value']) is int:
+        a = r.choice(self.model.attribute_values[a['defindex']])
+      attributes.append(a)
+    present = set(a['defindex'] for a in attributes)
+    for _ in range(self.extra_attributes):
+      extra = r.choice(self._attribute_defindexes)
+      if not extra in present:
+        present.add(extra)
+        attributes.append(r.choice(self.model.attribute_values[extra]))
+    if attributes:
+      item['attributes'] = attributes
+    return item
+
+  # Returns a backpack of |item_count| items with room for |slots|.
+  def Backpack(self, item_count, slots):
+    return {
+        'result': {
+            'status': 1,
+            'num_backpack_slots': max(slots, item_count),
+            'items': [self.Item(i) for i in range(item_count)],
+        },
+    }
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description='Writes synthetic TF2 backpacks, drawn from the items of '
+      'real ones, as <steamid>.json files.')
+  parser.add_argument('out_dir')
+  parser.add_argument('--source', action='append',
+                      help='A real backpack to learn from. May be repeated; '
+                      'defaults to raw_tf2_bp.json.')
+  parser.add_argument('--users', type=int, default=10,
+                      help='How many backpacks to write.')
+  parser.add_argument('--items', type=int, default=3000,
+                      help='The most items in a backpack.')
+  parser.add_argument('--min-items', type=int,
+                      help='The fewest items in a backpack. Defaults to '
+                      '--items.')
+  parser.add_argument('--slots', type=int, default=3000,
+                      help='The number of backpack slots to report.')
+  parser.add_argument('--extra-attributes', type=int, default=0,
+                      help='Add up to this many more int attributes to each '
+                      'item.')
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--first-id', type=int, default=kFirstItemId,
+                      help='The first item id to hand out.')
+  args = parser.parse_args()
+
+  min_items = args.items if args.min_items is None else args.min_items
+  if not 0 <= min_items <= args.items:
+    parser.error('--min-items must be between 0 and --items.')
+
+  model = BackpackModel()
+  for path in args.source or ['raw_tf2_bp.json']:
+    model.Learn(IterBackpackItems(path))
+  if not model.templates:
+    parser.error('The source backpacks have no items.')
+  print "Learned from %d items of %d defindexes." % (len(model.templates),
+                                                      len(model.qualities))
+
+  if not os.path.isdir(args.out_dir):
+    os.makedirs(args.out_dir)
+
+  generator = BackpackGenerator(model, args.seed, args.first_id,
+                                args.extra_attributes)
+  total = 0
+  for i in range(args.users):
+    item_count = generator.random.randint(min_items, args.items)
+    backpack = generator.Backpack(item_count, args.slots)
+    path = os.path.join(args.out_dir, '%d.json' % (kFirstAccount + i))
+    with open(path, 'w') as f:
+      json.dump(backpack, f, sort_keys=True)
+    total += item_count
+  print "Wrote %d backpacks with %d items to '%s'." % (args.users, total,
+                                                       args.out_dir)
+
+
+if __name__ == '__main__':
+  main()
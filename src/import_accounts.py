@@ -0,0 +1,238 @@
+#!/usr/bin/python
+#
+# Copyright 2015 Dr. Blue.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##############################################################################
+#
+# Imports the backpacks of many accounts at once.
+#
+# pyethereum is pure python, so a single import never gets more than one core.
+# Accounts don't share anything on chain, though, so we give each account its
+# own test chain and spread the accounts over a pool of worker processes.
+#
+# The accounts come from either a directory of backpack json files, named
+# after the account, or a manifest with one account per line:
+#
+#   <account> <path to backpack json>
+#
+# Blank lines and lines starting with # are ignored.
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from chain_transport import TesterTransport
+from contract_profiler import GetProfiler
+from import_journal import ImportJournal
+from load_backpack import BackpackLoader, OpenChain, StampSchemaVersion
+from schema_index import LoadSchemaIndex
+from tf2_schema import IterBackpackItems
+
+# Set in each worker process by _InitWorker().
+_schema = None
+_journal_dir = None
+_log_dir = None
+
+
+# Returns a list of (account, backpack path) from a directory of backpacks.
+def AccountsInDirectory(path):
+  accounts = []
+  for name in sorted(os.listdir(path)):
+    if name.endswith('.json'):
+      accounts.append((name[:-len('.json')], os.path.join(path, name)))
+  return accounts
+
+
+# Returns a list of (account, backpack path) from a manifest file. Relative
+# paths are relative to the manifest.
+def AccountsInManifest(path):
+  base = os.path.dirname(path)
+  accounts = []
+  with open(path) as f:
+    for line in f:
+      line = line.strip()
+      if not line or line.startswith('#'):
+        continue
+      account, backpack = line.split(None, 1)
+      accounts.append((account, os.path.join(base, backpack)))
+  return accounts
+
+
+def _InitWorker(schema_path, schema_cache, journal_dir, log_dir):
+  global _schema, _journal_dir, _log_dir
+  _schema = LoadSchemaIndex(schema_path, schema_cache)
+  _journal_dir = journal_dir
+  _log_dir = log_dir
+
+
+# Imports one account's backpack onto a chain of its own. Runs in a worker, and
+# returns a dict of results instead of raising, so one bad backpack doesn't
+# stop the others.
+def ImportAccount(account_and_path):
+  account, path = account_and_path
+  result = {'account': account, 'backpack': path, 'items': 0,
+            'seconds': 0.0, 'gas': 0, 'blocks': 0, 'error': None}
+
+  # The loader talks a lot; keep each account's output apart.
+  if _log_dir:
+    log = open(os.path.join(_log_dir, account + '.log'), 'a')
+  else:
+    log = open(os.devnull, 'w')
+  stdout = sys.stdout
+  sys.stdout = log
+
+  start = time.time()
+  try:
+    journal = None
+    checkpoint_path = None
+    if _journal_dir:
+      journal_path = os.path.join(_journal_dir, account + '.journal')
+      journal = ImportJournal(journal_path)
+      checkpoint_path = journal_path + '.chain'
+
+    s, c, generation = OpenChain(checkpoint_path)
+    transport = TesterTransport(s, c)
+    if not StampSchemaVersion(transport, _schema):
+      raise Exception("The chain has a different schema.")
+    if journal:
+      journal.Open(generation)
+
+    loader = BackpackLoader(transport, _schema, journal=journal,
+                            checkpoint_path=checkpoint_path)
+    loader.ImportItems(IterBackpackItems(path))
+    if journal:
+      journal.Close()
+
+    result['items'] = loader.items_imported
+    result['gas'] = transport.total_gas
+    result['blocks'] = transport.blocks_used
+  except Exception:
+    result['error'] = traceback.format_exc()
+  finally:
+    result['seconds'] = time.time() - start
+    sys.stdout = stdout
+    log.close()
+
+  # Workers don't run atexit handlers, so send the profile back to be merged
+  # and written by the parent.
+  profiler = GetProfiler()
+  if profiler:
+    result['profile'] = profiler.stats
+    profiler.stats = {}
+  return result
+
+
+# Imports |accounts| over a pool of |jobs| worker processes, printing a line
+# as each finishes. Returns the results of ImportAccount(), in the order the
+# accounts finished, and how many seconds it all took.
+def ImportAccounts(accounts, jobs, schema_path, schema_cache, journal_dir=None,
+                   log_dir=None):
+  start = time.time()
+  pool = multiprocessing.Pool(
+      jobs, _InitWorker, (schema_path, schema_cache, journal_dir, log_dir))
+  results = []
+  try:
+    for result in pool.imap_unordered(ImportAccount, accounts):
+      results.append(result)
+      if 'profile' in result:
+        GetProfiler().Merge(result.pop('profile'))
+      print "[%d/%d] %s: %s" % (
+          len(results), len(accounts), result['account'],
+          'failed' if result['error'] else '%d items' % result['items'])
+    pool.close()
+  except KeyboardInterrupt:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+  return results, time.time() - start
+
+
+def PrintSummary(results, wall_seconds):
+  print "%-24s %8s %9s %9s %12s %7s" % ('account', 'items', 'seconds',
+                                         'items/s', 'gas', 'blocks')
+  for r in sorted(results, key=lambda r: r['account']):
+    if r['error']:
+      print "%-24s FAILED: %s" % (r['account'],
+                                  r['error'].strip().splitlines()[-1])
+      continue
+    rate = r['items'] / r['seconds'] if r['seconds'] else 0.0
+    print "%-24s %8d %9.1f %9.1f %12d %7d" % (
+        r['account'], r['items'], r['seconds'], rate, r['gas'], r['blocks'])
+
+  items = sum(r['items'] for r in results)
+  failed = len([r for r in results if r['error']])
+  print "%d accounts (%d failed), %d items in %.1fs: %.1f items/s." % (
+      len(results), failed, items, wall_seconds,
+      items / wall_seconds if wall_seconds else 0.0)
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description='Imports the TF2 backpacks of many accounts in parallel, '
+      'each onto its own local test chain.')
+  source = parser.add_mutually_exclusive_group(required=True)
+  source.add_argument('--backpacks',
+                      help='A directory of <account>.json backpack files.')
+  source.add_argument('--manifest',
+                      help='A file listing "<account> <backpack path>" '
+                      'lines.')
+  parser.add_argument('--schema', default='tf2_schema.json')
+  parser.add_argument('--schema-cache', default='build',
+                      help='Where to keep binary indexes of the schema.')
+  parser.add_argument('--jobs', type=int, default=multiprocessing.cpu_count(),
+                      help='How many accounts to import at once.')
+  parser.add_argument('--journal-dir',
+                      help='Keep a resumable journal for each account here.')
+  parser.add_argument('--log-dir',
+                      help="Write each account's loader output here.")
+  parser.add_argument('--results',
+                      help='Also write the per account results to this file '
+                      'as json.')
+  args = parser.parse_args()
+
+  if args.backpacks:
+    accounts = AccountsInDirectory(args.backpacks)
+  else:
+    accounts = AccountsInManifest(args.manifest)
+  for d in (args.journal_dir, args.log_dir):
+    if d and not os.path.isdir(d):
+      os.makedirs(d)
+
+  # Build the schema index once here, rather than having every worker race to
+  # write it.
+  print "Loading schema..."
+  LoadSchemaIndex(args.schema, args.schema_cache).Close()
+
+  print "Importing %d accounts with %d workers..." % (len(accounts),
+                                                      args.jobs)
+  results, wall_seconds = ImportAccounts(
+      accounts, args.jobs, args.schema, args.schema_cache, args.journal_dir,
+      args.log_dir)
+
+  PrintSummary(results, wall_seconds)
+  if args.results:
+    with open(args.results, 'w') as f:
+      json.dump({'accounts': results, 'seconds': wall_seconds}, f, indent=2)
+
+  if any(r['error'] for r in results):
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,129 @@
+# Copyright 2015 Dr. Blue.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##############################################################################
+#
+# An append only journal of what load_backpack.py has already uploaded.
+#
+# Every line is a JSON object. Work is recorded in numbered generations: the
+# loader writes the entries for a generation, then saves a chain checkpoint
+# tagged with that generation number. Only entries whose generation made it
+# into a checkpoint are real; anything later was lost with the process. When
+# the loader resumes from generation N it appends a "resume" entry, which
+# tells later replays to throw away whatever was recorded past N before it.
+
+import json
+import os
+
+
+class ImportJournal(object):
+  def __init__(self, path):
+    self.path = path
+
+    # Attribute and item schema defindexes which are already uploaded.
+    self.attributes = set()
+    self.schema_items = set()
+
+    # Maps an imported item's source id to a record of its original_id, its
+    # new_id on chain, and the fingerprint of what was imported.
+    self.items = {}
+
+    self.generation = 0
+    self._file = None
+
+  # Replays the journal, keeping only the entries covered by the checkpoint
+  # for |generation|, and opens it for appending. Work after that point will
+  # be recorded as |generation| + 1.
+  def Open(self, generation=0):
+    entries = []
+    # The length of the journal up to the end of its last whole entry.
+    length = 0
+    if os.path.exists(self.path):
+      with open(self.path, 'rb') as f:
+        for line in f:
+          # A torn final line from a crash mid write. Lines are only synced
+          # whole, so a line without its newline was never part of a
+          # checkpoint.
+          if not line.endswith('\n'):
+            break
+          if line.strip():
+            try:
+              entry = json.loads(line)
+            except ValueError:
+              break
+            if entry['kind'] == 'resume':
+              entries = [e for e in entries if e['gen'] <= entry['gen']]
+            else:
+              entries.append(entry)
+          length += len(line)
+
+    for entry in entries:
+      if entry['gen'] > generation:
+        continue
+      if entry['kind'] == 'attribute':
+        self.attributes.add(entry['defindex'])
+      elif entry['kind'] == 'schema_item':
+        self.schema_items.add(entry['defindex'])
+      elif entry['kind'] == 'item':
+        self.items[entry['id']] = entry['record']
+      elif entry['kind'] == 'deleted_item':
+        self.items.pop(entry['id'], None)
+
+    self._file = open(self.path, 'a')
+    # Drop any torn line, so new entries don't run on from it.
+    self._file.truncate(length)
+    if entries:
+      self._Write({'kind': 'resume', 'gen': generation})
+    self.generation = generation + 1
+
+  def RecordAttribute(self, defindex):
+    self.attributes.add(defindex)
+    self._Write({'kind': 'attribute', 'gen': self.generation,
+                 'defindex': defindex})
+
+  def RecordSchemaItem(self, defindex):
+    self.schema_items.add(defindex)
+    self._Write({'kind': 'schema_item', 'gen': self.generation,
+                 'defindex': defindex})
+
+  # |fingerprint| is a dict describing what was put on chain, which a later
+  # sync compares against.
+  def RecordItem(self, source_id, original_id, new_id, fingerprint):
+    record = dict(fingerprint, original_id=original_id, new_id=new_id)
+    self.items[source_id] = record
+    self._Write({'kind': 'item', 'gen': self.generation, 'id': source_id,
+                 'record': record})
+
+  def RecordDeletedItem(self, source_id):
+    del self.items[source_id]
+    self._Write({'kind': 'deleted_item', 'gen': self.generation,
+                 'id': source_id})
+
+  # Flushes the current generation to disk. The caller should checkpoint the
+  # chain as |generation| right after this returns, then call NextGeneration.
+  def Sync(self):
+    self._file.flush()
+    os.fsync(self._file.fileno())
+    return self.generation
+
+  def NextGeneration(self):
+    self.generation += 1
+
+  def Close(self):
+    if self._file:
+      self._file.close()
+      self._file = None
+
+  def _Write(self, entry):
+    self._file.write(json.dumps(entry, sort_keys=True) + '\n')
@@ -0,0 +1,98 @@
+# Copyright 2015 Dr. Blue.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##############################################################################
+#
+# Works out everything an import needs before anything is sent to the chain.
+#
+# Walking the backpack once up front gives us the complete set of item schemas
+# and attributes the import depends on, so they can be uploaded in a few bulk
+# calls instead of being discovered one item at a time, and the attributes
+# each item actually needs on chain.
+
+# As a special hack for now, manually load the killeater score attributes and
+# set them to be modifiable. We do this because we want a non-owner to be able
+# to modify these attributes on an item. (This isn't really necessary until
+# later; it is here more as a reminder.)
+kModifiableAttributes = [214, 294, 379, 381, 383, 494]
+
+
+class ImportPlan(object):
+  # |inherited_attributes| caches InheritedAttributes() for |schema|. Pass the
+  # same dict to every plan made from one schema so each item schema's
+  # attributes are only matched up once.
+  def __init__(self, schema, inherited_attributes=None):
+    self.schema = schema
+
+    # The item schema and attribute defindexes the items depend on.
+    self.schema_items = set()
+    self.attributes = set(kModifiableAttributes)
+
+    # A list of (item, attr_keys, attr_values), where attr_keys/attr_values
+    # are the attributes to set on the item instance.
+    self.items = []
+
+    # Maps an item defindex to the attribute defindexes it inherits from its
+    # schema item.
+    if inherited_attributes is None:
+      inherited_attributes = {}
+    self._inherited_attributes = inherited_attributes
+
+  # Returns the set of attribute defindexes which the item schema |defindex|
+  # gives to all its items.
+  def InheritedAttributes(self, defindex):
+    inherited = self._inherited_attributes.get(defindex)
+    if inherited is None:
+      inherited = set()
+      # Each attribute in the item definition doesn't list the defindex. We
+      # instead have to match by name
+      schema_item = self.schema.items_by_defindex[defindex]
+      for item_attr in schema_item.get('attributes', []):
+        inherited.add(
+            self.schema.attributes_by_name[item_attr['name']]['defindex'])
+      self._inherited_attributes[defindex] = inherited
+    return inherited
+
+  # Returns the (keys, values) of the attributes of a backpack item which need
+  # to be set on the item instance.
+  def OnChainAttributes(self, item):
+    # The backpack json format merges inherited attributes into the item
+    # instance deinition. Filter out the real attributes.
+    inherited = self.InheritedAttributes(item['defindex'])
+    attr_keys = []
+    attr_values = []
+    for a in item.get('attributes', []):
+      if not a['defindex'] in inherited:
+        # TODO: For now, only add attributes that are ints.
+        if type(a['value']) is int:
+          attr_keys.append(a['defindex'])
+          attr_values.append(a['value'])
+    return attr_keys, attr_values
+
+  def AddItem(self, item):
+    defindex = item['defindex']
+    self.schema_items.add(defindex)
+    # Uploading an item schema uploads the attributes it inherits, too.
+    self.attributes.update(self.InheritedAttributes(defindex))
+
+    attr_keys, attr_values = self.OnChainAttributes(item)
+    self.attributes.update(attr_keys)
+    self.items.append((item, attr_keys, attr_values))
+
+
+def BuildPlan(schema, items, inherited_attributes=None):
+  plan = ImportPlan(schema, inherited_attributes)
+  for item in items:
+    plan.AddItem(item)
+  return plan
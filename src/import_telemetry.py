@@ -0,0 +1,164 @@
+# Copyright 2015 Dr. Blue.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##############################################################################
+#
+# Progress reporting for BackpackLoader.
+#
+# Printing a line per item was a real share of an import's runtime and still
+# didn't say how fast things were going. Instead, the loader tells the
+# telemetry which phase it's in and how many items it has finished, and every
+# |interval| seconds one progress line goes out with the phase, items/s,
+# gas/s, blocks used and an ETA. At the end a summary breaks the run's time
+# down by phase.
+#
+# The phases are:
+#
+#   parse       reading the backpack and planning a window of it
+#   schema      uploading attributes and item schemas
+#   import      importing (or deleting) items
+#   attributes  rewriting the attributes of modified items
+#   finalize    waiting for calls in flight and checkpointing
+#
+# Lines go to stdout at |level|: 'debug' adds a line per item, 'info' has the
+# progress and summary lines, and 'quiet' prints nothing. Independently, the
+# progress and summary can be appended to |json_path| as one json object per
+# line.
+
+import json
+import sys
+import time
+
+kLevels = {'debug': 0, 'info': 1, 'quiet': 2}
+
+# How often to report progress by default, in seconds.
+kReportInterval = 5.0
+
+
+class ImportTelemetry(object):
+  def __init__(self, level='info', json_path=None, interval=kReportInterval,
+               out=None):
+    self.level = kLevels[level]
+    self.interval = interval
+    self.out = out or sys.stdout
+    self.json = open(json_path, 'a') if json_path else None
+    self.transport = None
+
+    self.items = 0
+    # The number of items expected, or the fraction of the input read so
+    # far, for the ETA.
+    self.expected_items = None
+    self.fraction = None
+
+    # Maps each phase to the seconds spent in it.
+    self.phase_seconds = {}
+    self.phase = None
+
+    self.start = time.time()
+    self._phase_start = self.start
+    self._last_report = self.start
+
+  def _Write(self, line):
+    self.out.write(line + '\n')
+
+  def Debug(self, message, *args):
+    if self.level <= kLevels['debug']:
+      self._Write(message % args if args else message)
+
+  def Info(self, message, *args):
+    if self.level <= kLevels['info']:
+      self._Write(message % args if args else message)
+
+  # Gas and blocks are read from |transport|.
+  def SetTransport(self, transport):
+    self.transport = transport
+
+  def Expect(self, items):
+    self.expected_items = items
+
+  # Records that |fraction| of the input has been read.
+  def Progress(self, fraction):
+    self.fraction = fraction
+
+  def Phase(self, name):
+    now = time.time()
+    if self.phase:
+      self.phase_seconds[self.phase] = (
+          self.phase_seconds.get(self.phase, 0.0) + now - self._phase_start)
+    self.phase = name
+    self._phase_start = now
+    if name:
+      self.Tick(now)
+
+  def AddItems(self, count):
+    self.items += count
+    self.Tick()
+
+  # Reports progress if it's been |interval| seconds since the last report.
+  def Tick(self, now=None):
+    now = now or time.time()
+    if now - self._last_report >= self.interval:
+      self._last_report = now
+      self.Report(now)
+
+  def _Stats(self, now):
+    elapsed = now - self.start
+    gas = self.transport.total_gas if self.transport else 0
+    stats = {
+        'phase': self.phase,
+        'seconds': round(elapsed, 3),
+        'items': self.items,
+        'items_per_second': self.items / elapsed if elapsed else 0.0,
+        'gas': gas,
+        'gas_per_second': gas / elapsed if elapsed else 0.0,
+        'blocks': self.transport.blocks_used if self.transport else 0,
+        'eta_seconds': None,
+    }
+
+    done = self.fraction
+    if done is None and self.expected_items:
+      done = float(self.items) / self.expected_items
+    if done:
+      stats['eta_seconds'] = round(elapsed * max(1 - done, 0) / done, 1)
+    return stats
+
+  def _Emit(self, event, stats):
+    if self.json:
+      self.json.write(json.dumps(dict(stats, event=event)) + '\n')
+      self.json.flush()
+
+  def Report(self, now=None):
+    stats = self._Stats(now or time.time())
+    self._Emit('progress', stats)
+    eta = stats['eta_seconds']
+    self.Info("%s: %d items, %.1f items/s, %d gas/s, %d blocks, ETA %s",
+              stats['phase'], stats['items'], stats['items_per_second'],
+              stats['gas_per_second'], stats['blocks'],
+              '%ds' % eta if eta is not None else 'unknown')
+
+  # Closes the current phase and reports the totals.
+  def Finish(self):
+    self.Phase(None)
+    stats = self._Stats(time.time())
+    stats['phase_seconds'] = self.phase_seconds
+    self._Emit('summary', stats)
+    self.Info("%d items in %.1fs: %.1f items/s, %d gas/s, %d blocks.",
+              stats['items'], stats['seconds'], stats['items_per_second'],
+              stats['gas_per_second'], stats['blocks'])
+    for phase, seconds in sorted(self.phase_seconds.iteritems(),
+                                 key=lambda (p, s): -s):
+      self.Info("  %-10s %8.1fs", phase, seconds)
+    if self.json:
+      self.json.close()
+      self.json = None
@@ -0,0 +1,57 @@
+# Copyright 2015 Dr. Blue.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##############################################################################
+#
+# Decodes the packed item words returned by Backpack.GetItemDataPacked().
+#
+# This mirrors the layout of ItemInstance.packed in Backpack.sol; keep the two
+# in sync.
+
+# (field, bit offset, width), from the low bits up.
+kFields = [
+    ('id', 0, 64),
+    ('original_id', 64, 64),
+    ('defindex', 128, 32),
+    ('level', 160, 16),
+    ('quality', 176, 16),
+    ('origin', 192, 16),
+    ('state', 208, 8),
+    ('backpack_slot', 216, 32),
+]
+
+# Backpack.ItemState, by value.
+kItemStates = ['DOEST_EXIST', 'ITEM_EXISTS', 'UNDER_CONSTRUCTION']
+
+
+# Returns a dict of the fields in the packed item word |packed|. |owner| is
+# added to the record when given.
+def UnpackItem(packed, owner=None):
+  record = {}
+  for name, offset, width in kFields:
+    record[name] = (packed >> offset) & ((1 << width) - 1)
+  if owner is not None:
+    record['owner'] = owner
+  return record
+
+
+def PackItem(record):
+  packed = 0
+  for name, offset, width in kFields:
+    packed |= (record.get(name, 0) & ((1 << width) - 1)) << offset
+  return packed
+
+
+def StateName(record):
+  return kItemStates[record['state']]
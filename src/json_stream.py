@@ -0,0 +1,160 @@
+# Copyright 2015 Dr. Blue.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##############################################################################
+#
+# Reads one array out of a large JSON file, an element at a time.
+#
+# The TF2 schema is tens of megabytes, and json.load() keeps all of it alive
+# while we only need a few fields of two arrays. IterArray() walks down to the
+# array at a path of object keys, skipping over everything else without
+# building it, and yields the array's elements as they're parsed. Only the
+# unconsumed tail of the last read is kept in memory.
+
+import json
+import re
+
+kReadSize = 1 << 16
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'[ \t\n\r]*')
+_structural = re.compile(r'[\[\]{}"]')
+_string_tail = re.compile(r'(?:[^"\\]|\\.)*"', re.DOTALL)
+
+# Characters which can carry on a number, so a number followed by one of them
+# at a read boundary may not be finished.
+_number_chars = frozenset('.eE+-0123456789')
+
+
+class _Stream(object):
+  def __init__(self, f):
+    self.f = f
+    self.buf = ''
+    self.pos = 0
+    self.eof = False
+
+  # Drops the consumed part of the buffer and reads more. Returns False at the
+  # end of the file.
+  def Fill(self):
+    if self.eof:
+      return False
+    data = self.f.read(kReadSize)
+    if not data:
+      self.eof = True
+      return False
+    self.buf = self.buf[self.pos:] + data
+    self.pos = 0
+    return True
+
+  def SkipWhitespace(self):
+    while True:
+      self.pos = _whitespace.match(self.buf, self.pos).end()
+      if self.pos < len(self.buf) or not self.Fill():
+        return
+
+  def Peek(self):
+    self.SkipWhitespace()
+    if self.pos >= len(self.buf):
+      raise ValueError('Unexpected end of JSON')
+    return self.buf[self.pos]
+
+  def Expect(self, c):
+    if self.Peek() != c:
+      raise ValueError('Expected %r, found %r' % (c, self.buf[self.pos]))
+    self.pos += 1
+
+  # Parses and returns the next value.
+  def Decode(self):
+    self.SkipWhitespace()
+    while True:
+      try:
+        value, end = _decoder.raw_decode(self.buf, self.pos)
+        # A number may have been cut short by the end of the buffer, either
+        # right at it or, like "1." or "2e", just before it.
+        if self.eof or (end < len(self.buf) and not (
+            type(value) in (int, long, float) and
+            self.buf[end] in _number_chars)):
+          self.pos = end
+          return value
+      except ValueError:
+        if self.eof:
+          raise
+      self.Fill()
+
+  # Moves past the next value without building it.
+  def Skip(self):
+    if not self.Peek() in '[{"':
+      self.Decode()
+      return
+
+    depth = 0
+    while True:
+      m = _structural.search(self.buf, self.pos)
+      if m is None:
+        self.pos = len(self.buf)
+        if not self.Fill():
+          raise ValueError('Unexpected end of JSON')
+        continue
+
+      c = m.group()
+      self.pos = m.end()
+      if c == '"':
+        self._SkipStringTail()
+        if depth == 0:
+          return
+      elif c in '[{':
+        depth += 1
+      else:
+        depth -= 1
+        if depth == 0:
+          return
+
+  def _SkipStringTail(self):
+    while True:
+      m = _string_tail.match(self.buf, self.pos)
+      if m:
+        self.pos = m.end()
+        return
+      if not self.Fill():
+        raise ValueError('Unterminated string')
+
+
+# Yields the elements of the array found by following the object keys in
+# |path| from the top of the JSON document in |f|.
+def IterArray(f, path):
+  stream = _Stream(f)
+  for key in path:
+    stream.Expect('{')
+    while True:
+      if stream.Peek() == '}':
+        raise KeyError(key)
+      name = stream.Decode()
+      stream.Expect(':')
+      if name == key:
+        break
+      stream.Skip()
+      if stream.Peek() == ',':
+        stream.pos += 1
+
+  stream.Expect('[')
+  if stream.Peek() == ']':
+    return
+  while True:
+    yield stream.Decode()
+    c = stream.Peek()
+    stream.pos += 1
+    if c == ']':
+      return
+    if c != ',':
+      raise ValueError('Expected , or ], found %r' % c)
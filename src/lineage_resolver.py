@@ -0,0 +1,108 @@
+# Copyright 2015 Dr. Blue.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##############################################################################
+#
+# Finds the current ids of items from ids they used to have.
+#
+# An item gets a new id every time it's modified or changes hands, so ids held
+# off chain go stale. Backpack.ResolveItemIds() maps old ids to current ones,
+# and Backpack.ResolveOriginalIds() does the same for the off chain original
+# ids of imported items. Those can collide with chain ids, so the two are
+# looked up and cached apart. The resolver batches those calls and remembers
+# the answers in a bounded LRU cache, so asking about the same items again
+# doesn't go to the chain.
+#
+# A cached answer is only as fresh as the last time it was looked up. When a
+# resolved id turns out to be stale too, Forget() it, or pass refresh=True,
+# and it is looked up again.
+
+import collections
+from backpack_client import kPageSize
+
+# How many ids to remember by default.
+kCacheSize = 10000
+
+
+class LineageResolver(object):
+  def __init__(self, contract, cache_size=kCacheSize, page_size=kPageSize):
+    self.contract = contract
+    self.cache_size = cache_size
+    self.page_size = page_size
+
+    # Maps (contract function, id we were asked about) to the current id it
+    # resolved to, least recently used first.
+    self.cache = collections.OrderedDict()
+
+    self.hits = 0
+    self.misses = 0
+    self.calls = 0
+
+  def _Remember(self, key, current_id):
+    self.cache.pop(key, None)
+    self.cache[key] = current_id
+    if len(self.cache) > self.cache_size:
+      self.cache.popitem(last=False)
+
+  # Resolves |item_ids| with the contract function |lookup|.
+  def _Resolve(self, lookup, item_ids, refresh):
+    resolved = {}
+    missing = []
+    for item_id in item_ids:
+      if item_id in resolved:
+        continue
+      key = (lookup, item_id)
+      if not refresh and key in self.cache:
+        current_id = self.cache.pop(key)
+        self.cache[key] = current_id
+        resolved[item_id] = current_id
+        self.hits += 1
+      else:
+        resolved[item_id] = None
+        missing.append(item_id)
+
+    self.misses += len(missing)
+    for start in range(0, len(missing), self.page_size):
+      page = missing[start:start + self.page_size]
+      self.calls += 1
+      for item_id, current_id in zip(page,
+                                     getattr(self.contract, lookup)(page)):
+        resolved[item_id] = current_id
+        self._Remember((lookup, item_id), current_id)
+    return resolved
+
+  # Returns a dict mapping each of |item_ids|, ids items have had on chain, to
+  # the id the item has now, or 0 if it no longer exists. Ids missing from the
+  # cache, or every id when |refresh| is set, are looked up |page_size| at a
+  # time.
+  def Resolve(self, item_ids, refresh=False):
+    return self._Resolve('ResolveItemIds', item_ids, refresh)
+
+  def ResolveOne(self, item_id, refresh=False):
+    return self.Resolve([item_id], refresh)[item_id]
+
+  # Like Resolve(), for the off chain original ids of imported items.
+  def ResolveOriginal(self, original_ids, refresh=False):
+    return self._Resolve('ResolveOriginalIds', original_ids, refresh)
+
+  def ResolveOriginalOne(self, original_id, refresh=False):
+    return self.ResolveOriginal([original_id], refresh)[original_id]
+
+  def Forget(self, item_ids):
+    for item_id in item_ids:
+      self.cache.pop(('ResolveItemIds', item_id), None)
+
+  def ForgetOriginal(self, original_ids):
+    for original_id in original_ids:
+      self.cache.pop(('ResolveOriginalIds', original_id), None)
@@ -25,131 +25,605 @@
 # previous load_backpack.py script because of improvement in pyethereum. We
 # don't deserve credit here at all. (Though maybe the array usage helps...?)
 
+import argparse
+import itertools
 import json
+import os
+import chain_state
+from call_plan import LoadPlan, PlanTransport, WritePlan
+from chain_transport import JsonRpcTransport, TesterTransport
+from contract_profiler import Profile
 from ethereum import tester
 from ethertdd import FileContractStore
+from import_journal import ImportJournal
+from import_plan import BuildPlan, kModifiableAttributes
+from import_telemetry import ImportTelemetry, kLevels
+from schema_index import LoadSchemaIndex, OnChainVersion, kNoVersion
+from tf2_schema import IntSchemaAttributes, IterBackpackItems
+from world_snapshot import SaveWorld
 
 # Up the gas limit because our contract is pretty huge.
 tester.gas_limit = 100000000;
 
-print "Loading schema..."
-schema_file = open('tf2_schema.json')
-schema_json = json.load(schema_file)['result']
-
-# When parsing the schema, the index into the array schema_json['items'] does
-# not match the 'defindex' position. So build up a defindex dictionary. (Since
-# I don't think I can guarenetee that all defindexes are accounted for?)
-attributes_by_defindex = {}
-attributes_by_name = {}
-items_by_defindex = {}
-for item in schema_json['items']:
-  defindex = item['defindex']
-  items_by_defindex[defindex] = item
-for a in schema_json['attributes']:
-  defindex = a['defindex']
-  attributes_by_defindex[defindex] = a
-  attributes_by_name[a['name']] = a
-
-print "Loaded %d item definitions." % len(schema_json['items'])
-# TODO(drblue): Do more parsing on the schema file.
-
-print "Loading backpack..."
-bp_file = open('raw_tf2_bp.json')
-backpack_json = json.load(bp_file)['result']
-print "Loaded %d items from backpack." % len(backpack_json['items'])
-
-# Create the Backpack contract
-print "Creating ethereum context..."
-s = tester.state()
-s.mine()
-fs = FileContractStore().build
-c = fs.Backpack.create(sender=tester.k0, state=s)
-
-
-def IncrementMineCounter():
-  IncrementMineCounter.calls_since_last_mine += 1;
-  if (IncrementMineCounter.calls_since_last_mine > 30):
-    s.mine()
-    IncrementMineCounter.calls_since_last_mine = 0
-IncrementMineCounter.calls_since_last_mine = 0
-
-
-def EnsureAttribute(defindex):
-  if not defindex in EnsureAttribute.loaded_attributes:
-    a = attributes_by_defindex[defindex]
-    n = a["name"]
-    n = n[:32] if len(n) > 32 else n
-    print ("Loading attribute '%s'..." % n)
-    c.SetAttribute(defindex, "name", n)
-    IncrementMineCounter()
-    EnsureAttribute.loaded_attributes.add(defindex)
-EnsureAttribute.loaded_attributes = set()
-
-
-def EnsureSchemaItem(defindex):
-  if not defindex in EnsureSchemaItem.loaded_item_schema:
-    item = items_by_defindex[defindex]
-    print ("Loading item schema for '%s'..." % item["name"])
-    c.SetItemSchema(defindex, item["min_ilevel"], item["max_ilevel"], 0);
-    IncrementMineCounter()
-    # Upload all the attributes, too:
-    for a in item.get("attributes", {}):
-      EnsureAttribute(attributes_by_name[a["name"]]["defindex"])
-    EnsureSchemaItem.loaded_item_schema.add(defindex);
-EnsureSchemaItem.loaded_item_schema = set();
-
-
-# As a special hack for now, manually load the killeater score attributes a d
-# set them to be modifiable. We do this because we want a non-owner to be able
-# to modify these attributes on an item. (This isn't really necessary until
-# later; it is here more as a reminder.)
-for i in [214, 294, 379, 381, 383, 494]:
-  c.SetAttributeModifiable(i, True)
-  EnsureAttribute(i)
-
-# TODO(drblue): We probably want to increment the backpack space here.
-
-for item in backpack_json['items']:
-  defindex = item['defindex']
-  EnsureSchemaItem(defindex)
-
-  schema_item = items_by_defindex[defindex];
-  schema_attributes_by_defindex = {}
-  if 'attributes' in schema_item:
-    # The backpack json format merges inherited attributes into the item
-    # instance deinition. Filter out the real attributes.
-    for item_attr in schema_item['attributes']:
-      # Each attribute in the item definition doesn't list the defindex. We
-      # instead have to match by name
-      real_attr = attributes_by_name[item_attr['name']]
-      schema_attributes_by_defindex[real_attr['defindex']] = real_attr
-
-  on_item_attr = []
-  if 'attributes' in item:
-    for a in item['attributes']:
-      a_defindex = a['defindex']
-      if not a_defindex in schema_attributes_by_defindex:
-        # TODO: For now, only add attributes that are ints.
-        if type(a['value']) is int:
-          on_item_attr.append({
-              'defindex': a_defindex,
-              'value': a['value'],
-              'name': attributes_by_defindex[a_defindex]['name']})
-
-  # Ensure all the attributes for this item instance are set.
-  attr_keys = []
-  attr_values = []
-  for attr in on_item_attr:
-    EnsureAttribute(attr['defindex'])
-    attr_keys.append(attr['defindex'])
-    attr_values.append(attr['value'])
-
-  old_id = item["id"]
-  new_id = c.ImportItem(item["defindex"], item["quality"],
-                        item["origin"], item["level"], item["original_id"],
-                        tester.a1);
-  print "Imported item id='%s' as id='%s'..." % (item["id"], new_id)
-  if attr_keys:
-    print " - Importing %s attributes onto %s" % (len(attr_keys), new_id);
-    c.SetIntAttributes(new_id, attr_keys, attr_values);
-  c.FinalizeItem(new_id);
+# Items are sent to the contract in batches through ImportItems. These are
+# rough, deliberately pessimistic gas costs for one item and for one attribute
+# on an item, which we use to size batches so that each transaction stays
+# under the gas limit.
+kImportItemGas = 150000
+kImportAttributeGas = 45000
+
+
+# Returns the most gas to put into one batch when a block holds |gas_limit|.
+def BatchGas(gas_limit):
+  return gas_limit * 9 / 10
+
+kImportBatchGas = BatchGas(tester.gas_limit)
+
+# The same for each entry in the bulk schema uploads.
+kSetAttributeGas = 50000
+kSetItemSchemaGas = 30000
+
+# Backpack items are streamed in, planned and imported this many at a time.
+kImportWindowSize = 500
+
+
+# Packs one item into the format that Backpack.ImportItems() expects.
+def PackItem(item, attribute_count):
+  return (item['defindex'] | item['quality'] << 32 | item['origin'] << 48 |
+          item['level'] << 64 | item['original_id'] << 80 |
+          attribute_count << 144)
+
+
+def PackAttribute(defindex, value):
+  return defindex | value << 32
+
+
+# Splits |values| into lists small enough to be uploaded in one call of up to
+# |batch_gas|, when each value costs |gas_per_value|.
+def Chunks(values, gas_per_value, batch_gas=kImportBatchGas):
+  size = max(batch_gas / gas_per_value, 1)
+  for i in range(0, len(values), size):
+    yield values[i:i + size]
+
+
+# Splits the iterable |items| into lists of up to |size| items.
+def Windows(items, size):
+  items = iter(items)
+  while True:
+    window = list(itertools.islice(items, size))
+    if not window:
+      return
+    yield window
+
+
+# The parts of a backpack item which end up on chain. Two snapshots of an item
+# with the same fingerprint don't need any work to sync.
+def Fingerprint(item, attr_keys, attr_values):
+  return {
+      'defindex': item['defindex'],
+      'level': item['level'],
+      'quality': item['quality'],
+      'origin': item['origin'],
+      'attributes': sorted([k, v] for k, v in zip(attr_keys, attr_values)),
+  }
+
+
+# Imports backpacks through a chain_transport. Calls go out without waiting
+# for the ones before them where nothing depends on their results, and the
+# journal records each item once its import has gone through.
+class BackpackLoader(object):
+  def __init__(self, transport, schema, recipient=tester.a1,
+               recipient_key=tester.k1, journal=None, checkpoint_path=None,
+               telemetry=None):
+    self.transport = transport
+    self.telemetry = telemetry or ImportTelemetry()
+    self.telemetry.SetTransport(self.transport)
+    # Batches are sized to the blocks of the chain we're talking to.
+    self.batch_gas = BatchGas(self.transport.gas_limit)
+    self.schema = schema
+    # Shared by the plan of every window, since they all use |schema|.
+    self.inherited_attributes = {}
+    self.recipient = recipient
+    self.recipient_key = recipient_key
+    self.journal = journal
+    self.checkpoint_path = checkpoint_path
+    self.items_imported = 0
+
+    # Maps the source id of each item this loader imported to its id on
+    # chain.
+    self.item_ids = {}
+
+    if journal:
+      self.loaded_attributes = journal.attributes
+      self.loaded_item_schema = journal.schema_items
+    else:
+      self.loaded_attributes = set()
+      self.loaded_item_schema = set()
+
+  # Waits for every call in flight, then saves the chain and marks everything
+  # journaled so far as done.
+  def Checkpoint(self):
+    self.telemetry.Phase('finalize')
+    self.transport.Wait()
+    if self.journal:
+      self.transport.SaveCheckpoint(self.checkpoint_path, {
+          'generation': self.journal.Sync(),
+          'contract': self.transport.address,
+      })
+      self.journal.NextGeneration()
+
+  # Uploads every attribute and item schema in |plan| which isn't on chain
+  # yet, along with the int attributes each item schema gives its items.
+  def UploadSchema(self, plan):
+    self.telemetry.Phase('schema')
+    for i in kModifiableAttributes:
+      if not i in self.loaded_attributes:
+        self.transport.Call('SetAttributeModifiable', (i, True))
+
+    attributes = sorted(plan.attributes - self.loaded_attributes)
+    self.telemetry.Debug("Loading %d attributes...", len(attributes))
+    for chunk in Chunks(attributes, kSetAttributeGas, self.batch_gas):
+      names = [self.schema.attributes_by_defindex[a]['name'][:32]
+               for a in chunk]
+      self.transport.Call('SetAttributes', (chunk, "name", names),
+                          estimate=kSetAttributeGas * len(chunk))
+      self.RecordAttributes(chunk)
+
+    schema_items = sorted(plan.schema_items - self.loaded_item_schema)
+    self.telemetry.Debug("Loading %d item schemas...", len(schema_items))
+    for chunk in Chunks(schema_items, kSetItemSchemaGas, self.batch_gas):
+      items = [self.schema.items_by_defindex[d] for d in chunk]
+      self.transport.Call('SetItemSchemas',
+                          (chunk, [i['min_ilevel'] for i in items],
+                           [i['max_ilevel'] for i in items]),
+                          estimate=kSetItemSchemaGas * len(chunk))
+      for d, item in zip(chunk, items):
+        attributes = IntSchemaAttributes(self.schema, item)
+        for a in sorted(attributes):
+          self.transport.Call('AddIntAttributeToItemSchema',
+                              (d, a, attributes[a]))
+      self.RecordSchemaItems(chunk)
+
+  def RecordAttributes(self, defindexes):
+    for a in defindexes:
+      self.loaded_attributes.add(a)
+      if self.journal:
+        self.journal.RecordAttribute(a)
+
+  def RecordSchemaItems(self, defindexes):
+    for d in defindexes:
+      self.loaded_item_schema.add(d)
+      if self.journal:
+        self.journal.RecordSchemaItem(d)
+
+  def ImportBatch(self, batch, batch_gas):
+    packed_items = []
+    packed_attributes = []
+    records = []
+    for item, attr_keys, attr_values in batch:
+      packed_items.append(PackItem(item, len(attr_keys)))
+      for key, value in zip(attr_keys, attr_values):
+        packed_attributes.append(PackAttribute(key, value))
+      records.append([item['id'], item['original_id'],
+                      Fingerprint(item, attr_keys, attr_values)])
+
+    pending = self.transport.Call(
+        'ImportItems', (packed_items, packed_attributes, self.recipient),
+        estimate=batch_gas, records=records)
+    pending.AddCallback(lambda first_id: self.RecordBatch(records, first_id))
+
+  # Journals the items described by |records|, a list of [source id,
+  # original_id, fingerprint], once ImportItems() gave them ids starting at
+  # |first_id|.
+  def RecordBatch(self, records, first_id):
+    if first_id == 0:
+      raise Exception("ImportItems rejected a batch of %d items" %
+                      len(records))
+
+    self.items_imported += len(records)
+
+    # Ids are handed out consecutively, two apart.
+    for i, (source_id, original_id, fingerprint) in enumerate(records):
+      new_id = first_id + 2 * i
+      self.item_ids[source_id] = new_id
+      self.telemetry.Debug(
+          "Imported item id='%s' as id='%s' with %d attributes...",
+          source_id, new_id, len(fingerprint['attributes']))
+      if self.journal:
+        self.journal.RecordItem(source_id, original_id, new_id, fingerprint)
+    self.telemetry.AddItems(len(records))
+
+  # Imports every item in |items| which the journal doesn't already have.
+  # |items| may be any iterable; it is consumed a window at a time, so the
+  # first items are on chain before the last ones are read.
+  def ImportItems(self, items):
+    if hasattr(items, '__len__'):
+      self.telemetry.Expect(len(items))
+    if self.journal:
+      items = (i for i in items if not i['id'] in self.journal.items)
+    self.telemetry.Phase('parse')
+    for window in Windows(items, kImportWindowSize):
+      plan = BuildPlan(self.schema, window, self.inherited_attributes)
+      self.UploadSchema(plan)
+      self.ImportPlannedItems(plan.items)
+      self.telemetry.Phase('parse')
+
+  # Imports a list of (item, attr_keys, attr_values) whose schema is already
+  # uploaded.
+  def ImportPlannedItems(self, planned_items):
+    # TODO(drblue): We probably want to increment the backpack space here.
+
+    self.telemetry.Phase('import')
+    batch = []
+    batch_gas = 0
+    for item, attr_keys, attr_values in planned_items:
+      item_gas = kImportItemGas + kImportAttributeGas * len(attr_keys)
+      if batch and batch_gas + item_gas > self.batch_gas:
+        self.ImportBatch(batch, batch_gas)
+        batch = []
+        batch_gas = 0
+      batch.append((item, attr_keys, attr_values))
+      batch_gas += item_gas
+
+    if batch:
+      self.ImportBatch(batch, batch_gas)
+    self.Checkpoint()
+
+  # Whether the journal shows the planned |call| has already been made.
+  def PlannedCallDone(self, call):
+    name, args = call['function'], call['args']
+    if name == 'SetAttributeModifiable':
+      return args[0] in self.loaded_attributes
+    if name == 'SetAttributes':
+      return all(a in self.loaded_attributes for a in args[0])
+    if name == 'SetItemSchemas':
+      return all(d in self.loaded_item_schema for d in args[0])
+    if name == 'AddIntAttributeToItemSchema':
+      return args[0] in self.loaded_item_schema
+    if name == 'ImportItems' and self.journal:
+      return all(r[0] in self.journal.items for r in call['records'])
+    return False
+
+  # Makes the calls of a plan written by call_plan.WritePlan(), in order, and
+  # journals them as an import would.
+  def ExecutePlan(self, calls):
+    calls = [c for c in calls if not self.PlannedCallDone(c)]
+    self.telemetry.Expect(sum(len(c['records']) for c in calls
+                              if c['function'] == 'ImportItems'))
+    for call in calls:
+      name, args = call['function'], call['args']
+      self.telemetry.Phase('import' if name == 'ImportItems' else 'schema')
+      pending = self.transport.Call(name, args, estimate=call['gas'])
+      if name == 'SetAttributes':
+        self.RecordAttributes(args[0])
+      elif name == 'SetItemSchemas':
+        self.RecordSchemaItems(args[0])
+      elif name == 'ImportItems':
+        records = call['records']
+        pending.AddCallback(
+            lambda first_id, records=records: self.RecordBatch(records,
+                                                               first_id))
+    self.Checkpoint()
+
+  # Brings the chain in line with a new snapshot of the backpack, given the
+  # journal of the last import or sync. Items are matched by original_id,
+  # since Valve gives an item a new id whenever it is modified. Items whose
+  # defindex, level, quality and origin still match but whose attributes
+  # changed are modified in place; anything else that changed is deleted and
+  # reimported. Like ImportItems(), |items| is consumed a window at a time,
+  # and each window's items are on chain before the next is read. Returns how
+  # many items were new, changed, modified and removed.
+  def Sync(self, items):
+    last_by_original_id = {}
+    for source_id, record in self.journal.items.iteritems():
+      last_by_original_id[record['original_id']] = (source_id, record)
+
+    counts = {'new': 0, 'changed': 0, 'modified': 0}
+    self.telemetry.Phase('parse')
+    for window in Windows(items, kImportWindowSize):
+      plan = BuildPlan(self.schema, window, self.inherited_attributes)
+      self.UploadSchema(plan)
+      self.ImportPlannedItems(
+          self.SyncPlannedItems(plan.items, last_by_original_id, counts))
+      self.telemetry.Phase('parse')
+
+    # Whatever is left is gone from the backpack.
+    for source_id, record in last_by_original_id.itervalues():
+      self.DeleteItem(source_id, record)
+    self.Checkpoint()
+
+    self.telemetry.Info("Sync: %d new, %d changed and reimported, %d "
+                        "modified, %d removed.", counts['new'],
+                        counts['changed'], counts['modified'],
+                        len(last_by_original_id))
+    return dict(counts, removed=len(last_by_original_id))
+
+  # Syncs each planned item against the last import, and returns the planned
+  # items which need importing. Matched items are removed from
+  # |last_by_original_id|, and |counts| is updated with how many items were
+  # new, changed enough to be reimported, or modified in place.
+  def SyncPlannedItems(self, planned_items, last_by_original_id, counts):
+    to_import = []
+    for planned in planned_items:
+      item, attr_keys, attr_values = planned
+      fingerprint = Fingerprint(item, attr_keys, attr_values)
+
+      last = last_by_original_id.pop(item['original_id'], None)
+      if last is None:
+        to_import.append(planned)
+        counts['new'] += 1
+        continue
+
+      source_id, record = last
+      new_id = record['new_id']
+      if (record['defindex'] != fingerprint['defindex'] or
+          record['level'] != fingerprint['level'] or
+          record['quality'] != fingerprint['quality'] or
+          record['origin'] != fingerprint['origin']):
+        self.DeleteItem(source_id, record)
+        to_import.append(planned)
+        counts['changed'] += 1
+        continue
+
+      if fingerprint['attributes'] != record['attributes']:
+        new_id = self.ModifyItem(record, fingerprint)
+        counts['modified'] += 1
+      elif source_id == item['id'] and 'origin' in record:
+        continue
+
+      self.journal.RecordDeletedItem(source_id)
+      self.journal.RecordItem(item['id'], item['original_id'], new_id,
+                              fingerprint)
+    return to_import
+
+  def DeleteItem(self, source_id, record):
+    self.telemetry.Phase('import')
+    self.telemetry.Debug("Deleting item id='%s' (was id='%s')...",
+                         record['new_id'], source_id)
+    self.transport.Call('DeleteItem', (record['new_id'],),
+                        sender=self.recipient_key)
+    self.journal.RecordDeletedItem(source_id)
+    self.telemetry.AddItems(1)
+
+  # Rewrites the attributes of the item described by the journal |record| to
+  # match |fingerprint|, returning the item's new id.
+  def ModifyItem(self, record, fingerprint):
+    self.telemetry.Phase('attributes')
+    old_attributes = dict(record['attributes'])
+    new_attributes = dict(fingerprint['attributes'])
+
+    # We need the owner's permission to open the item. The unlock comes from
+    # another sender, so it has to go through before we can rely on it.
+    self.transport.Call('UnlockItemFor',
+                        (record['new_id'], self.transport.sender),
+                        sender=self.recipient_key).Result()
+    new_id = self.transport.Call('OpenForModification',
+                                 (record['new_id'],)).Result()
+    if new_id == 0:
+      raise Exception("Couldn't open item id='%s'" % record['new_id'])
+
+    for key in old_attributes:
+      if not key in new_attributes:
+        self.transport.Call('RemoveIntAttribute', (new_id, key))
+    changed = [(key, value) for key, value in fingerprint['attributes']
+               if old_attributes.get(key) != value]
+    if changed:
+      self.transport.Call('SetIntAttributes',
+                          (new_id, [k for k, _ in changed],
+                           [v for _, v in changed]))
+    self.transport.Call('FinalizeItem', (new_id,))
+
+    self.telemetry.Debug("Modified item id='%s' as id='%s'...",
+                         record['new_id'], new_id)
+    self.telemetry.AddItems(1)
+    return new_id
+
+
+# Returns (state, contract, generation) for an import, resuming from the
+# checkpoint at |checkpoint_path| when there is one and otherwise creating a
+# new chain with a fresh Backpack contract. Reports what it's doing to
+# |telemetry|.
+def OpenChain(checkpoint_path=None, telemetry=None):
+  telemetry = telemetry or ImportTelemetry()
+  if checkpoint_path and os.path.exists(checkpoint_path):
+    telemetry.Info("Resuming from checkpoint '%s'...", checkpoint_path)
+    s, checkpoint = chain_state.LoadState(checkpoint_path)
+    c = chain_state.AttachContract(s, 'Backpack', checkpoint['contract'])
+    return s, Profile(s, c, 'Backpack'), checkpoint['generation']
+
+  # Create the Backpack contract
+  telemetry.Info("Creating ethereum context...")
+  s = tester.state()
+  s.mine()
+  fs = FileContractStore().build
+  c = fs.Backpack.create(sender=tester.k0, state=s)
+  return s, Profile(s, c, 'Backpack'), 0
+
+
+# Returns (transport, generation) for an import into the Backpack contract at
+# |address| on the node at |url|. Resumes from the checkpoint at
+# |checkpoint_path| when there is one, and deploys a new contract from
+# |build_dir| when there's neither a checkpoint nor an |address|. Reports
+# what it's doing to |telemetry|. |options| are passed on to JsonRpcTransport.
+def OpenRpcChain(url, checkpoint_path=None, address=None, build_dir='build',
+                 telemetry=None, **options):
+  telemetry = telemetry or ImportTelemetry()
+  with open(os.path.join(build_dir, 'Backpack.abi')) as f:
+    transport = JsonRpcTransport(url, json.load(f), **options)
+
+  generation = 0
+  if checkpoint_path and os.path.exists(checkpoint_path):
+    telemetry.Info("Resuming from checkpoint '%s'...", checkpoint_path)
+    with open(checkpoint_path) as f:
+      checkpoint = json.load(f)
+    address = checkpoint['contract']
+    generation = checkpoint['generation']
+
+  if address:
+    transport.address = address.lower().replace('0x', '')
+  else:
+    telemetry.Info("Deploying Backpack to %s...", url)
+    with open(os.path.join(build_dir, 'Backpack.bin')) as f:
+      transport.Deploy(f.read().strip().decode('hex'))
+    telemetry.Info("Deployed at 0x%s.", transport.address)
+  return transport, generation
+
+
+# Records |schema| as the chain's schema version if it doesn't have one yet.
+# Returns False if the chain was loaded from a different schema.
+#
+# Uploads only add what's missing, so they can't bring older definitions
+# already on chain up to date.
+def StampSchemaVersion(transport, schema):
+  live_version = transport.Constant('GetSchemaVersion')
+  if live_version == kNoVersion:
+    transport.Call('SetSchemaVersion', (OnChainVersion(schema.sha1),)).Result()
+    return True
+  return live_version == OnChainVersion(schema.sha1)
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description='Imports a TF2 backpack onto a local test chain.')
+  parser.add_argument('--schema', default='tf2_schema.json')
+  parser.add_argument('--backpack', default='raw_tf2_bp.json')
+  parser.add_argument('--schema-cache', default='build',
+                      help='Where to keep binary indexes of the schema.')
+  parser.add_argument('--journal',
+                      help='Record progress in this journal, checkpointing '
+                      'the chain next to it. If the journal already exists, '
+                      'resume the import where it left off.')
+  parser.add_argument('--sync', action='store_true',
+                      help='Instead of importing, make the chain recorded in '
+                      '--journal match the backpack.')
+  parser.add_argument('--snapshot', metavar='FILE',
+                      help='Once done, save the world to FILE so it can be '
+                      'loaded with world_snapshot.LoadWorld().')
+  parser.add_argument('--plan-only', metavar='FILE',
+                      help="Don't import; write every call the import would "
+                      'make, with gas estimates, to FILE.')
+  parser.add_argument('--from-plan', metavar='FILE',
+                      help='Make the calls planned in FILE instead of '
+                      'reading --backpack.')
+  parser.add_argument('--log-level', choices=sorted(kLevels),
+                      default='info',
+                      help="'debug' prints a line per item; 'quiet' prints "
+                      'nothing.')
+  parser.add_argument('--report-interval', type=float, default=5.0,
+                      help='Seconds between progress reports.')
+  parser.add_argument('--telemetry', metavar='FILE',
+                      help='Also append progress reports to FILE as one json '
+                      'object per line.')
+  rpc = parser.add_argument_group(
+      'JSON-RPC', 'Import into a node instead of a local test chain.')
+  rpc.add_argument('--rpc', metavar='URL',
+                   help="The node's JSON-RPC endpoint.")
+  rpc.add_argument('--contract',
+                   help='The address of the Backpack contract. Deploys a new '
+                   'one if neither this nor a checkpoint is given.')
+  rpc.add_argument('--owner-key',
+                   help="The hex private key of the contract's owner.")
+  rpc.add_argument('--connections', type=int, default=4,
+                   help='How many HTTP connections to keep open.')
+  rpc.add_argument('--in-flight', type=int, default=64,
+                   help='The most transactions to have waiting for receipts.')
+  rpc.add_argument('--gas-price', type=int, default=1)
+  rpc.add_argument('--gas-limit', type=int,
+                   help="The node's block gas limit, which batches are sized "
+                   'to. Read from the latest block by default. Also sizes '
+                   'the batches of --plan-only.')
+  args = parser.parse_args()
+  if args.sync and not args.journal:
+    parser.error('--sync needs the --journal of a previous import.')
+  if args.snapshot and args.rpc:
+    parser.error("Only local test chains can be snapshotted.")
+  if args.sync and (args.plan_only or args.from_plan):
+    parser.error("Syncs can't be planned; they depend on the chain.")
+
+  telemetry = ImportTelemetry(args.log_level, args.telemetry,
+                              args.report_interval)
+  telemetry.Info("Loading schema...")
+  schema = LoadSchemaIndex(args.schema, args.schema_cache)
+  telemetry.Info("Loaded %d item definitions.", len(schema.items_by_defindex))
+  # TODO(drblue): Do more parsing on the schema file.
+
+  if args.plan_only:
+    planner = PlanTransport(args.gas_limit)
+    loader = BackpackLoader(planner, schema,
+                            recipient=tester.a1.encode('hex'),
+                            telemetry=telemetry)
+    loader.ImportItems(IterBackpackItems(args.backpack, telemetry.Progress))
+    WritePlan(args.plan_only, planner, schema.sha1)
+    telemetry.Finish()
+    telemetry.Info(planner.Report())
+    telemetry.Info("Wrote plan to '%s'.", args.plan_only)
+    return
+
+  plan = None
+  if args.from_plan:
+    plan = LoadPlan(args.from_plan)
+    if plan['schema_sha1'] != schema.sha1:
+      parser.error("'%s' was planned against a different schema." %
+                   args.from_plan)
+
+  journal = None
+  checkpoint_path = None
+  if args.journal:
+    journal = ImportJournal(args.journal)
+    checkpoint_path = args.journal + '.chain'
+
+  if args.sync and not os.path.exists(checkpoint_path):
+    parser.error("No checkpoint found at '%s'." % checkpoint_path)
+
+  if args.rpc:
+    options = {'connections': args.connections,
+               'max_in_flight': args.in_flight, 'gas_price': args.gas_price,
+               'gas_limit': args.gas_limit}
+    if args.owner_key:
+      options['default_key'] = args.owner_key.decode('hex')
+    transport, generation = OpenRpcChain(args.rpc, checkpoint_path,
+                                         args.contract, telemetry=telemetry,
+                                         **options)
+  else:
+    s, c, generation = OpenChain(checkpoint_path, telemetry)
+    transport = TesterTransport(s, c)
+  if plan and plan['gas_limit'] > transport.gas_limit:
+    parser.error("'%s' was planned for blocks of %d gas, but this chain's "
+                 "hold %d." % (args.from_plan, plan['gas_limit'],
+                               transport.gas_limit))
+  if not StampSchemaVersion(transport, schema):
+    parser.error("The chain has a different schema; update it with "
+                 "schema_delta.py first.")
+
+  if journal:
+    journal.Open(generation)
+    telemetry.Info("Journal has %d items already imported.",
+                   len(journal.items))
+
+  loader = BackpackLoader(transport, schema, journal=journal,
+                          checkpoint_path=checkpoint_path, telemetry=telemetry)
+  if plan:
+    telemetry.Info("Making %d planned calls...", len(plan['calls']))
+    loader.ExecutePlan(plan['calls'])
+  else:
+    telemetry.Info("Streaming backpack from '%s'...", args.backpack)
+    items = IterBackpackItems(args.backpack, telemetry.Progress)
+    if args.sync:
+      loader.Sync(items)
+    else:
+      loader.ImportItems(items)
+  telemetry.Finish()
+  telemetry.Info(transport.Report())
+
+  if args.snapshot:
+    item_ids = loader.item_ids
+    if journal:
+      item_ids = dict((source_id, record['new_id'])
+                      for source_id, record in journal.items.iteritems())
+    SaveWorld(s, args.snapshot, transport.address, item_ids)
+    telemetry.Info("Saved world with %d items to '%s'.", len(item_ids),
+                   args.snapshot)
+
+
+if __name__ == '__main__':
+  main()
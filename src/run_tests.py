@@ -0,0 +1,237 @@
+#!/usr/bin/python
+#
+# Copyright 2015 Dr. Blue.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##############################################################################
+#
+# Runs backpack_tests.py across a pool of worker processes.
+#
+# Every test spends its time executing pyethereum, which is pure python, so
+# the suite is bound to one core when run through unittest directly. Test
+# classes share their world through setUpClass, so we hand out whole classes:
+# each worker imports the suite, with its own FileContractStore build and test
+# chain, and runs the classes it is given. The results and per test timings
+# are merged into one report.
+#
+# With --timings, each run's class timings are saved, and the next run starts
+# the slowest classes first so one long class doesn't finish last.
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+import unittest
+from contract_profiler import GetProfiler
+
+kTestModule = 'backpack_tests'
+
+
+# Returns the names of the test classes in the suite, in file order.
+def TestClassNames():
+  module = __import__(kTestModule)
+  names = []
+  for test in unittest.defaultTestLoader.loadTestsFromModule(module):
+    for case in test:
+      name = case.__class__.__name__
+      if not name in names:
+        names.append(name)
+  return names
+
+
+# A TestResult which records the outcome and wall time of each test as plain
+# data, so it can be sent back from a worker.
+class _RecordingResult(unittest.TestResult):
+  def __init__(self):
+    unittest.TestResult.__init__(self)
+    self.records = []
+    self._start = None
+
+  def startTest(self, test):
+    unittest.TestResult.startTest(self, test)
+    self._start = time.time()
+    self.records.append({'test': test._testMethodName, 'outcome': 'ok',
+                         'seconds': 0.0, 'details': None})
+
+  def stopTest(self, test):
+    unittest.TestResult.stopTest(self, test)
+    self.records[-1]['seconds'] = time.time() - self._start
+
+  def _Record(self, outcome, test, err):
+    details = self._exc_info_to_string(err, test)
+    # Errors in setUpClass aren't reported against a test of their own.
+    if isinstance(test, unittest.TestCase) and self.records and (
+        self.records[-1]['test'] == test._testMethodName):
+      self.records[-1].update(outcome=outcome, details=details)
+    else:
+      self.records.append({'test': str(test), 'outcome': outcome,
+                           'seconds': 0.0, 'details': details})
+
+  def addError(self, test, err):
+    unittest.TestResult.addError(self, test, err)
+    self._Record('error', test, err)
+
+  def addFailure(self, test, err):
+    unittest.TestResult.addFailure(self, test, err)
+    self._Record('failure', test, err)
+
+  def addSkip(self, test, reason):
+    unittest.TestResult.addSkip(self, test, reason)
+    self.records[-1].update(outcome='skipped', details=reason)
+
+
+# Runs the test class |name| in a worker, and returns a dict of its results.
+def RunTestClass(name):
+  result = {'class': name, 'tests': [], 'seconds': 0.0, 'error': None}
+  start = time.time()
+  try:
+    module = __import__(kTestModule)
+    suite = unittest.defaultTestLoader.loadTestsFromTestCase(
+        getattr(module, name))
+    recorder = _RecordingResult()
+    suite.run(recorder)
+    result['tests'] = recorder.records
+  except Exception:
+    result['error'] = traceback.format_exc()
+  result['seconds'] = time.time() - start
+
+  # Workers don't run atexit handlers, so send the profile back to be
+  # merged and written by the parent.
+  profiler = GetProfiler()
+  if profiler:
+    result['profile'] = profiler.stats
+    profiler.stats = {}
+  return result
+
+
+def LoadTimings(path):
+  if not path or not os.path.exists(path):
+    return {}
+  with open(path) as f:
+    return json.load(f).get('classes', {})
+
+
+def PrintReport(results, wall_seconds, slowest):
+  tests = [(r['class'], t) for r in results for t in r['tests']]
+  failed = [(c, t) for c, t in tests if t['outcome'] in ('error', 'failure')]
+  broken = [r for r in results if r['error']]
+
+  for c, t in failed:
+    print '=' * 70
+    print '%s: %s.%s' % (t['outcome'].upper(), c, t['test'])
+    print '-' * 70
+    print t['details']
+  for r in broken:
+    print '=' * 70
+    print 'ERROR: could not run %s' % r['class']
+    print '-' * 70
+    print r['error']
+
+  print "%-28s %6s %9s" % ('class', 'tests', 'seconds')
+  for r in sorted(results, key=lambda r: -r['seconds']):
+    print "%-28s %6d %9.2f" % (r['class'], len(r['tests']), r['seconds'])
+
+  if slowest:
+    print
+    print "Slowest tests:"
+    tests.sort(key=lambda (c, t): -t['seconds'])
+    for c, t in tests[:slowest]:
+      print "  %7.2fs %s.%s" % (t['seconds'], c, t['test'])
+
+  serial = sum(r['seconds'] for r in results)
+  print
+  print "Ran %d tests in %.1fs (%.1fs of work, %.1fx)." % (
+      len(tests), wall_seconds, serial,
+      serial / wall_seconds if wall_seconds else 0.0)
+  if failed or broken:
+    print "FAILED (%d failed, %d classes could not run)" % (len(failed),
+                                                           len(broken))
+  else:
+    print "OK"
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description='Runs the backpack test suite in parallel, one test class '
+      'at a time per worker.')
+  parser.add_argument('classes', nargs='*',
+                      help='Only run these test classes.')
+  parser.add_argument('--jobs', type=int, default=multiprocessing.cpu_count(),
+                      help='How many test classes to run at once.')
+  parser.add_argument('--timings',
+                      help='Read class timings from this file to schedule '
+                      'the slowest classes first, and write the new timings '
+                      'back to it.')
+  parser.add_argument('--slowest', type=int, default=10,
+                      help='List this many of the slowest tests.')
+  parser.add_argument('--results',
+                      help='Also write the per test results to this file as '
+                      'json.')
+  args = parser.parse_args()
+
+  names = TestClassNames()
+  if args.classes:
+    unknown = set(args.classes) - set(names)
+    if unknown:
+      parser.error("No such test classes: %s" % ', '.join(sorted(unknown)))
+    names = [n for n in names if n in args.classes]
+
+  # Start the slowest classes first; classes we haven't timed yet go first of
+  # all, since we don't know how long they take.
+  timings = LoadTimings(args.timings)
+  names.sort(key=lambda n: -timings.get(n, float('inf')))
+
+  start = time.time()
+  pool = multiprocessing.Pool(min(args.jobs, len(names)) or 1)
+  results = []
+  try:
+    for result in pool.imap_unordered(RunTestClass, names):
+      results.append(result)
+      if 'profile' in result:
+        GetProfiler().Merge(result.pop('profile'))
+      outcomes = [t['outcome'] for t in result['tests']]
+      ok = not result['error'] and all(o in ('ok', 'skipped')
+                                       for o in outcomes)
+      print "[%d/%d] %s: %d tests, %.1fs%s" % (
+          len(results), len(names), result['class'], len(outcomes),
+          result['seconds'], '' if ok else ', FAILED')
+    pool.close()
+  except KeyboardInterrupt:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+  wall_seconds = time.time() - start
+
+  PrintReport(results, wall_seconds, args.slowest)
+
+  if args.timings:
+    timings.update((r['class'], r['seconds']) for r in results)
+    with open(args.timings, 'w') as f:
+      json.dump({'classes': timings}, f, indent=2, sort_keys=True)
+  if args.results:
+    with open(args.results, 'w') as f:
+      json.dump({'classes': results, 'seconds': wall_seconds}, f, indent=2)
+
+  if any(r['error'] for r in results) or any(
+      t['outcome'] in ('error', 'failure')
+      for r in results for t in r['tests']):
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,203 @@
+#!/usr/bin/python
+#
+# Copyright 2015 Dr. Blue.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##############################################################################
+#
+# Brings the schema on chain up to date with a new tf2_schema.json.
+#
+# Valve ships schema updates all the time, and most of them touch a handful of
+# items. Instead of uploading everything again, we diff the old and new schema
+# by defindex and only send what changed: new and renamed attributes, new items
+# and items whose level range changed, and the int attributes added to,
+# changed on or removed from item schemas. The contract records the sha1 of
+# the schema it was last brought up to date with, so we can refuse to apply a
+# delta against the wrong base.
+#
+# Items and attributes that were removed from the schema are left on chain;
+# existing items may still refer to them.
+
+import argparse
+import os
+import chain_state
+from chain_transport import TesterTransport
+from import_journal import ImportJournal
+from load_backpack import (BackpackLoader, Chunks, kSetAttributeGas,
+                           kSetItemSchemaGas)
+from schema_index import LoadSchemaIndex, OnChainVersion, kNoVersion
+from tf2_schema import IntSchemaAttributes
+
+
+class SchemaDelta(object):
+  def __init__(self):
+    # Maps attribute defindex to name, for new and renamed attributes.
+    self.attributes = {}
+
+    # Maps item defindex to (min_ilevel, max_ilevel), for new items and items
+    # whose level range changed.
+    self.item_schemas = {}
+
+    # Lists of (item defindex, attribute defindex, value) to set on item
+    # schemas, and of (item defindex, attribute defindex) to remove from them.
+    self.added_int_attributes = []
+    self.removed_int_attributes = []
+
+  def IsEmpty(self):
+    return not (self.attributes or self.item_schemas or
+                self.added_int_attributes or self.removed_int_attributes)
+
+  def Summary(self):
+    return ("%d attributes, %d item schemas, %d schema attributes set, "
+            "%d removed" % (len(self.attributes), len(self.item_schemas),
+                            len(self.added_int_attributes),
+                            len(self.removed_int_attributes)))
+
+
+# Diffs the schemas |old| and |new|. When |live_items| and |live_attributes|
+# are given, only those item and attribute defindexes are on chain, and
+# everything else is left for the loader to upload when an item needs it.
+def DiffSchemas(old, new, live_items=None, live_attributes=None):
+  delta = SchemaDelta()
+
+  for defindex in new.attributes_by_defindex:
+    if live_attributes is not None and not defindex in live_attributes:
+      continue
+    name = new.attributes_by_defindex[defindex]['name']
+    old_attribute = old.attributes_by_defindex.get(defindex)
+    if old_attribute is None or old_attribute['name'] != name:
+      delta.attributes[defindex] = name
+
+  for defindex in new.items_by_defindex:
+    if live_items is not None and not defindex in live_items:
+      continue
+    item = new.items_by_defindex[defindex]
+    old_item = old.items_by_defindex.get(defindex)
+    levels = (item['min_ilevel'], item['max_ilevel'])
+    if (old_item is None or
+        levels != (old_item['min_ilevel'], old_item['max_ilevel'])):
+      delta.item_schemas[defindex] = levels
+
+    # Uploading an item schema uploads the attributes it inherits, so any
+    # attribute it now refers to has to be defined.
+    if live_attributes is not None:
+      for a in item.get('attributes', []):
+        attribute = new.attributes_by_name.get(a['name'])
+        if (attribute is not None and
+            not attribute['defindex'] in live_attributes):
+          delta.attributes[attribute['defindex']] = attribute['name']
+
+    attributes = IntSchemaAttributes(new, item)
+    old_attributes = {}
+    if old_item is not None:
+      old_attributes = IntSchemaAttributes(old, old_item)
+    for a in sorted(attributes):
+      if old_attributes.get(a) != attributes[a]:
+        delta.added_int_attributes.append((defindex, a, attributes[a]))
+    for a in sorted(old_attributes):
+      if not a in attributes:
+        delta.removed_int_attributes.append((defindex, a))
+
+  return delta
+
+
+# Sends |delta| to the chain through |loader|'s transport, and records that
+# the chain now has the schema with the hex |sha1|.
+def ApplyDelta(loader, delta, sha1):
+  transport = loader.transport
+  journal = loader.journal
+
+  attributes = sorted(delta.attributes)
+  for chunk in Chunks(attributes, kSetAttributeGas, loader.batch_gas):
+    transport.Call('SetAttributes',
+                   (chunk, "name", [delta.attributes[a][:32] for a in chunk]),
+                   estimate=kSetAttributeGas * len(chunk))
+    for a in chunk:
+      loader.loaded_attributes.add(a)
+      if journal:
+        journal.RecordAttribute(a)
+
+  schema_items = sorted(delta.item_schemas)
+  for chunk in Chunks(schema_items, kSetItemSchemaGas, loader.batch_gas):
+    transport.Call('SetItemSchemas',
+                   (chunk, [delta.item_schemas[d][0] for d in chunk],
+                    [delta.item_schemas[d][1] for d in chunk]),
+                   estimate=kSetItemSchemaGas * len(chunk))
+    for d in chunk:
+      loader.loaded_item_schema.add(d)
+      if journal:
+        journal.RecordSchemaItem(d)
+
+  for item, attribute, value in delta.added_int_attributes:
+    transport.Call('AddIntAttributeToItemSchema', (item, attribute, value))
+  for item, attribute in delta.removed_int_attributes:
+    transport.Call('RemoveIntAttributeFromItemSchema', (item, attribute))
+
+  transport.Call('SetSchemaVersion', (OnChainVersion(sha1),))
+  loader.Checkpoint()
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description='Uploads the changes between two versions of the TF2 '
+      'schema to the chain recorded in a load_backpack.py journal.')
+  parser.add_argument('old_schema')
+  parser.add_argument('new_schema')
+  parser.add_argument('--journal', required=True,
+                      help='The journal of the import to update.')
+  parser.add_argument('--schema-cache', default='build',
+                      help='Where to keep binary indexes of the schema.')
+  parser.add_argument('--all', action='store_true',
+                      help='Upload every changed item and attribute, not '
+                      'just the ones already on chain.')
+  parser.add_argument('--dry-run', action='store_true',
+                      help="Print the delta but don't apply it.")
+  args = parser.parse_args()
+
+  checkpoint_path = args.journal + '.chain'
+  if not os.path.exists(checkpoint_path):
+    parser.error("No checkpoint found at '%s'." % checkpoint_path)
+
+  print "Loading schemas..."
+  old = LoadSchemaIndex(args.old_schema, args.schema_cache)
+  new = LoadSchemaIndex(args.new_schema, args.schema_cache)
+
+  s, checkpoint = chain_state.LoadState(checkpoint_path)
+  c = chain_state.AttachContract(s, 'Backpack', checkpoint['contract'])
+  journal = ImportJournal(args.journal)
+  journal.Open(checkpoint['generation'])
+
+  live_version = c.GetSchemaVersion()
+  if live_version == OnChainVersion(new.sha1):
+    print "The chain already has this schema."
+    return
+  if live_version not in (kNoVersion, OnChainVersion(old.sha1)):
+    parser.error("The chain wasn't loaded from '%s'." % args.old_schema)
+
+  if args.all:
+    delta = DiffSchemas(old, new)
+  else:
+    delta = DiffSchemas(old, new, journal.schema_items, journal.attributes)
+  print "Delta: %s." % delta.Summary()
+  if args.dry_run:
+    return
+
+  loader = BackpackLoader(TesterTransport(s, c), new, journal=journal,
+                          checkpoint_path=checkpoint_path)
+  ApplyDelta(loader, delta, new.sha1)
+  print loader.transport.Report()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,378 @@
+# Copyright 2015 Dr. Blue.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##############################################################################
+#
+# A binary, memory mapped index of tf2_schema.json.
+#
+# The schema only changes when Valve ships an update, but parsing it and
+# building the lookup dictionaries is most of the loader's startup. So the
+# first time we see a schema we write out an index file named after the
+# schema's sha1, and afterwards we just mmap that.
+#
+# The file is a header followed by these sections:
+#
+#   items         fixed size item records
+#   item_attrs    fixed size records for the attributes on each schema item
+#   attributes    fixed size attribute records
+#   strings       a pool of utf-8 names, referenced by (offset, length)
+#   three open addressing hash tables, mapping item defindex, attribute
+#   defindex and attribute name to a record number plus one (zero is empty)
+#
+# A SchemaIndex answers the same lookups as tf2_schema.Schema, but reads each
+# record out of the mapping when it's asked for instead of keeping dicts.
+# Schema items come back as views over their record, which only decode a
+# field when it's read.
+
+import hashlib
+import mmap
+import os
+import struct
+import zlib
+from tf2_schema import LoadSchema
+
+kMagic = 'TF2SIDX1'
+
+# magic, then the item, item attribute and attribute counts, the string pool
+# size and the size of each of the three hash tables.
+kHeader = struct.Struct('<8sIIIIIII')
+
+# defindex, name offset, name length, min_ilevel, max_ilevel, attribute count,
+# first attribute.
+kItem = struct.Struct('<IIHHHHI')
+
+# name offset, name length, value kind, value. Values are stored as their
+# int64 or double bit pattern. Non numeric values come back as None; they
+# can't be put on chain anyway.
+kItemAttr = struct.Struct('<IHH8s')
+kNoValue, kIntValue, kFloatValue = 0, 1, 2
+
+# defindex, name offset, name length.
+kAttribute = struct.Struct('<IIH2x')
+
+kSlot = struct.Struct('<I')
+
+
+def _HashInt(value):
+  return (value * 2654435761) & 0xFFFFFFFF
+
+
+def _HashName(name):
+  return zlib.crc32(name) & 0xFFFFFFFF
+
+
+def _TableSize(count):
+  size = 8
+  while size < count * 2:
+    size *= 2
+  return size
+
+
+# Returns the contents of an open addressing hash table of |size| slots,
+# holding (hash, record number) |entries|.
+def _BuildTable(size, entries):
+  slots = [0] * size
+  mask = size - 1
+  for h, record in entries:
+    i = h & mask
+    while slots[i]:
+      i = (i + 1) & mask
+    slots[i] = record + 1
+  return ''.join(kSlot.pack(s) for s in slots)
+
+
+def _PackValue(value):
+  if isinstance(value, bool) or value is None:
+    return kNoValue, '\x00' * 8
+  if isinstance(value, (int, long)) and -2**63 <= value < 2**63:
+    return kIntValue, struct.pack('<q', value)
+  if isinstance(value, float):
+    return kFloatValue, struct.pack('<d', value)
+  return kNoValue, '\x00' * 8
+
+
+def _UnpackValue(kind, data):
+  if kind == kIntValue:
+    return struct.unpack('<q', data)[0]
+  if kind == kFloatValue:
+    return struct.unpack('<d', data)[0]
+  return None
+
+
+# Writes an index of the tf2_schema.Schema |schema| to |path|.
+def WriteIndex(schema, path):
+  strings = []
+  string_offsets = {}
+  pool_size = [0]
+
+  def AddString(s):
+    data = s.encode('utf-8')
+    offset = string_offsets.get(data)
+    if offset is None:
+      offset = pool_size[0]
+      string_offsets[data] = offset
+      strings.append(data)
+      pool_size[0] += len(data)
+    return offset, len(data)
+
+  items = []
+  item_attrs = []
+  for defindex in sorted(schema.items_by_defindex):
+    item = schema.items_by_defindex[defindex]
+    name_offset, name_length = AddString(item.get('name', u''))
+    attrs = item.get('attributes', [])
+    items.append(kItem.pack(defindex, name_offset, name_length,
+                            item.get('min_ilevel', 0),
+                            item.get('max_ilevel', 0),
+                            len(attrs), len(item_attrs)))
+    for a in attrs:
+      a_offset, a_length = AddString(a['name'])
+      kind, value = _PackValue(a.get('value'))
+      item_attrs.append(kItemAttr.pack(a_offset, a_length, kind, value))
+
+  attributes = []
+  attribute_names = []
+  for defindex in sorted(schema.attributes_by_defindex):
+    a = schema.attributes_by_defindex[defindex]
+    name_offset, name_length = AddString(a['name'])
+    attributes.append(kAttribute.pack(defindex, name_offset, name_length))
+    attribute_names.append(a['name'].encode('utf-8'))
+
+  item_table_size = _TableSize(len(items))
+  attribute_table_size = _TableSize(len(attributes))
+  item_defindexes = sorted(schema.items_by_defindex)
+  attribute_defindexes = sorted(schema.attributes_by_defindex)
+
+  tmp_path = path + '.tmp'
+  with open(tmp_path, 'wb') as f:
+    f.write(kHeader.pack(kMagic, len(items), len(item_attrs), len(attributes),
+                         pool_size[0], item_table_size, attribute_table_size,
+                         attribute_table_size))
+    f.write(''.join(items))
+    f.write(''.join(item_attrs))
+    f.write(''.join(attributes))
+    f.write(''.join(strings))
+    f.write(_BuildTable(item_table_size,
+                        [(_HashInt(d), i)
+                         for i, d in enumerate(item_defindexes)]))
+    f.write(_BuildTable(attribute_table_size,
+                        [(_HashInt(d), i)
+                         for i, d in enumerate(attribute_defindexes)]))
+    f.write(_BuildTable(attribute_table_size,
+                        [(_HashName(n), i)
+                         for i, n in enumerate(attribute_names)]))
+  os.rename(tmp_path, path)
+
+
+class _Table(object):
+  def __init__(self, count, lookup, keys):
+    self._count = count
+    self._lookup = lookup
+    self._keys = keys
+
+  def __getitem__(self, key):
+    value = self._lookup(key)
+    if value is None:
+      raise KeyError(key)
+    return value
+
+  def get(self, key, default=None):
+    value = self._lookup(key)
+    return default if value is None else value
+
+  def __contains__(self, key):
+    return self._lookup(key) is not None
+
+  def __len__(self):
+    return self._count
+
+  def __iter__(self):
+    return self._keys()
+
+
+# The fields of an item record, by name. 'attributes' is decoded separately.
+kItemRecordFields = {'defindex': 0, 'min_ilevel': 3, 'max_ilevel': 4}
+
+
+# A read only, dict like view of a schema item's record in |index|.
+class _ItemView(object):
+  __slots__ = ('_index', '_record')
+
+  def __init__(self, index, record):
+    self._index = index
+    self._record = record
+
+  def get(self, key, default=None):
+    if key in kItemRecordFields:
+      return self._record[kItemRecordFields[key]]
+    if key == 'name':
+      return self._index._String(self._record[1], self._record[2])
+    if key == 'attributes' and self._record[5]:
+      return self._index._ItemAttributes(self._record[6], self._record[5])
+    return default
+
+  def __getitem__(self, key):
+    value = self.get(key)
+    if value is None:
+      raise KeyError(key)
+    return value
+
+  def __contains__(self, key):
+    return self.get(key) is not None
+
+
+class SchemaIndex(object):
+  # |sha1| is the hash of the schema file the index was built from, if known.
+  def __init__(self, path, sha1=None):
+    self.sha1 = sha1
+    with open(path, 'rb') as f:
+      self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if (len(self._map) < kHeader.size or
+        kHeader.unpack_from(self._map, 0)[0] != kMagic):
+      self._map.close()
+      raise ValueError("'%s' isn't a schema index." % path)
+    (magic, item_count, item_attr_count, attribute_count, pool_size,
+     item_table_size, attribute_table_size,
+     name_table_size) = kHeader.unpack_from(self._map, 0)
+
+    self._items = kHeader.size
+    self._item_attrs = self._items + item_count * kItem.size
+    self._attributes = self._item_attrs + item_attr_count * kItemAttr.size
+    self._strings = self._attributes + attribute_count * kAttribute.size
+    self._item_table = self._strings + pool_size
+    self._attribute_table = self._item_table + item_table_size * kSlot.size
+    self._name_table = (self._attribute_table +
+                        attribute_table_size * kSlot.size)
+    self._item_table_size = item_table_size
+    self._attribute_table_size = attribute_table_size
+    self._name_table_size = name_table_size
+
+    self.items_by_defindex = _Table(
+        item_count, self._LookupItem,
+        lambda: (self._ItemRecord(i)[0] for i in xrange(item_count)))
+    self.attributes_by_defindex = _Table(
+        attribute_count, self._LookupAttribute,
+        lambda: (self._AttributeRecord(i)[0]
+                 for i in xrange(attribute_count)))
+    self.attributes_by_name = _Table(
+        attribute_count, self._LookupAttributeByName,
+        lambda: (self._String(*self._AttributeRecord(i)[1:])
+                 for i in xrange(attribute_count)))
+
+  def Close(self):
+    self._map.close()
+
+  def _String(self, offset, length):
+    start = self._strings + offset
+    return self._map[start:start + length].decode('utf-8')
+
+  # Walks a hash table, returning the first record number for which
+  # |matches| is true, or None.
+  def _Probe(self, table, size, h, matches):
+    mask = size - 1
+    i = h & mask
+    while True:
+      record = kSlot.unpack_from(self._map, table + i * kSlot.size)[0]
+      if record == 0:
+        return None
+      if matches(record - 1):
+        return record - 1
+      i = (i + 1) & mask
+
+  def _ItemRecord(self, i):
+    return kItem.unpack_from(self._map, self._items + i * kItem.size)
+
+  def _AttributeRecord(self, i):
+    return kAttribute.unpack_from(self._map,
+                                  self._attributes + i * kAttribute.size)
+
+  def _LookupItem(self, defindex):
+    i = self._Probe(self._item_table, self._item_table_size,
+                    _HashInt(defindex),
+                    lambda i: self._ItemRecord(i)[0] == defindex)
+    if i is None:
+      return None
+    return _ItemView(self, self._ItemRecord(i))
+
+  def _ItemAttributes(self, start, count):
+    attributes = []
+    for j in range(start, start + count):
+      a_offset, a_length, kind, value = kItemAttr.unpack_from(
+          self._map, self._item_attrs + j * kItemAttr.size)
+      attributes.append({'name': self._String(a_offset, a_length),
+                         'value': _UnpackValue(kind, value)})
+    return attributes
+
+  def _LookupAttribute(self, defindex):
+    i = self._Probe(self._attribute_table, self._attribute_table_size,
+                    _HashInt(defindex),
+                    lambda i: self._AttributeRecord(i)[0] == defindex)
+    if i is None:
+      return None
+    return self._AttributeDict(i)
+
+  def _LookupAttributeByName(self, name):
+    data = name.encode('utf-8')
+
+    def Matches(i):
+      _, offset, length = self._AttributeRecord(i)
+      start = self._strings + offset
+      return self._map[start:start + length] == data
+
+    i = self._Probe(self._name_table, self._name_table_size,
+                    _HashName(data), Matches)
+    if i is None:
+      return None
+    return self._AttributeDict(i)
+
+  def _AttributeDict(self, i):
+    defindex, name_offset, name_length = self._AttributeRecord(i)
+    return {'defindex': defindex,
+            'name': self._String(name_offset, name_length)}
+
+
+def SchemaHash(path):
+  digest = hashlib.sha1()
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(1 << 20), ''):
+      digest.update(block)
+  return digest.hexdigest()
+
+
+# What Backpack.GetSchemaVersion() returns before any schema was uploaded.
+kNoVersion = '\x00' * 32
+
+
+# Returns the schema version stored on chain for the schema with the hex
+# |sha1|. The raw digest is used since the hex one doesn't fit in a bytes32.
+def OnChainVersion(sha1):
+  return sha1.decode('hex').ljust(32, '\x00')
+
+
+# Returns a SchemaIndex for the schema file at |path|, building and caching
+# it in |cache_dir| if this version of the schema hasn't been seen before. A
+# cached index written in an older format is built again.
+def LoadSchemaIndex(path, cache_dir='build'):
+  sha1 = SchemaHash(path)
+  index_path = os.path.join(cache_dir, 'schema-%s.idx' % sha1)
+  if os.path.exists(index_path):
+    try:
+      return SchemaIndex(index_path, sha1)
+    except ValueError:
+      pass
+  elif not os.path.isdir(cache_dir):
+    os.makedirs(cache_dir)
+  WriteIndex(LoadSchema(path), index_path)
+  return SchemaIndex(index_path, sha1)
@@ -0,0 +1,90 @@
+# Copyright 2015 Dr. Blue.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##############################################################################
+#
+# Reads the parts of tf2_schema.json and backpack files that the loader uses.
+#
+# Both files are streamed with json_stream, and schema entries are cut down to
+# the handful of fields we upload as they're read, so we never hold the
+# localized names, descriptions, image urls, etc. of every item at once.
+
+import os
+from json_stream import IterArray
+
+# The fields of a schema item which we keep.
+kItemFields = ('defindex', 'name', 'min_ilevel', 'max_ilevel')
+
+
+def ProjectItem(item):
+  projected = dict((k, item[k]) for k in kItemFields if k in item)
+  if 'attributes' in item:
+    projected['attributes'] = [{'name': a['name'], 'value': a.get('value')}
+                               for a in item['attributes']]
+  return projected
+
+
+def ProjectAttribute(attribute):
+  return {'defindex': attribute['defindex'], 'name': attribute['name']}
+
+
+class Schema(object):
+  def __init__(self, items, attributes):
+    # When parsing the schema, the index into the array schema_json['items']
+    # does not match the 'defindex' position. So build up a defindex
+    # dictionary. (Since I don't think I can guarenetee that all defindexes
+    # are accounted for?)
+    self.attributes_by_defindex = {}
+    self.attributes_by_name = {}
+    self.items_by_defindex = {}
+    for item in items:
+      self.items_by_defindex[item['defindex']] = item
+    for a in attributes:
+      self.attributes_by_defindex[a['defindex']] = a
+      self.attributes_by_name[a['name']] = a
+
+
+# Returns a dict of attribute defindex to value for the int attributes which
+# the schema item |item| gives its items.
+def IntSchemaAttributes(schema, item):
+  attributes = {}
+  for a in item.get('attributes', []):
+    # TODO: As with item instances, only ints can be put on chain for now.
+    definition = schema.attributes_by_name.get(a['name'])
+    if definition is not None and type(a['value']) is int:
+      attributes[definition['defindex']] = a['value']
+  return attributes
+
+
+# Streams the schema file at |path| into a Schema. The file is read twice, once
+# per array, so that only the projected entries are ever held.
+def LoadSchema(path):
+  with open(path) as f:
+    items = [ProjectItem(i) for i in IterArray(f, ('result', 'items'))]
+  with open(path) as f:
+    attributes = [ProjectAttribute(a)
+                  for a in IterArray(f, ('result', 'attributes'))]
+  return Schema(items, attributes)
+
+
+# Yields the items of the backpack file at |path| one at a time. If given,
+# |progress| is called with the fraction of the file read so far before each
+# item is yielded.
+def IterBackpackItems(path, progress=None):
+  size = float(os.path.getsize(path)) if progress else 0
+  with open(path) as f:
+    for item in IterArray(f, ('result', 'items')):
+      if size:
+        progress(f.tell() / size)
+      yield item
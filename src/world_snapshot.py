@@ -0,0 +1,121 @@
+# Copyright 2015 Dr. Blue.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+##############################################################################
+#
+# Saves an imported world, so it can be set up again without reimporting it.
+#
+# Unlike chain_state, which keeps every trie node of every block so an import
+# can resume, a world snapshot only keeps the accounts: the code and storage
+# of the Backpack contract, and the nonce and balance of the tester accounts.
+# Loading one writes those into a fresh tester.state() and mines a block, so
+# the history behind the world is gone but its state is the same. The
+# snapshot also keeps the mapping from source item ids to ids on chain.
+#
+# Each snapshot records the sha1 of the contract's compiled bytecode. If the
+# contract has been rebuilt since, LoadWorld() raises StaleSnapshot rather
+# than hand back a world running old code.
+
+import cPickle as pickle
+import hashlib
+import os
+from chain_state import AttachContract
+from ethereum import tester
+
+# Bumped whenever the snapshot format changes.
+kSnapshotVersion = 1
+
+
+class StaleSnapshot(Exception):
+  pass
+
+
+# Returns the hex sha1 of the bytecode of the contract |name| compiled into
+# |build_dir|.
+def CodeHash(build_dir='build', name='Backpack'):
+  with open(os.path.join(build_dir, name + '.bin'), 'rb') as f:
+    return hashlib.sha1(f.read().strip()).hexdigest()
+
+
+# Returns the storage of the account |address| as a list of (key, value).
+def _Storage(block, address):
+  storage = []
+  for key, value in block.account_to_dict(address)['storage'].iteritems():
+    value = int(value[2:] or '0', 16)
+    if value:
+      storage.append((int(key[2:], 16), value))
+  storage.sort()
+  return storage
+
+
+def _Account(block, address, with_storage):
+  account = {
+      'nonce': block.get_nonce(address),
+      'balance': block.get_balance(address),
+  }
+  if with_storage:
+    account['code'] = block.get_code(address)
+    account['storage'] = _Storage(block, address)
+  return account
+
+
+# Writes the world in |s|, where the contract |name| lives at |address|, to
+# |path|. |item_ids| maps each imported item's source id to its id on chain.
+def SaveWorld(s, path, address, item_ids, build_dir='build', name='Backpack',
+              code_hash=None):
+  s.mine()
+  accounts = dict((a, _Account(s.block, a, False)) for a in tester.accounts)
+  accounts[address] = _Account(s.block, address, True)
+  data = {
+      'version': kSnapshotVersion,
+      'code_hash': code_hash or CodeHash(build_dir, name),
+      'name': name,
+      'address': address,
+      'accounts': accounts,
+      'item_ids': item_ids,
+  }
+
+  tmp_path = path + '.tmp'
+  with open(tmp_path, 'wb') as f:
+    pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+  os.rename(tmp_path, path)
+
+
+# Returns (state, contract, item_ids) for a world written by SaveWorld().
+# Raises StaleSnapshot if the contract compiled into |build_dir| isn't the one
+# the world was saved with.
+def LoadWorld(path, build_dir='build', code_hash=None):
+  with open(path, 'rb') as f:
+    data = pickle.load(f)
+  if data.get('version') != kSnapshotVersion:
+    raise StaleSnapshot("'%s' is a version %s snapshot; expected version %d" %
+                        (path, data.get('version'), kSnapshotVersion))
+  code_hash = code_hash or CodeHash(build_dir, data['name'])
+  if data['code_hash'] != code_hash:
+    raise StaleSnapshot("'%s' was saved with a different build of %s" %
+                        (path, data['name']))
+
+  s = tester.state()
+  block = s.block
+  for address, account in data['accounts'].iteritems():
+    block.set_nonce(address, account['nonce'])
+    block.set_balance(address, account['balance'])
+    if 'code' in account:
+      block.set_code(address, account['code'])
+      for key, value in account['storage']:
+        block.set_storage_data(address, key, value)
+  s.mine()
+
+  contract = AttachContract(s, data['name'], data['address'], build_dir)
+  return s, contract, data['item_ids']